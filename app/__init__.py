@@ -1,13 +1,19 @@
+import os
 from flask import Flask
 from flask_migrate import Migrate
-from app.extensions import limiter, db, flask_uuid
-from app.extensions import create_aws_client
+from app.extensions import limiter, db, flask_uuid, credential_cache, access_cache, \
+                           details_cache
+from app.extensions import job_runner
+from app.extensions import aws_clients
 from app.config import Config
+from app.assertions import schema_registry
+from app.services import http_client
+from app.policies import policy_templates
+from app import instrumentation
+from app import profiling
+from app.logs import log_pipeline
 from app.errors import handle_429_request, handle_wrong_method, handle_not_found
 
-import logging
-from logging.handlers import RotatingFileHandler
-
 def create_app(config_class=Config):
 
     app = Flask(__name__)
@@ -17,52 +23,79 @@ def create_app(config_class=Config):
     # initial flask extensions
     limiter.init_app(app)
     flask_uuid.init_app(app)
+    # time how long requests wait on the db connection pool
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = instrumentation.engine_options(
+        app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
     db.init_app(app)
     migrate = Migrate(app, db)
     migrate.init_app(app, db)
 
+    # request, aws call and query metrics
+    instrumentation.init_app(app)
+
+    # caches
+    credential_cache.configure(maxsize=app.config['CREDENTIAL_CACHE_SIZE'],
+                               ttl=app.config['CREDENTIAL_CACHE_TTL'])
+    access_cache.configure(maxsize=app.config['AUTH_CACHE_SIZE'],
+                           ttl=app.config['AUTH_CACHE_TTL'])
+    details_cache.configure(maxsize=app.config['DETAILS_CACHE_SIZE'],
+                            ttl=app.config['DETAILS_CACHE_TTL'])
+
+    # pooled http client for the access service
+    http_client.init_app(app)
+
+    # background pool for async provisioning
+    job_runner.init_app(app)
+
+    # compile json schema validators once
+    schema_registry.init_app(app)
+
+    # parse and check aws policy templates once
+    policy_templates.init_app(app)
+
     # blueprints
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
+    # opt in request profiling, a no-op unless PROFILE_DIR is set
+    profiling.init_app(app)
+
+    # cli commands
+    from app.commands import register_commands
+    register_commands(app)
+
     # register custom errors
     app.register_error_handler(429, handle_429_request)
     app.register_error_handler(405, handle_wrong_method)
     app.register_error_handler(404, handle_not_found)
 
-    # logging stuff
-    log_filename = app.config.get('LOG_FILENAME')
-    if log_filename:
-        formatter = logging.Formatter("[%(asctime)s] [%(pathname)s:%(lineno)d] %(levelname)s - %(message)s")
-        handler = RotatingFileHandler(app.config['LOG_FILENAME'], maxBytes=10000000, backupCount=5)
-        log_level = app.config['LOG_LEVEL']
-
-        if log_level == 'DEBUG': # pragma: no cover
-            app.logger.setLevel(logging.DEBUG) # pragma: no cover
-        elif log_level == 'INFO': # pragma: no cover
-            app.logger.setLevel(logging.INFO) # pragma: no cover
-        elif log_level == 'WARNING': # pragma: no cover
-            app.logger.setLevel(logging.WARNING) # pragma: no cover
-        elif log_level == 'ERROR': # pragma: no cover
-            app.logger.setLevel(logging.ERROR) # pragma: no cover
-        else: # pragma: no cover
-            app.logger.setLevel(logging.CRITICAL) # pragma: no cover
-
-        handler.setFormatter(formatter)
-        app.logger.addHandler(handler)
-
-    # aws stuff
-    iam, iam_error = create_aws_client("iam")
-    if iam_error:
-        app.logger.error("Could not create AWS 'iam' client [%s]", str(iam_error))
-    app.iam = iam
-    app.logger.debug("Created 'iam' client ✓")
-
-    s3, s3_error = create_aws_client("s3")
-    if s3_error:
-        app.logger.error("Could not create AWS 's3' client [%s]", str(s3_error))
-    app.s3 = s3
-    app.logger.debug("Created 's3' client ✓")
+    # logging stuff - records go through a queue to a listener thread
+    log_pipeline.init_app(app)
+
+    # aws clients are built on first use unless AWS_CLIENT_WARMUP names them
+    aws_clients.init_app(app)
+    aws_clients.warm_up()
 
     return app
 
+# -----------------------------------------------------------------------------
+# for an app created before a fork, i.e. gunicorn with preload_app (see
+# gunicorn.conf.py). boto3 clients and pooled db connections hold sockets
+# that mustn't be shared between processes so the worker makes its own
+
+def after_fork(app):
+
+    aws_clients.reset()
+    aws_clients.warm_up()
+
+    # cached presign credentials each hold an s3 client too
+    credential_cache.clear()
+
+    # close=False leaves the parent's connections alone for the parent
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    http_client.close()
+    job_runner.shutdown(wait=False)
+
+    app.logger.info("Rebuilt aws clients and db pool in worker [%s]", os.getpid())
@@ -0,0 +1,206 @@
+# app/asgi.py
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.exceptions import HTTPException
+from app.decorators import ACCESS_ENVIRON_KEY, cached_access_check_async
+from app.services import async_http_client
+
+# -----------------------------------------------------------------------------
+# asgi serving mode, run with gunicorn's asgi worker:
+#   gunicorn -k asgi --worker-connections 1000 asgi:app
+#
+# nearly all our time is spent waiting on the access service, postgres and
+# aws. the access check happens on every authenticated route so here it is
+# done on the event loop with the async http client, and only once it has
+# an answer does the request go to the normal flask app on a bounded thread
+# pool. the view's require_access_level picks up the answer from the environ
+# rather than asking again, so every route keeps its response contract, rate
+# limits, error handlers and metrics, and requests waiting on the access
+# service don't hold a thread. ASGI_THREADS bounds the requests in flask at
+# once, which should be about the size of the db pool, and
+# ASGI_HTTP_CONNECTIONS the access checks in flight. request bodies are read
+# into memory before flask sees them so anything over ASGI_MAX_BODY gets a 413
+# without being read any further
+# -----------------------------------------------------------------------------
+
+class AsgiApp(object):
+
+    def __init__(self, flask_app, threads=None):
+        self.flask_app = flask_app
+        self.threads = threads or flask_app.config['ASGI_THREADS']
+        self.max_body = flask_app.config['ASGI_MAX_BODY']
+        self._executor = None
+        async_http_client.init_app(flask_app)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads,
+                                                thread_name_prefix='asgi')
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError('unsupported asgi scope ['+scope['type']+']')
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({ 'type': 'lifespan.startup.complete' })
+            elif message['type'] == 'lifespan.shutdown':
+                if self._executor is not None:
+                    self._executor.shutdown(wait=True)
+                    self._executor = None
+                await async_http_client.aclose()
+                await send({ 'type': 'lifespan.shutdown.complete' })
+                return
+
+    # -------------------------------------------------------------------------
+
+    def access_level(self, environ):
+        # the level the matched view checks for, None if it doesn't check
+        adapter = self.flask_app.url_map.bind_to_environ(environ)
+        try:
+            endpoint, _ = adapter.match()
+        except HTTPException:
+            return None
+        view = self.flask_app.view_functions.get(endpoint)
+        return getattr(view, 'access_level', None)
+
+    async def _http(self, scope, receive, send):
+
+        loop = asyncio.get_running_loop()
+        body = await _read_body(receive, self.max_body)
+        if body is None:
+            await _too_large(send)
+            return
+        environ = build_environ(scope, body)
+
+        token = environ.get('HTTP_X_ACCESS_TOKEN')
+        level = self.access_level(environ) if token else None
+        if level is not None:
+            started = time.perf_counter()
+            result = await cached_access_check_async(self.flask_app, token, level)
+            environ[ACCESS_ENVIRON_KEY] = (level, result, time.perf_counter() - started)
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+            return lambda data: None
+
+        def run():
+            # the first two chunks come back with the call so a normal json
+            # response is a single trip to the pool
+            body = self.flask_app.wsgi_app(environ, start_response)
+            chunks = iter(body)
+            chunk = _advance(body, chunks)
+            following = _advance(body, chunks) if chunk is not None else None
+            return body, chunks, chunk, following
+
+        body, chunks, chunk, following = await loop.run_in_executor(self.executor, run)
+        try:
+            await send({ 'type': 'http.response.start',
+                         'status': response['status'],
+                         'headers': response['headers'] })
+            while True:
+                await send({ 'type': 'http.response.body',
+                             'body': chunk or b'',
+                             'more_body': following is not None })
+                if following is None:
+                    break
+                chunk = following
+                following = await loop.run_in_executor(self.executor, _advance, body, chunks)
+        finally:
+            if following is not None:
+                # the client went away part way through
+                await loop.run_in_executor(self.executor, _close, body)
+
+# -----------------------------------------------------------------------------
+# the body is closed (ending flask's request) before the last chunk is sent.
+# gunicorn's asgi worker can miss the next request on a kept alive connection
+# if the app is still busy after its final send
+
+def _advance(body, chunks):
+    chunk = next(chunks, None)
+    if chunk is None:
+        _close(body)
+    return chunk
+
+
+def _close(body):
+    if hasattr(body, 'close'):
+        body.close()
+
+# -----------------------------------------------------------------------------
+
+async def _read_body(receive, limit):
+    # the whole body, or None as soon as it is more than limit bytes
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+
+async def _too_large(send):
+    body = json.dumps({ 'message': 'Request body too large' }).encode('utf-8')
+    await send({ 'type': 'http.response.start',
+                 'status': 413,
+                 'headers': [(b'content-type', b'application/json'),
+                             (b'content-length', str(len(body)).encode('latin-1'))] })
+    await send({ 'type': 'http.response.body', 'body': body })
+
+
+def build_environ(scope, body):
+    # the wsgi environ for an asgi http scope, as per pep 3333
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = { 'REQUEST_METHOD': scope['method'],
+                'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+                'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+                'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+                'SERVER_NAME': str(server[0]),
+                'SERVER_PORT': str(server[1]),
+                'SERVER_PROTOCOL': 'HTTP/'+scope.get('http_version', '1.1'),
+                'REMOTE_ADDR': client[0],
+                'REMOTE_PORT': str(client[1]),
+                'CONTENT_LENGTH': str(len(body)),
+                'wsgi.version': (1, 0),
+                'wsgi.url_scheme': scope.get('scheme', 'http'),
+                'wsgi.input': io.BytesIO(body),
+                'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True,
+                'wsgi.multiprocess': True,
+                'wsgi.run_once': False }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+        if name in environ:
+            value = environ[name] + ',' + value
+        environ[name] = value
+    return environ
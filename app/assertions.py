@@ -1,25 +1,135 @@
 import os.path
+import re
 import json
-from jsonschema import validate, Draft7Validator
+import threading
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import best_match
 from jsonschema.exceptions import ValidationError as JsonValidationError
 
-def assert_valid_schema(data, schema_type):
-    # checks whether the given data matches the schema
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), 'schemas')
 
-    #TODO: get these from redis or similar - only get from disk first time
+# -----------------------------------------------------------------------------
+# validators for every schema in app/schemas are compiled once when the app is
+# created rather than being read from disk and rebuilt on every request
+# -----------------------------------------------------------------------------
 
-    if schema_type == 'urls':
-        schema = _load_json_schema('schemas/urls.json')
+class SchemaRegistry(object):
 
-    if schema_type == 'uuid':
-        schema = _load_json_schema('schemas/uuid.json')
+    def __init__(self, schema_dir=SCHEMA_DIR):
+        self.schema_dir = schema_dir
+        self.auto_reload = False
+        self._validators = {}
+        self._fast_checks = {}
+        self._mtimes = {}
+        self._lock = threading.Lock()
 
-    return validate(data, schema, format_checker=Draft7Validator.FORMAT_CHECKER)
+    def init_app(self, app):
+        self.auto_reload = app.config.get('SCHEMA_AUTO_RELOAD', False)
+        self.load()
 
+    def load(self):
+        validators = {}
+        fast_checks = {}
+        mtimes = {}
+        for filename in sorted(os.listdir(self.schema_dir)):
+            if not filename.endswith('.json'):
+                continue
+            name = filename[:-len('.json')]
+            filepath = os.path.join(self.schema_dir, filename)
+            mtimes[name] = os.path.getmtime(filepath)
+            schema = _load_json_schema(filepath)
+            Draft7Validator.check_schema(schema)
+            validators[name] = Draft7Validator(schema,
+                                               format_checker=Draft7Validator.FORMAT_CHECKER)
+            fast_check = _compile_uuid_array_check(schema)
+            if fast_check:
+                fast_checks[name] = fast_check
 
-def _load_json_schema(filename):
-    # loads the given schema file
-    filepath = os.path.join(os.path.dirname(__file__), filename)
+        with self._lock:
+            self._validators = validators
+            self._fast_checks = fast_checks
+            self._mtimes = mtimes
+
+    def _changed(self):
+        try:
+            current = { f[:-len('.json')]: os.path.getmtime(os.path.join(self.schema_dir, f))
+                        for f in os.listdir(self.schema_dir) if f.endswith('.json') }
+        except OSError: # pragma: no cover
+            return False
+        return current != self._mtimes
+
+    def validator(self, name):
+        if self.auto_reload and self._changed():
+            self.load()
+        return self._validators[name]
+
+    def validate(self, data, name):
+        validator = self.validator(name)
+
+        # the fast path can only say yes. anything it rejects goes through the
+        # full validator so error messages are exactly what jsonschema gives
+        fast_check = self._fast_checks.get(name)
+        if fast_check and fast_check(data):
+            return None
+
+        error = best_match(validator.iter_errors(data))
+        if error is not None:
+            raise error
+
+schema_registry = SchemaRegistry()
+
+# -----------------------------------------------------------------------------
 
+def assert_valid_schema(data, schema_type):
+    # checks whether the given data matches the schema
+    return schema_registry.validate(data, schema_type)
+
+# -----------------------------------------------------------------------------
+
+def _load_json_schema(filepath):
+    # loads the given schema file
     with open(filepath) as schema_file:
         return json.loads(schema_file.read())
+
+# -----------------------------------------------------------------------------
+
+def _compile_uuid_array_check(schema):
+    # hand rolled check for schemas shaped like urls.json - an object with a
+    # single required array of unique, fixed length patterned strings. returns
+    # None for any schema that doesn't have exactly that shape
+    try:
+        if schema.get('type') != 'object' or schema.get('additionalProperties') is not False:
+            return None
+        properties = schema['properties']
+        if len(properties) != 1 or schema.get('required') != list(properties):
+            return None
+        (field, array_schema), = properties.items()
+        if set(array_schema) - {'type', 'uniqueItems', 'minItems', 'maxItems', 'items'}:
+            return None
+        if array_schema['type'] != 'array' or not array_schema.get('uniqueItems'):
+            return None
+        items = array_schema['items']
+        if set(items) != {'type', 'minLength', 'maxLength', 'pattern'} or items['type'] != 'string':
+            return None
+        min_items = array_schema.get('minItems', 0)
+        max_items = array_schema['maxItems']
+        min_length = items['minLength']
+        max_length = items['maxLength']
+        pattern = re.compile(items['pattern'])
+    except (AttributeError, KeyError, TypeError, ValueError, re.error):
+        return None
+
+    def check(data):
+        if type(data) is not dict or len(data) != 1:
+            return False
+        values = data.get(field)
+        if type(values) is not list or not min_items <= len(values) <= max_items:
+            return False
+        for value in values:
+            if type(value) is not str or not min_length <= len(value) <= max_length:
+                return False
+            if not pattern.search(value):
+                return False
+        return len(set(values)) == len(values)
+
+    return check
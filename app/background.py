@@ -0,0 +1,45 @@
+# app/background.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# -----------------------------------------------------------------------------
+# in-process pool for work that shouldn't hold a request thread, e.g. aws
+# user provisioning. each worker process gets its own pool as threads don't
+# survive a fork. with zero workers jobs run inline, which is what tests use
+# -----------------------------------------------------------------------------
+
+class JobRunner(object):
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.shutdown(wait=False)
+        self.max_workers = app.config['PROVISIONING_WORKERS']
+
+    @property
+    def executor(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._pid != pid:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='jobs')
+                self._pid = pid
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.max_workers:
+            fn(*args, **kwargs)
+            return None
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+            self._pid = None
@@ -0,0 +1,101 @@
+# app/cache.py
+import threading
+import time
+from collections import OrderedDict
+
+# -----------------------------------------------------------------------------
+# small in-process cache used to avoid repeating db lookups, crypto and client
+# builds on hot paths. entries are evicted least recently used first once the
+# cache is full and are never returned once they are older than the ttl
+# -----------------------------------------------------------------------------
+
+class TTLCache(object):
+
+    def __init__(self, maxsize=1024, ttl=300, weigher=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # optional function giving the size in bytes of a value so memory
+        # used by the cache can be reported
+        self.weigher = weigher
+        self.weight = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize=None, ttl=None):
+        # called from create_app so settings come from config. any entries
+        # held from a previous app instance are dropped
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = int(maxsize)
+            if ttl is not None:
+                self.ttl = float(ttl)
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.weight = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires, value = entry
+            if expires <= now:
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, value)
+            if self.weigher:
+                self.weight += self.weigher(value)
+            while len(self._data) > self.maxsize:
+                self._remove(next(iter(self._data)))
+
+    def _remove(self, key):
+        # caller holds the lock
+        entry = self._data.pop(key, None)
+        if entry is not None and self.weigher:
+            self.weight -= self.weigher(entry[1])
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = { 'size': len(self._data),
+                      'maxsize': self.maxsize,
+                      'ttl': self.ttl,
+                      'hits': self.hits,
+                      'misses': self.misses,
+                      'hit_rate': round(self.hits / lookups, 4) if lookups else None }
+            if self.weigher:
+                stats['bytes'] = self.weight
+            return stats
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        # does not count towards hits or misses
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > time.monotonic()
@@ -0,0 +1,23 @@
+# app/checkpoint.py
+import json
+import os
+
+# -----------------------------------------------------------------------------
+# json checkpoint files for the long running cli commands (flask reconcile,
+# flask rotate-keys) so an interrupted or partial run carries on from where
+# it got to
+# -----------------------------------------------------------------------------
+
+def load_checkpoint(path):
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return {}
+
+def save_checkpoint(path, checkpoint):
+    # write then rename so a crash never leaves half a file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(temp_path, path)
@@ -0,0 +1,90 @@
+# app/clients.py
+import logging
+import os
+import threading
+import time
+
+# -----------------------------------------------------------------------------
+# boto3 clients built the first time something asks for them, so processes
+# that never talk to aws (flask db, the status route, most tests) don't pay
+# for importing boto3 or loading the service models. one client per service
+# per process - they are thread safe so every thread shares it, and a process
+# forked after they were built makes its own rather than sharing sockets.
+#
+# AWS_CLIENT_WARMUP=iam,s3 builds those clients up front instead, in
+# create_app or in each worker after a fork, so the first request doesn't
+# wait on them
+# -----------------------------------------------------------------------------
+
+class AwsClientError(Exception):
+    pass
+
+
+class AwsClients(object):
+
+    def __init__(self, factory):
+        # factory(service) returns (client, error) like create_aws_client
+        self.factory = factory
+        self.warmup = []
+        self.logger = logging.getLogger(__name__)
+        self._clients = {}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.warmup = [name.strip() for name in app.config['AWS_CLIENT_WARMUP'].split(',')
+                       if name.strip()]
+        self.logger = app.logger
+        # a new app gets new clients, as it always has
+        self.reset()
+
+    @property
+    def iam(self):
+        return self.get('iam')
+
+    @property
+    def s3(self):
+        return self.get('s3')
+
+    def get(self, service):
+
+        pid = os.getpid()
+        if self._pid == pid:
+            client = self._clients.get(service)
+            if client is not None:
+                return client
+
+        with self._lock:
+            if self._pid != pid:
+                # anything built before a fork belongs to the parent
+                self._clients = {}
+                self._pid = pid
+            client = self._clients.get(service)
+            if client is None:
+                started = time.perf_counter()
+                client, error = self.factory(service)
+                if error:
+                    self.logger.error("Could not create AWS '%s' client [%s]", service, str(error))
+                    # nothing is cached so the next caller tries again
+                    raise AwsClientError("could not create aws '"+service+"' client: "+str(error))
+                self._clients[service] = client
+                self.logger.debug("Created '%s' client in %.1fms ✓", service,
+                                  (time.perf_counter() - started) * 1000)
+        return client
+
+    def built(self):
+        # names of the clients this process has made so far
+        return sorted(self._clients) if self._pid == os.getpid() else []
+
+    def warm_up(self, services=None):
+        # a failure here is logged and left for the first real use to report
+        for service in (self.warmup if services is None else services):
+            try:
+                self.get(service)
+            except AwsClientError:
+                pass
+
+    def reset(self):
+        with self._lock:
+            self._clients = {}
+            self._pid = None
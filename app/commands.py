@@ -0,0 +1,179 @@
+# app/commands.py
+import click
+import json
+from flask.cli import with_appcontext
+
+# -----------------------------------------------------------------------------
+# flask cli commands - registered on the app in create_app
+# -----------------------------------------------------------------------------
+
+@click.command('provision-users')
+@click.argument('public_ids', nargs=-1)
+@click.option('--file', 'id_file', type=click.File('r'),
+              help='file with one public_id per line')
+@click.option('--concurrency', type=int, default=None,
+              help='users provisioned at the same time')
+@click.option('--batch-size', type=int, default=None,
+              help='rows written to the db per transaction')
+@click.option('--report', 'report_file', type=click.File('w'),
+              help='write the per id json report here')
+@with_appcontext
+def provision_users_command(public_ids, id_file, concurrency, batch_size, report_file):
+    """Create aws users and buckets for many public_ids."""
+
+    from app.main.bulk import provision_users
+
+    ids = list(public_ids)
+    if id_file:
+        ids.extend(line.strip() for line in id_file if line.strip())
+
+    if not ids:
+        raise click.UsageError('no public_ids given')
+
+    report = provision_users(ids, concurrency=concurrency, batch_size=batch_size)
+
+    for result in report['results']:
+        if result['status'] == 'failed':
+            click.echo('%s failed: %s' % (result['public_id'], result['error']), err=True)
+
+    if report_file:
+        json.dump(report, report_file, indent=2)
+
+    summary = report['summary']
+    click.echo('requested %(requested)d, created %(created)d, already existed %(exists)d, '
+               'failed %(failed)d in %(seconds).1fs' % summary)
+
+# -----------------------------------------------------------------------------
+
+@click.command('export-users')
+@click.option('--since', default=None,
+              help='only rows created on or after this iso 8601 date')
+@click.option('--include-secrets', is_flag=True, default=False,
+              help='include the encrypted access key columns')
+@click.option('--output', type=click.File('w'), default='-',
+              help='file to write to, defaults to stdout')
+@click.option('--batch-size', type=int, default=1000,
+              help='rows fetched from the db at a time')
+@with_appcontext
+def export_users_command(since, include_secrets, output, batch_size):
+    """Write aws_details as newline delimited json."""
+
+    from app.main.export import iter_ndjson, parse_since
+
+    if since:
+        try:
+            since = parse_since(since)
+        except ValueError:
+            raise click.BadParameter('must be an iso 8601 date', param_hint='--since')
+
+    count = 0
+    for line in iter_ndjson(since, include_secrets, batch_size):
+        output.write(line)
+        count += 1
+
+    click.echo('exported %d rows' % count, err=True)
+
+# -----------------------------------------------------------------------------
+
+@click.command('reconcile')
+@click.option('--repair', is_flag=True, default=False,
+              help='delete orphaned aws users and buckets and dangling rows')
+@click.option('--full', is_flag=True, default=False,
+              help='ignore the checkpoint and start from the beginning')
+@click.option('--checkpoint', 'checkpoint_path', default=None,
+              help='checkpoint file, defaults to RECONCILE_CHECKPOINT_FILE')
+@click.option('--page-size', type=int, default=None,
+              help='iam users, buckets and rows per page')
+@click.option('--max-pages', type=int, default=None,
+              help='pages of each to check this run')
+@click.option('--grace', 'grace_seconds', type=int, default=None,
+              help='ignore anything created in the last this many seconds')
+@click.option('--report', 'report_file', type=click.File('w'),
+              help='write the json report here')
+@with_appcontext
+def reconcile_command(repair, full, checkpoint_path, page_size, max_pages,
+                      grace_seconds, report_file):
+    """Find aws users and buckets with no db row and rows with no aws user."""
+
+    from flask import current_app
+    from app.checkpoint import load_checkpoint, save_checkpoint
+    from app.main.reconcile import reconcile
+
+    checkpoint_path = checkpoint_path or current_app.config['RECONCILE_CHECKPOINT_FILE']
+    checkpoint = {} if full else load_checkpoint(checkpoint_path)
+
+    # whatever got done is kept even if the run fails part way
+    try:
+        report = reconcile(checkpoint, repair=repair, page_size=page_size,
+                           max_pages=max_pages, grace_seconds=grace_seconds)
+    finally:
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    for error in report['errors']:
+        click.echo(error, err=True)
+
+    if report_file:
+        json.dump(report, report_file, indent=2)
+
+    scanned = report['scanned']
+    click.echo('checked %d iam users, %d buckets and %d rows in %.1fs' %
+               (scanned['iam_users'], scanned['buckets'], scanned['rows'], report['seconds']))
+    click.echo('orphan users %d, orphan buckets %d, dangling rows %d, missing buckets %d' %
+               (len(report['orphan_users']), len(report['orphan_buckets']),
+                len(report['dangling_rows']), len(report['missing_buckets'])))
+    if repair:
+        click.echo('repaired %d users, %d buckets and %d rows' %
+                   tuple(len(report['repaired'][key]) for key in
+                         ('orphan_users', 'orphan_buckets', 'dangling_rows')))
+    if not all(report['complete'].values()):
+        click.echo('not finished, run again to carry on from the checkpoint')
+
+# -----------------------------------------------------------------------------
+
+@click.command('rotate-keys')
+@click.option('--full', is_flag=True, default=False,
+              help='ignore the checkpoint and start from the beginning')
+@click.option('--checkpoint', 'checkpoint_path', default=None,
+              help='checkpoint file, defaults to ROTATE_CHECKPOINT_FILE')
+@click.option('--batch-size', type=int, default=None,
+              help='rows read and written per transaction')
+@click.option('--workers', type=int, default=None,
+              help='processes doing the crypto, 0 to do it in this one')
+@with_appcontext
+def rotate_keys_command(full, checkpoint_path, batch_size, workers):
+    """Re-encrypt every aws_details key pair with the newest FERNET_KEY."""
+
+    from flask import current_app
+    from app.checkpoint import load_checkpoint, save_checkpoint
+    from app.main.rotate import rotate_keys
+
+    checkpoint_path = checkpoint_path or current_app.config['ROTATE_CHECKPOINT_FILE']
+    checkpoint = {} if full else load_checkpoint(checkpoint_path)
+    if checkpoint.get('after') and not checkpoint.get('complete'):
+        click.echo('carrying on after [%s]' % checkpoint['after'])
+
+    def progress(checkpoint, report, seconds):
+        save_checkpoint(checkpoint_path, checkpoint)
+        click.echo('%d rows, %d re-encrypted, %.0f rows/s' %
+                   (report['scanned'], report['rotated'], report['scanned'] / seconds))
+
+    report = rotate_keys(checkpoint, batch_size=batch_size, workers=workers,
+                         progress=progress)
+    save_checkpoint(checkpoint_path, checkpoint)
+
+    for public_id in report['failed']:
+        click.echo('%s could not be decrypted with any key' % public_id, err=True)
+
+    click.echo('checked %d rows in %.1fs (%.0f rows/s): re-encrypted %d, already on key '
+               '[%s] %d, failed %d' % (report['scanned'], report['seconds'],
+                                       report['rows_per_second'], report['rotated'],
+                                       report['key_id'], report['current'],
+                                       len(report['failed'])))
+
+# -----------------------------------------------------------------------------
+
+def register_commands(app):
+    app.cli.add_command(provision_users_command)
+    app.cli.add_command(export_users_command)
+    app.cli.add_command(reconcile_command)
+    app.cli.add_command(rotate_keys_command)
@@ -4,6 +4,24 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# -----------------------------------------------------------------------------
+# db connection pool. pre ping tests each connection as it's checked out so
+# connections left dead by a postgres restart or failover are replaced rather
+# than failing the request, and recycle retires them before anything in
+# between (pgbouncer, a load balancer) times them out. sqlite, as used by the
+# tests and benchmarks, keeps flask-sqlalchemy's own pool settings
+
+def engine_options(uri):
+    if uri and uri.startswith('sqlite'):
+        return {}
+    return { 'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+             'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+             'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+             'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+             'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True') == 'True' }
+
+# -----------------------------------------------------------------------------
+
 class Config(object):
     # set app configs
     SECRET_KEY = os.getenv('SECRET_KEY')
@@ -11,19 +29,81 @@ class Config(object):
     FOTO_LIMIT_PER_PAGE = os.getenv('ADDRESS_LIMIT_PER_PAGE')
     LOG_FILENAME = os.getenv('LOG_FILENAME')
     LOG_LEVEL = os.getenv('LOG_LEVEL')
+    LOG_LEVELS = os.getenv('LOG_LEVELS')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10000000))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    LOG_QUEUE_POLICY = os.getenv('LOG_QUEUE_POLICY', 'drop')
+    LOG_QUEUE_TIMEOUT = float(os.getenv('LOG_QUEUE_TIMEOUT', 1.0))
     FERNET_KEY = os.getenv('FERNET_KEY')
+    FERNET_OLD_KEYS = os.getenv('FERNET_OLD_KEYS', '')
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
     AWS_REGION = os.getenv('AWS_REGION')
     AWS_ACCOUNT_ID = os.getenv('AWS_ACCOUNT_ID')
+    AWS_CLIENT_WARMUP = os.getenv('AWS_CLIENT_WARMUP', '')
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'True') == 'True'
+    RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI', 'memory://')
+    RATELIMIT_STRATEGY = os.getenv('RATELIMIT_STRATEGY', 'fixed-window')
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = int(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    PROFILE_DIR = os.getenv('PROFILE_DIR')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Profile')
+    PROFILE_SECRET = os.getenv('PROFILE_SECRET')
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 100))
+    CREDENTIAL_CACHE_SIZE = int(os.getenv('CREDENTIAL_CACHE_SIZE', 1024))
+    CREDENTIAL_CACHE_TTL = int(os.getenv('CREDENTIAL_CACHE_TTL', 300))
+    DETAILS_CACHE_SIZE = int(os.getenv('DETAILS_CACHE_SIZE', 10000))
+    DETAILS_CACHE_TTL = int(os.getenv('DETAILS_CACHE_TTL', 600))
+    PRESIGN_FAST_PATH = os.getenv('PRESIGN_FAST_PATH', 'True') == 'True'
+    SCHEMA_AUTO_RELOAD = os.getenv('SCHEMA_AUTO_RELOAD', 'False') == 'True'
+    AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+    AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 30))
+    AUTH_CACHE_NEGATIVE_TTL = int(os.getenv('AUTH_CACHE_NEGATIVE_TTL', 5))
+    AUTH_CACHE_STALE_TTL = int(os.getenv('AUTH_CACHE_STALE_TTL', 0))
+    HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 10))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 2.0))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 5.0))
+    HTTP_BREAKER_FAILURES = int(os.getenv('HTTP_BREAKER_FAILURES', 5))
+    HTTP_BREAKER_RESET = int(os.getenv('HTTP_BREAKER_RESET', 30))
+    ASGI_THREADS = int(os.getenv('ASGI_THREADS', 32))
+    ASGI_HTTP_CONNECTIONS = int(os.getenv('ASGI_HTTP_CONNECTIONS', 100))
+    ASGI_MAX_BODY = int(os.getenv('ASGI_MAX_BODY', 1048576))
+    PROVISIONING_ASYNC = os.getenv('PROVISIONING_ASYNC', 'False') == 'True'
+    PROVISIONING_WORKERS = int(os.getenv('PROVISIONING_WORKERS', 4))
+    PROVISIONING_JOB_STALE_SECONDS = int(os.getenv('PROVISIONING_JOB_STALE_SECONDS', 900))
+    PROVISIONING_STEP_WORKERS = int(os.getenv('PROVISIONING_STEP_WORKERS', 4))
+    BULK_PROVISIONING_CONCURRENCY = int(os.getenv('BULK_PROVISIONING_CONCURRENCY', 8))
+    BULK_PROVISIONING_BATCH_SIZE = int(os.getenv('BULK_PROVISIONING_BATCH_SIZE', 100))
+    RECONCILE_CHECKPOINT_FILE = os.getenv('RECONCILE_CHECKPOINT_FILE', 'reconcile_checkpoint.json')
+    RECONCILE_PAGE_SIZE = int(os.getenv('RECONCILE_PAGE_SIZE', 100))
+    RECONCILE_MAX_PAGES = int(os.getenv('RECONCILE_MAX_PAGES', 10))
+    RECONCILE_WORKERS = int(os.getenv('RECONCILE_WORKERS', 8))
+    RECONCILE_GRACE_SECONDS = int(os.getenv('RECONCILE_GRACE_SECONDS', 3600))
+    ROTATE_CHECKPOINT_FILE = os.getenv('ROTATE_CHECKPOINT_FILE', 'rotate_checkpoint.json')
+    ROTATE_BATCH_SIZE = int(os.getenv('ROTATE_BATCH_SIZE', 1000))
+    ROTATE_WORKERS = int(os.getenv('ROTATE_WORKERS', os.cpu_count() or 1))
+    USER_POLICY_TEMPLATE = os.getenv('USER_POLICY_TEMPLATE', 'standardpolicy')
+    BUCKET_POLICY_TEMPLATE = os.getenv('BUCKET_POLICY_TEMPLATE', 'bucket_policy')
+    READINESS_TIMEOUT = float(os.getenv('READINESS_TIMEOUT', 30))
+    READINESS_INITIAL_DELAY = float(os.getenv('READINESS_INITIAL_DELAY', 0.05))
+    READINESS_MAX_DELAY = float(os.getenv('READINESS_MAX_DELAY', 2))
 
 class TestConfig(Config):
     FOTO_LIMIT_PER_PAGE = "2"
     LOG_LEVEL = "DEBUG"
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    SQLALCHEMY_ENGINE_OPTIONS = {}
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     WTF_CSRF_ENABLED = False
     LOG_FILENAME = "/tmp/test.log"
+    PROVISIONING_WORKERS = 0
+    RATELIMIT_STORAGE_URI = 'memory://'
+    METRICS_DIR = None
+    PROFILE_DIR = None
@@ -0,0 +1,38 @@
+# app/crypto.py
+import hashlib
+from cryptography.fernet import Fernet, MultiFernet
+
+# -----------------------------------------------------------------------------
+# the aws key pair in aws_details is fernet encrypted. new values are always
+# encrypted with FERNET_KEY, and FERNET_OLD_KEYS (comma separated, newest
+# first) are still accepted when decrypting. to rotate: move the current key
+# to FERNET_OLD_KEYS, set a new FERNET_KEY, deploy, run flask rotate-keys and
+# once it has finished drop the old key
+# -----------------------------------------------------------------------------
+
+def fernet_keys(config):
+    old_keys = [key.strip() for key in (config.get('FERNET_OLD_KEYS') or '').split(',')
+                if key.strip()]
+    return [config['FERNET_KEY']] + old_keys
+
+
+def key_id(key):
+    # short fingerprint for logs and checkpoints, never the key itself
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return hashlib.sha256(key).hexdigest()[:12]
+
+# -----------------------------------------------------------------------------
+
+_suite = (None, None)
+
+def cipher_suite(config):
+    # parsing the keys on every call adds up on the presign path so the
+    # MultiFernet is kept until the keys change
+    global _suite
+    keys = tuple(fernet_keys(config))
+    cached_keys, suite = _suite
+    if cached_keys != keys:
+        suite = MultiFernet([Fernet(key) for key in keys])
+        _suite = (keys, suite)
+    return suite
@@ -1,14 +1,23 @@
 # app/decorators.py
-#from app.services import call_requests
+from app.services import call_requests, async_http_client
 import requests
 from functools import wraps
+import asyncio
+import hashlib
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from flask import jsonify
 from flask import current_app as appy
+from app.extensions import access_cache
+from app.instrumentation import auth_check_latency
 
 load_dotenv()
 
+# (access level, result, seconds taken) put in the wsgi environ by app/asgi.py
+ACCESS_ENVIRON_KEY = 'poptape.access'
+
 # -----------------------------------------------------------------------------
 # these are separate from the views so we can mock them more easily  in tests
 # -----------------------------------------------------------------------------
@@ -48,21 +57,201 @@ def require_access_level(access_level,request): # pragma: no cover
             url = os.getenv('CHECK_ACCESS_URL')+str(access_level)
             appy.logger.debug('FULL CHECK ACCESS URL IS [%s]', url)
 
-            try:
-                r = requests.get(url, headers=headers)
-            except Exception as err:
-                appy.logger.error(str(err))
+            resolved = request.environ.get(ACCESS_ENVIRON_KEY)
+            if resolved and resolved[0] == access_level:
+                # already checked without blocking by the asgi server
+                _, result, waited = resolved
+                started = time.perf_counter() - waited
+            else:
+                started = time.perf_counter()
+                result = _cached_access_check(token, access_level, url, headers)
+
+            if result is None:
+                auth_check_latency.observe('unavailable', time.perf_counter() - started)
+                return jsonify({ 'message': 'Access service unavailable, try again later'}), 503
 
-            if r.status_code != 200:
+            if not result[0]:
+                auth_check_latency.observe('denied', time.perf_counter() - started)
                 return jsonify({ 'message': 'Ooh you are naughty!'}), 401
 
-            returned_json = r.json()
+            auth_check_latency.observe('allowed', time.perf_counter() - started)
 
-            if 'public_id' in returned_json:
-                pub_id = returned_json['public_id']
+            pub_id = result[1]
+
+            if pub_id:
                 return f(pub_id, request, *args, **kwargs)
 
             return jsonify({ 'message': 'No public_id returned'}), 401
 
+        # lets the asgi server see which routes need an access check
+        decorated.access_level = access_level
         return decorated
     return actual_decorator 
+
+# -----------------------------------------------------------------------------
+# access check results are cached for a short time so a burst of calls from one
+# logged in user costs one round trip to the access service. entries are keyed
+# on a hash of the token and access level so raw tokens aren't kept in memory
+# -----------------------------------------------------------------------------
+
+def _access_cache_key(token, access_level):
+    return hashlib.sha256((token+'|'+str(access_level)).encode('utf-8')).hexdigest()
+
+# -----------------------------------------------------------------------------
+
+def _check_access(url, headers, logger):
+    # returns (authorised, public_id) or None if the access service
+    # couldn't be asked
+
+    try:
+        r = call_requests(url, headers)
+    except Exception as err:
+        logger.error(str(err))
+        return None
+
+    if r.status_code >= 500:
+        logger.error('Access service returned [%s]', r.status_code)
+        return None
+
+    if r.status_code != 200:
+        return (False, None)
+
+    returned_json = r.json()
+
+    return (True, returned_json.get('public_id'))
+
+# -----------------------------------------------------------------------------
+
+def _store_access_result(key, result, ttls):
+
+    fresh_ttl, negative_ttl, stale_ttl = ttls
+
+    if result is None:
+        # the access service wasn't reached - never cache that
+        return
+
+    if result[0] and result[1]:
+        access_cache.set(key, (time.monotonic() + fresh_ttl, result),
+                         ttl=fresh_ttl + stale_ttl)
+    elif negative_ttl:
+        access_cache.set(key, (time.monotonic() + negative_ttl, result),
+                         ttl=negative_ttl)
+
+# -----------------------------------------------------------------------------
+
+def _revalidate(key, url, headers, ttls, logger):
+    try:
+        _store_access_result(key, _check_access(url, headers, logger), ttls)
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+# -----------------------------------------------------------------------------
+
+def _cached_access_check(token, access_level, url, headers):
+
+    ttls = (appy.config['AUTH_CACHE_TTL'],
+            appy.config['AUTH_CACHE_NEGATIVE_TTL'],
+            appy.config['AUTH_CACHE_STALE_TTL'])
+
+    if not ttls[0]:
+        return _check_access(url, headers, appy.logger)
+
+    key = _access_cache_key(token, access_level)
+    entry = access_cache.get(key)
+
+    if entry:
+        fresh_until, result = entry
+        if time.monotonic() < fresh_until:
+            return result
+
+        # past its ttl but inside the stale window - serve it and refresh in
+        # the background, once per key
+        with _revalidating_lock:
+            start = key not in _revalidating
+            _revalidating.add(key)
+        if start:
+            threading.Thread(target=_revalidate,
+                             args=(key, url, headers, ttls, appy.logger),
+                             daemon=True).start()
+        return result
+
+    result = _check_access(url, headers, appy.logger)
+    _store_access_result(key, result, ttls)
+
+    return result
+
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+# -----------------------------------------------------------------------------
+# the same check and cache for the asgi server, run on its event loop. there's
+# no app context there so the flask app is passed in
+# -----------------------------------------------------------------------------
+
+async def _check_access_async(url, headers, logger):
+
+    try:
+        r = await async_http_client.get(url, headers=headers)
+    except Exception as err:
+        logger.error(str(err))
+        return None
+
+    if r.status_code >= 500:
+        logger.error('Access service returned [%s]', r.status_code)
+        return None
+
+    if r.status_code != 200:
+        return (False, None)
+
+    returned_json = r.json()
+
+    return (True, returned_json.get('public_id'))
+
+# -----------------------------------------------------------------------------
+
+async def _revalidate_async(key, url, headers, ttls, logger):
+    try:
+        _store_access_result(key, await _check_access_async(url, headers, logger), ttls)
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+# -----------------------------------------------------------------------------
+
+async def cached_access_check_async(flask_app, token, access_level):
+
+    headers = { 'Content-Type': 'application/json', 'x-access-token': token }
+    url = os.getenv('CHECK_ACCESS_URL')+str(access_level)
+    ttls = (flask_app.config['AUTH_CACHE_TTL'],
+            flask_app.config['AUTH_CACHE_NEGATIVE_TTL'],
+            flask_app.config['AUTH_CACHE_STALE_TTL'])
+
+    if not ttls[0]:
+        return await _check_access_async(url, headers, flask_app.logger)
+
+    key = _access_cache_key(token, access_level)
+    entry = access_cache.get(key)
+
+    if entry:
+        fresh_until, result = entry
+        if time.monotonic() < fresh_until:
+            return result
+
+        with _revalidating_lock:
+            start = key not in _revalidating
+            _revalidating.add(key)
+        if start:
+            task = asyncio.ensure_future(
+                _revalidate_async(key, url, headers, ttls, flask_app.logger))
+            _revalidating_tasks.add(task)
+            task.add_done_callback(_revalidating_tasks.discard)
+        return result
+
+    result = await _check_access_async(url, headers, flask_app.logger)
+    _store_access_result(key, result, ttls)
+
+    return result
+
+# the loop only keeps weak references to tasks
+_revalidating_tasks = set()
@@ -1,6 +1,7 @@
 # app/errors.py
 
 from flask import jsonify
+from app.instrumentation import ratelimit_rejections, current_route
 
 # -----------------------------------------------------------------------------
 # any custom errors can be put here
@@ -9,6 +10,7 @@ from flask import jsonify
 # register global too many requests handler - useful for
 # returning json when limit in limiter is reached
 def handle_429_request(e):
+    ratelimit_rejections.inc(current_route())
     return jsonify({ 'message': 'chill out and give it a rest man' }), 429
 
 def handle_wrong_method(e):
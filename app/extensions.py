@@ -3,9 +3,12 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_uuid import FlaskUUID
-import boto3
-from botocore.client import Config
-from botocore.exceptions import ClientError
+from app.cache import TTLCache
+from app.background import JobRunner
+from app.ratelimit import SharedMemoryStorage # registers the mmap:// storage
+from app.instrumentation import instrument_client
+from app.clients import AwsClients
+from botocore.exceptions import ClientError, BotoCoreError
 import os
 
 # -----------------------------------------------------------------------------
@@ -21,22 +24,55 @@ flask_uuid = FlaskUUID()
 # set up SQL alchemy
 db = SQLAlchemy()
 
+# -----------------------------------------------------------------------------
+# per user decrypted credentials and s3 client used for presigning, keyed by
+# public_id. sized and timed from config in create_app
+credential_cache = TTLCache()
+
+# -----------------------------------------------------------------------------
+# encoded json responses for aws user details keyed by public_id. values are
+# dicts of bytes per view so the size held can be reported
+details_cache = TTLCache(weigher=lambda views: sum(len(body) for body in views.values()))
+
+# -----------------------------------------------------------------------------
+# results from the access service keyed by a hash of token and access level
+access_cache = TTLCache()
+
+# -----------------------------------------------------------------------------
+# background pool for async provisioning jobs
+job_runner = JobRunner()
+
 # -----------------------------------------------------------------------------
 # c r e a t e    a m a z o n    b o t o    c l i e n t 
 # -----------------------------------------------------------------------------
 
+def aws_retry_config():
+    # adaptive mode rate limits on the client side once aws starts throttling
+    # us, which matters when provisioning many users at once
+    return { 'mode': os.getenv('AWS_RETRY_MODE', 'adaptive'),
+             'max_attempts': int(os.getenv('AWS_MAX_ATTEMPTS', 10)) }
+
 def create_aws_client(service):
 
+    # boto3 takes a while to import so it waits until a client is wanted
+    import boto3
+    from botocore.client import Config
+
     # setup aws
     try:
         aws = boto3.client(service,
                            region_name=os.getenv('AWS_REGION'),
                            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
                            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-                           config=Config(signature_version='s3v4'))
-    except ClientError as e:
+                           config=Config(signature_version='s3v4',
+                                         retries=aws_retry_config()))
+    except (ClientError, BotoCoreError) as e:
         return None, e
     
-    return aws, None
+    return instrument_client(aws), None
+
+# -----------------------------------------------------------------------------
+# the iam and s3 clients, built on first use - see app/clients.py
+aws_clients = AwsClients(create_aws_client)
 
 # -----------------------------------------------------------------------------
@@ -0,0 +1,166 @@
+# app/instrumentation.py
+import time
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+from app.metrics import registry, Histogram, Counter, DEFAULT_BUCKETS
+
+# -----------------------------------------------------------------------------
+# what /aws/metrics exposes and the hooks that feed it. routes are labelled
+# by url rule rather than path and queries by statement type so the number of
+# series stays small whatever the traffic
+# -----------------------------------------------------------------------------
+
+request_latency = registry.register(Histogram(
+    'http_request_duration_seconds', 'request latency by route',
+    labels=('route', 'method')))
+
+requests_total = registry.register(Counter(
+    'http_requests_total', 'requests by route and status code',
+    labels=('route', 'method', 'status')))
+
+ratelimit_rejections = registry.register(Counter(
+    'ratelimit_rejections_total', 'requests refused by the rate limiter',
+    labels=('route',)))
+
+auth_check_latency = registry.register(Histogram(
+    'auth_check_duration_seconds', 'time taken by require_access_level, by outcome',
+    labels=('result',)))
+
+aws_call_latency = registry.register(Histogram(
+    'aws_call_duration_seconds', 'aws api call latency including retries',
+    labels=('service', 'operation')))
+
+aws_call_errors = registry.register(Counter(
+    'aws_call_errors_total', 'aws api calls that failed, by error code',
+    labels=('service', 'operation', 'code')))
+
+db_query_latency = registry.register(Histogram(
+    'db_query_duration_seconds', 'sql statement latency by statement type',
+    labels=('statement',)))
+
+db_query_errors = registry.register(Counter(
+    'db_query_errors_total', 'sql statements that raised',
+    labels=('statement',)))
+
+db_pool_wait = registry.register(Histogram(
+    'db_pool_checkout_wait_seconds',
+    'time waiting for a pooled db connection, including opening a new one',
+    buckets=(0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS, labels=()))
+
+db_pool_timeouts = registry.register(Counter(
+    'db_pool_checkout_timeouts_total', 'requests that gave up waiting for a db connection',
+    labels=()))
+
+# -----------------------------------------------------------------------------
+
+def current_route():
+    if request.url_rule is not None:
+        return request.url_rule.rule
+    return 'unmatched'
+
+# -----------------------------------------------------------------------------
+# flask
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        route = current_route()
+        request_latency.observe((route, request.method), time.perf_counter() - started)
+        requests_total.inc((route, request.method, str(response.status_code)))
+    return response
+
+# -----------------------------------------------------------------------------
+# botocore - before-call handlers must return None or the call is skipped
+
+def instrument_client(client):
+    if client is None:
+        return client
+    service = client.meta.service_model.service_name
+    events = client.meta.events
+
+    def before_call(context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        started = context.pop('metrics_started', None)
+        if started is not None:
+            aws_call_latency.observe((service, model.name), time.perf_counter() - started)
+        if http_response.status_code >= 300:
+            code = parsed.get('Error', {}).get('Code') or str(http_response.status_code)
+            aws_call_errors.inc((service, model.name, code))
+
+    def after_call_error(exception, context, event_name, **kwargs):
+        operation = event_name.split('.')[-1]
+        started = context.pop('metrics_started', None)
+        if started is not None:
+            aws_call_latency.observe((service, operation), time.perf_counter() - started)
+        aws_call_errors.inc((service, operation, type(exception).__name__))
+
+    events.register('before-call', before_call, unique_id='metrics-before-call')
+    events.register('after-call', after_call, unique_id='metrics-after-call')
+    events.register('after-call-error', after_call_error, unique_id='metrics-after-call-error')
+    return client
+
+# -----------------------------------------------------------------------------
+# sqlalchemy - listens on every engine. a stack copes with statements run from
+# inside another statement's events
+
+def _statement_type(statement):
+    words = statement.split(None, 1)
+    return words[0].upper() if words else 'UNKNOWN'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if started:
+        db_query_latency.observe(_statement_type(statement), time.perf_counter() - started.pop())
+
+def _handle_error(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('metrics_started'):
+        connection.info['metrics_started'].pop()
+    db_query_errors.inc(_statement_type(exception_context.statement or ''))
+
+# -----------------------------------------------------------------------------
+# the pool has no event for before a checkout so the wait is timed around
+# getting one. a subclass rather than a listener so it survives the pool
+# being recreated by engine.dispose()
+
+class TimedQueuePool(QueuePool):
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            db_pool_timeouts.inc(())
+            raise
+        finally:
+            db_pool_wait.observe((), time.perf_counter() - started)
+
+
+def engine_options(options):
+    # engines configured with a queue pool (see engine_options in config)
+    # get the timed one
+    if 'pool_size' in options and 'poolclass' not in options:
+        return dict(options, poolclass=TimedQueuePool)
+    return options
+
+# -----------------------------------------------------------------------------
+
+def init_app(app):
+    registry.init_app(app)
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
@@ -0,0 +1,288 @@
+# app/logs.py
+import atexit
+import datetime
+import fcntl
+import json
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from app.metrics import registry, Counter
+
+TEXT_FORMAT = "[%(asctime)s] [%(pathname)s:%(lineno)d] %(levelname)s - %(message)s"
+
+dropped_records = registry.register(Counter(
+    'log_records_dropped_total', 'log records thrown away because the log queue was full',
+    labels=('level',)))
+
+# -----------------------------------------------------------------------------
+# log calls only put the record on a bounded queue, a listener thread per
+# worker does the formatting and file writes. when the queue is full records
+# are dropped (and counted) or, with LOG_QUEUE_POLICY=block, the caller waits
+# up to LOG_QUEUE_TIMEOUT for room before dropping.
+#
+# LOG_LEVELS sets levels per module, e.g.
+#   LOG_LEVELS=app.main.create_user=INFO,botocore=WARNING
+# app code all logs through app.logger so its modules are matched on the file
+# the call came from. other names are loggers in their own right and get
+# their level set and the queue handler attached
+# -----------------------------------------------------------------------------
+
+class BoundedQueueHandler(QueueHandler):
+
+    def __init__(self, maxsize=10000, policy='drop', timeout=1.0):
+        super().__init__(queue.Queue(maxsize))
+        self.policy = policy
+        self.timeout = timeout
+
+    def prepare(self, record):
+        # the message and any traceback are rendered on the calling thread so
+        # the listener never sees args or frames that have since changed.
+        # exc_text is kept apart so the json output can put it in its own field
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = logging.Formatter().formatException(record.exc_info)
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = message
+        record.message = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = exc_text
+        return record
+
+    def enqueue(self, record):
+        try:
+            if self.policy == 'block':
+                self.queue.put(record, timeout=self.timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            dropped_records.inc(record.levelname)
+
+# -----------------------------------------------------------------------------
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # the default put_nowait would fail on a full queue, wait for the
+        # thread to make room instead
+        self.queue.put(self._sentinel)
+
+# -----------------------------------------------------------------------------
+
+class ModuleLevelFilter(logging.Filter):
+    # drops records below the level set for the module they were logged from.
+    # the longest matching module prefix wins, anything unmatched uses default
+
+    def __init__(self, levels, default, package, package_path):
+        super().__init__()
+        self.levels = levels
+        self.default = default
+        self.package = package
+        self.package_path = package_path
+        self._modules = {}
+
+    def module_name(self, record):
+        if record.name != self.package and not record.name.startswith(self.package+'.'):
+            return record.name
+        name = self._modules.get(record.pathname)
+        if name is None:
+            relative = os.path.relpath(record.pathname, self.package_path)
+            if relative.startswith('..') or not relative.endswith('.py'):
+                name = record.name
+            else:
+                name = self.package+'.'+relative[:-3].replace(os.sep, '.')
+            self._modules[record.pathname] = name
+        return name
+
+    def level_for(self, module):
+        while True:
+            if module in self.levels:
+                return self.levels[module]
+            if '.' not in module:
+                return self.default
+            module = module.rsplit('.', 1)[0]
+
+    def filter(self, record):
+        return record.levelno >= self.level_for(self.module_name(record))
+
+# -----------------------------------------------------------------------------
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = { 'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                                          .isoformat(timespec='milliseconds'),
+                  'level': record.levelname,
+                  'logger': record.name,
+                  'module': record.module,
+                  'line': record.lineno,
+                  'pid': record.process,
+                  'thread': record.threadName,
+                  'message': record.getMessage() }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+# -----------------------------------------------------------------------------
+
+class SharedRotatingFileHandler(RotatingFileHandler):
+    # rotating file handler for several processes writing the same file. every
+    # write takes an flock on <file>.lock, reopens the file if another worker
+    # has rotated it and then checks the size, so only one worker rotates and
+    # nobody carries on writing to a renamed file
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding=None):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount,
+                         encoding=encoding)
+        self._lock_file = None
+
+    def _lock_path(self):
+        return self.baseFilename + '.lock'
+
+    def _reopen_if_rotated(self):
+        if self.stream is None:
+            self.stream = self._open()
+            return
+        try:
+            current = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            current = None
+        if current is None or current.st_ino != os.fstat(self.stream.fileno()).st_ino:
+            self.stream.close()
+            self.stream = self._open()
+
+    def emit(self, record):
+        try:
+            if self._lock_file is None:
+                self._lock_file = open(self._lock_path(), 'a')
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                self._reopen_if_rotated()
+                if self.shouldRollover(record):
+                    self.doRollover()
+                logging.FileHandler.emit(self, record)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        except Exception:
+            self.handleError(record)
+
+    def after_fork(self):
+        # an flock belongs to the open file, which the child shares with its
+        # parent until it opens its own
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+        finally:
+            self.release()
+        super().close()
+
+# -----------------------------------------------------------------------------
+
+def parse_levels(value):
+    # "app.main=INFO,botocore=WARNING" -> { 'app.main': 20, 'botocore': 30 }
+    levels = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        name, _, level = item.partition('=')
+        levels[name.strip()] = level_number(level)
+    return levels
+
+
+def level_number(name):
+    # anything not recognised is treated as CRITICAL, as it always has been
+    level = logging.getLevelName((name or '').strip().upper())
+    return level if isinstance(level, int) else logging.CRITICAL
+
+# -----------------------------------------------------------------------------
+
+class LogPipeline(object):
+
+    def __init__(self):
+        self.handler = None
+        self.file_handler = None
+        self.listener = None
+        self._loggers = []
+        os.register_at_fork(after_in_child=self.after_fork)
+        atexit.register(self.stop)
+
+    def init_app(self, app):
+
+        self.stop()
+
+        filename = app.config.get('LOG_FILENAME')
+        if not filename:
+            return
+
+        default = level_number(app.config.get('LOG_LEVEL'))
+        levels = parse_levels(app.config.get('LOG_LEVELS'))
+
+        self.file_handler = SharedRotatingFileHandler(filename,
+                                                      maxBytes=app.config['LOG_MAX_BYTES'],
+                                                      backupCount=app.config['LOG_BACKUP_COUNT'])
+        if app.config.get('LOG_FORMAT') == 'json':
+            self.file_handler.setFormatter(JsonFormatter())
+        else:
+            self.file_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+        self.handler = BoundedQueueHandler(maxsize=app.config['LOG_QUEUE_SIZE'],
+                                           policy=app.config['LOG_QUEUE_POLICY'],
+                                           timeout=app.config['LOG_QUEUE_TIMEOUT'])
+        self.handler.addFilter(ModuleLevelFilter(levels, default, app.logger.name, app.root_path))
+        app_levels = { name: level for name, level in levels.items()
+                       if name == app.logger.name or name.startswith(app.logger.name+'.') }
+
+        # the logger has to let through the lowest level any module wants,
+        # the filter does the rest
+        app.logger.setLevel(min([default] + list(app_levels.values())))
+        self._attach(app.logger)
+        for name, level in levels.items():
+            if name not in app_levels:
+                logging.getLogger(name).setLevel(level)
+                self._attach(logging.getLogger(name))
+
+        self.start()
+
+    def _attach(self, logger):
+        logger.addHandler(self.handler)
+        self._loggers.append(logger)
+
+    def start(self):
+        self.listener = _Listener(self.handler.queue, self.file_handler,
+                                  respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        # flushes whatever is queued and closes the file
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        for logger in self._loggers:
+            logger.removeHandler(self.handler)
+        self._loggers = []
+        if self.file_handler is not None:
+            self.file_handler.close()
+            self.file_handler = None
+        self.handler = None
+
+    def after_fork(self):
+        # the listener thread doesn't survive a fork. records the parent had
+        # queued but not written are its to write, not ours
+        if self.listener is None:
+            return
+        self.handler.queue = queue.Queue(self.handler.queue.maxsize)
+        self.file_handler.after_fork()
+        self.start()
+
+log_pipeline = LogPipeline()
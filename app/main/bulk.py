@@ -0,0 +1,122 @@
+# app/main/bulk.py
+from app import db
+from app.models import AwsDetails
+from app.main.create_user import provision_aws_user, rollback_aws_user, \
+                                  invalidate_user_caches
+from flask import current_app as app
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+
+# -----------------------------------------------------------------------------
+# provisioning many users at once, e.g. when onboarding or migrating. aws work
+# for a bounded number of users runs at the same time - the iam client uses
+# adaptive retries so throttling slows us down rather than failing users - and
+# the db rows are written in batches as users finish
+# -----------------------------------------------------------------------------
+
+def _provision_one(flask_app, public_id):
+    with flask_app.app_context():
+        try:
+            return provision_aws_user(public_id)
+        except Exception as e: # pragma: no cover
+            app.logger.error("Provisioning [%s] blew up: %s", public_id, str(e))
+            return None
+
+# -----------------------------------------------------------------------------
+
+def _flush(pending, results):
+    # writes a batch of rows in one transaction. if that fails each row is
+    # tried on its own so one bad row doesn't lose the rest
+
+    if not pending:
+        return
+
+    try:
+        db.session.add_all([aws_user for _, aws_user in pending])
+        db.session.commit()
+        saved = pending
+    except (SQLAlchemyError, DBAPIError) as e:
+        db.session.rollback()
+        app.logger.warning("Batch insert of %d rows failed, retrying one by one: %s",
+                           len(pending), str(e))
+        saved = []
+        for context, aws_user in pending:
+            try:
+                db.session.add(aws_user)
+                db.session.commit()
+                saved.append((context, aws_user))
+            except (SQLAlchemyError, DBAPIError) as e:
+                db.session.rollback()
+                app.logger.error('Database says no!:\n'+str(e))
+                rollback_aws_user(context)
+                results[context['public_id']] = { 'status': 'failed',
+                                                  'error': 'Could not save user' }
+
+    for context, _ in saved:
+        invalidate_user_caches(context['public_id'])
+        results[context['public_id']] = { 'status': 'created' }
+
+    del pending[:]
+
+# -----------------------------------------------------------------------------
+
+def provision_users(public_ids, concurrency=None, batch_size=None, progress=None):
+    # returns a report with a result per public_id, in the order given.
+    # progress is called on this thread with (done, total) as users finish
+
+    concurrency = concurrency or app.config['BULK_PROVISIONING_CONCURRENCY']
+    batch_size = batch_size or app.config['BULK_PROVISIONING_BATCH_SIZE']
+    started = time.perf_counter()
+
+    # dedupe but keep order
+    ordered = list(dict.fromkeys(public_ids))
+    results = {}
+
+    existing = set()
+    for i in range(0, len(ordered), 1000):
+        chunk = ordered[i:i+1000]
+        rows = db.session.query(AwsDetails.public_id).\
+                   filter(AwsDetails.public_id.in_(chunk)).all()
+        existing.update(row[0] for row in rows)
+
+    for public_id in existing:
+        results[public_id] = { 'status': 'exists' }
+
+    todo = [public_id for public_id in ordered if public_id not in existing]
+    flask_app = app._get_current_object()
+    pending = []
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bulk') as pool:
+        futures = { pool.submit(_provision_one, flask_app, public_id): public_id
+                    for public_id in todo }
+        for future in as_completed(futures):
+            public_id = futures[future]
+            provisioned = future.result()
+            if provisioned:
+                pending.append(provisioned)
+                if len(pending) >= batch_size:
+                    _flush(pending, results)
+            else:
+                results[public_id] = { 'status': 'failed',
+                                       'error': 'Failed to create user on AWS' }
+            if progress:
+                progress(len(results) + len(pending), len(ordered))
+
+    _flush(pending, results)
+
+    report = []
+    for public_id in ordered:
+        result = { 'public_id': public_id }
+        result.update(results[public_id])
+        report.append(result)
+
+    summary = { 'requested': len(public_ids),
+                'created': sum(1 for r in report if r['status'] == 'created'),
+                'exists': sum(1 for r in report if r['status'] == 'exists'),
+                'failed': sum(1 for r in report if r['status'] == 'failed'),
+                'seconds': round(time.perf_counter() - started, 3) }
+
+    app.logger.info("Bulk provisioning done: %s", summary)
+
+    return { 'results': report, 'summary': summary }
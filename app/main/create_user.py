@@ -1,155 +1,206 @@
 # app/main/create_user.py
 from app import db
+from app.extensions import credential_cache, details_cache, aws_clients
 from app.models import AwsDetails 
+from app.main.presign import PresignedPostSigner
+from app.main.readiness import wait_for_bucket, wait_for_public_access_block_removed
+from app.main.readiness import ReadinessTimeout
+from app.policies import policy_templates, PolicyError
+from app.taskgraph import Step, StepError, StepTimer, run_graph, rollback
+from app.instrumentation import instrument_client
 from flask import current_app as app
-import boto3
-from botocore.client import Config
-import os
 import logging
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 from botocore.exceptions import ClientError
-import time
+from collections import namedtuple
 
 # a better hashing ting
-from cryptography.fernet import Fernet
+from app.crypto import cipher_suite as fernet_suite
+
+# decrypted keys, a ready built s3 client and a fast path signer for a
+# user's presigned urls
+PresignCredentials = namedtuple('PresignCredentials',
+                                ['access_key_id', 'secret_access_key', 's3', 'signer'])
 
 # -----------------------------------------------------------------------------
 
-def create_aws_user(public_id):
+def _readiness_config():
+    return { 'timeout': app.config['READINESS_TIMEOUT'],
+             'initial_delay': app.config['READINESS_INITIAL_DELAY'],
+             'max_delay': app.config['READINESS_MAX_DELAY'] }
 
-    collection_name = 'z'+public_id.replace('-','')
+# -----------------------------------------------------------------------------
 
-    app.logger.debug("In create_aws_user function")
+def _check_status(response, doing):
+    status_code = response['ResponseMetadata']['HTTPStatusCode']
+    if status_code != 200:
+        raise StepError('Problem '+doing+'. Status code is ['+str(status_code)+']')
 
-    #------------------------------------
-    # personalise policy
+# -----------------------------------------------------------------------------
+# provisioning steps. each takes the shared context dict and returns its
+# result, which later steps find in the context under the step's name. only
+# the bucket policy needs the user's arn so iam and s3 work mostly overlaps
+# -----------------------------------------------------------------------------
 
-    policy_data = None
+def _render_user_policy(ctx):
 
-    #TODO: put this in separate function and/or get it from the db
+    #TODO: get it from the db
     try:
-        filepath = os.path.join(os.path.dirname(__file__), 'standardpolicy.txt')
-        file = open(filepath, 'r')
-        policy_data = file.read()
-    except OSError as e:
-        app.logger.error('Failed to open and/or read aws standard policy template. Check it exists and permissions are correct.')
-        return False
-    
-    policy_data = policy_data.replace('XXXXXX',collection_name)
-
-    app.logger.debug("Read standard policy text file")
-
-    #------------------------------------
-    # create user
-    
-    create_response = None
+        template = policy_templates.get(app.config['USER_POLICY_TEMPLATE'])
+        policy_data = template.render(limit='iam_user', resource_name=ctx['collection_name'])
+    except PolicyError as e:
+        raise StepError('Failed to render aws standard policy template: '+str(e))
+
+    app.logger.debug("Rendered standard policy")
+    return policy_data
+
+# -----------------------------------------------------------------------------
+
+def _create_user(ctx):
+
     app.logger.debug("Attempting to create iam user")
     try:
-        create_response = app.iam.create_user(UserName=collection_name)
+        create_response = aws_clients.iam.create_user(UserName=ctx['collection_name'])
     except ClientError as e:
-        app.logger.error('Failed to create AWS user: '+str(e))
-        return False
-
-    if create_response['ResponseMetadata']['HTTPStatusCode'] != 200:
-        app.logger.error('Problem creating AWS user. Status code is ['+create_response.status_code+']')
-        return False
+        raise StepError('Failed to create AWS user: '+str(e))
 
+    _check_status(create_response, 'creating AWS user')
     app.logger.debug("user created ✓")
+    return create_response
+
+def _delete_user(ctx):
+    aws_clients.iam.delete_user(UserName=ctx['collection_name'])
 
-    #------------------------------------
-    # set policy for user
+# -----------------------------------------------------------------------------
+
+def _put_user_policy(ctx):
     #TODO: get policy name from config/.env
 
     try:
-        policy_response = app.iam.put_user_policy(
-            UserName = collection_name,
+        policy_response = aws_clients.iam.put_user_policy(
+            UserName = ctx['collection_name'],
             PolicyName = 'poptape_aws_standard_user_policy',
-            PolicyDocument = policy_data
+            PolicyDocument = ctx['render_user_policy']
         )
     except ClientError as e:
-        app.logger.error('Failed to create policy for AWS user: '+str(e))
-        return False
-
-    if policy_response['ResponseMetadata']['HTTPStatusCode'] != 200:
-        app.logger.error('Problem creating policy for AWS user. Status code is ['+policy_response.status_code+']')
-        return False
+        raise StepError('Failed to create policy for AWS user: '+str(e))
 
+    _check_status(policy_response, 'creating policy for AWS user')
     app.logger.debug("policy set for user ✓")
 
-    #------------------------------------
-    # create access key for user
-    
+def _delete_user_policy(ctx):
+    aws_clients.iam.delete_user_policy(UserName=ctx['collection_name'],
+                               PolicyName='poptape_aws_standard_user_policy')
+
+# -----------------------------------------------------------------------------
+
+def _create_access_key(ctx):
+
     try:
-        key_response = app.iam.create_access_key(UserName = collection_name)
+        key_response = aws_clients.iam.create_access_key(UserName = ctx['collection_name'])
     except ClientError as e:
-        app.logger.error('Failed to create access key for AWS user: '+str(e))
-        return False    
-    
-    if key_response['ResponseMetadata']['HTTPStatusCode'] != 200:
-        app.logger.error('Problem creating access key for AWS user. \
-                         Status code is ['+key_response.status_code+']')
-        return False
+        raise StepError('Failed to create access key for AWS user: '+str(e))
 
+    _check_status(key_response, 'creating access key for AWS user')
     app.logger.debug("access key created for user ✓")
+    return key_response
 
-    #------------------------------------
-    # create s3 bucket and add bucket policy to it
+def _delete_access_key(ctx):
+    aws_clients.iam.delete_access_key(UserName=ctx['collection_name'],
+                              AccessKeyId=ctx['create_access_key']['AccessKey']['AccessKeyId'])
 
+# -----------------------------------------------------------------------------
+
+def _load_bucket_policy(ctx):
+    # only needs the user's arn to render but check the template is good
+    # before anything is created
     try:
-        filepath = os.path.join(os.path.dirname(__file__), 'bucket_policy.txt')
-        file = open(filepath, 'r')
-        bucket_policy = file.read()
-    except OSError as e:
-        app.logger.error('Failed to open and/or read bucket policy template. Check it exists and permissions are correct.')
-        return False
+        return policy_templates.get(app.config['BUCKET_POLICY_TEMPLATE'])
+    except PolicyError as e:
+        raise StepError('Failed to load bucket policy template: '+str(e))
+
+# -----------------------------------------------------------------------------
 
-    bucket_policy = bucket_policy.replace('XXXXXX', collection_name.lower())
-    bucket_policy = bucket_policy.replace('AAAAAA', create_response['User']['Arn'])
+def _create_bucket(ctx):
 
     app.logger.debug("attempting to create a bucket")
-
     try:
-        buck_resp = app.s3.create_bucket(Bucket = collection_name.lower()) 
+        buck_resp = aws_clients.s3.create_bucket(Bucket = ctx['bucket_name'])
     except ClientError as e:
-        app.logger.error('Failed to create bucket for AWS user: '+str(e))
-        return False
+        raise StepError('Failed to create bucket for AWS user: '+str(e))
 
     if buck_resp['ResponseMetadata']["HTTPStatusCode"] != 200:
-        app.logger.error("Could not create bucket [%s] for user", collection_name.lower())
-        return False
+        raise StepError('Could not create bucket ['+ctx['bucket_name']+'] for user')
 
     app.logger.debug("bucket created for user ✓")
-    #TODO: fix this - the delay is here as AWS says bucket created ok but sometimes
-    #      when we try and create a bucket afterwards AWS says bucket doesn't exist.
-    #      this is caused by the length of time AWS takes to propogate the new bucket
-    #      info in it's systems. waiting whilst hacky and bad ux should help
-    time.sleep(2)
-    app.logger.debug("attempting to update bucket settings...")
 
+def _delete_bucket(ctx):
+    # in us-east-1 creating a bucket we already own succeeds, so only delete it
+    # if this run created the iam user and therefore owns the name
+    if 'create_user' in ctx:
+        aws_clients.s3.delete_bucket(Bucket=ctx['bucket_name'])
+
+# -----------------------------------------------------------------------------
+
+def _wait_bucket_exists(ctx):
+    # AWS says the bucket is created ok but it can take a while to propagate
+    # the new bucket through its systems. wait until it actually exists
     try:
-        app.s3.delete_public_access_block(
-            Bucket = collection_name.lower(),
+        waited = wait_for_bucket(aws_clients.s3, ctx['bucket_name'], **_readiness_config())
+    except (ReadinessTimeout, ClientError) as e:
+        raise StepError('Bucket ['+ctx['bucket_name']+'] never became available: '+str(e))
+    app.logger.debug("bucket available after %.3fs ✓", waited)
+
+# -----------------------------------------------------------------------------
+
+def _delete_public_access_block(ctx):
+
+    app.logger.debug("attempting to update bucket settings...")
+    try:
+        aws_clients.s3.delete_public_access_block(
+            Bucket = ctx['bucket_name'],
             ExpectedBucketOwner = app.config['AWS_ACCOUNT_ID'],
         )
     except ClientError as e:
-        app.logger.error('Failed to update bucket settings: '+str(e))
-        return False
+        raise StepError('Failed to update bucket settings: '+str(e))
     app.logger.debug("updated bucket settings ✓")
 
-    time.sleep(2)
-    app.logger.debug("attempting to create a bucket policy")
+# -----------------------------------------------------------------------------
+
+def _wait_public_access_block(ctx):
+    try:
+        waited = wait_for_public_access_block_removed(aws_clients.s3,
+                                                      ctx['bucket_name'],
+                                                      app.config['AWS_ACCOUNT_ID'],
+                                                      **_readiness_config())
+    except (ReadinessTimeout, ClientError) as e:
+        raise StepError('Public access block never removed: '+str(e))
+    app.logger.debug("public access block gone after %.3fs ✓", waited)
+
+# -----------------------------------------------------------------------------
+
+def _put_bucket_policy(ctx):
 
+    try:
+        bucket_policy = ctx['load_bucket_policy'].render(limit='bucket',
+                                                         resource_name=ctx['bucket_name'],
+                                                         principal_arn=ctx['create_user']['User']['Arn'])
+    except PolicyError as e:
+        raise StepError('Failed to render bucket policy: '+str(e))
+
+    app.logger.debug("attempting to create a bucket policy")
     try:
         app.logger.debug("BUCKET POLICY: %s", bucket_policy)
-        app.s3.put_bucket_policy(Bucket = collection_name.lower(), Policy = bucket_policy)
+        aws_clients.s3.put_bucket_policy(Bucket = ctx['bucket_name'], Policy = bucket_policy)
     except ClientError as e:
-        app.logger.error('Failed to create bucket policy: '+str(e))
-        return False        
+        raise StepError('Failed to create bucket policy: '+str(e))
 
     app.logger.debug("bucket policy created ✓")
 
-    #------------------------------------
-    # add cors policy to bucket
+# -----------------------------------------------------------------------------
+
+def _put_bucket_cors(ctx):
+
     cors_configuration = {
         'CORSRules': [{
             'AllowedHeaders': ['*'],
@@ -161,24 +212,25 @@ def create_aws_user(public_id):
     }
 
     try:
-        app.s3.put_bucket_cors(Bucket = collection_name.lower(),
+        aws_clients.s3.put_bucket_cors(Bucket = ctx['bucket_name'],
                                CORSConfiguration = cors_configuration)
     except ClientError as e:
-        app.logger.error('Failed to create cors config for bucket [%s]: %s',
-                         collection_name,
-                         str(e))
-        return False
-    
+        raise StepError('Failed to create cors config for bucket ['+ctx['collection_name']+']: '+str(e))
+
     app.logger.debug("cors config added to bucket ✓")
 
-    #------------------------------------------------
-    # save user after everything has completed okay
-    #------------------------------------------------
-    cipher_suite = Fernet(app.config['FERNET_KEY'])
+# -----------------------------------------------------------------------------
+
+def _build_aws_user(ctx):
+
+    create_response = ctx['create_user']
+    key_response = ctx['create_access_key']
+
+    cipher_suite = fernet_suite(app.config)
     aws_AccessKeyId = cipher_suite.encrypt(key_response['AccessKey']['AccessKeyId'].encode('utf-8'))
     aws_SecretAccessKey = cipher_suite.encrypt(key_response['AccessKey']['SecretAccessKey'].encode('utf-8'))
 
-    aws_user = AwsDetails(public_id = public_id,
+    aws_user = AwsDetails(public_id = ctx['public_id'],
                           aws_CreateUserRequestId = create_response['ResponseMetadata']['RequestId'],
                           aws_UserId = create_response['User']['UserId'],
                           aws_CreateDate = create_response['User']['CreateDate'],
@@ -187,49 +239,177 @@ def create_aws_user(public_id):
                           aws_SecretAccessKey = aws_SecretAccessKey.decode('utf-8'),
                           aws_PolicyName = 'poptape_aws_standard_user_policy',
                           aws_Arn = create_response['User']['Arn'])
+    return aws_user
+
+# -----------------------------------------------------------------------------
+
+def _save_user(ctx):
+
+    #------------------------------------------------
+    # save user after everything has completed okay
+    #------------------------------------------------
+    aws_user = _build_aws_user(ctx)
     try:
         db.session.add(aws_user)
         db.session.commit()
     except (SQLAlchemyError, DBAPIError) as e:
         db.session.rollback()
-        app.logger.error('Database says no!:\n'+str(e))
-        return False
+        raise StepError('Database says no!:\n'+str(e))
+
+    invalidate_user_caches(ctx['public_id'])
 
     app.logger.debug("user saved in aws db ✓")
 
-    return True
+# -----------------------------------------------------------------------------
+
+def invalidate_user_caches(public_id):
+    # called whenever a row for this user is written so we don't carry on
+    # serving credentials or details from a previous provisioning. other
+    # workers only pick the change up once their entries expire
+    credential_cache.invalidate(public_id)
+    details_cache.invalidate(public_id)
+
+# -----------------------------------------------------------------------------
+
+AWS_STEPS = [
+    Step('render_user_policy', _render_user_policy),
+    Step('load_bucket_policy', _load_bucket_policy),
+    # rendering is in memory so there's no cost to checking the templates
+    # before anything is created on aws
+    Step('create_user', _create_user, undo=_delete_user,
+         requires=['render_user_policy', 'load_bucket_policy']),
+    Step('create_bucket', _create_bucket, undo=_delete_bucket,
+         requires=['render_user_policy', 'load_bucket_policy']),
+    Step('put_user_policy', _put_user_policy,
+         requires=['create_user', 'render_user_policy'], undo=_delete_user_policy),
+    Step('create_access_key', _create_access_key,
+         requires=['create_user'], undo=_delete_access_key),
+    Step('wait_bucket_exists', _wait_bucket_exists, requires=['create_bucket']),
+    Step('put_bucket_cors', _put_bucket_cors, requires=['wait_bucket_exists']),
+    Step('delete_public_access_block', _delete_public_access_block,
+         requires=['wait_bucket_exists']),
+    Step('wait_public_access_block', _wait_public_access_block,
+         requires=['delete_public_access_block']),
+    Step('put_bucket_policy', _put_bucket_policy,
+         requires=['wait_public_access_block', 'create_user', 'load_bucket_policy']),
+]
+
+PROVISIONING_STEPS = AWS_STEPS + [
+    # db work stays on the calling thread so it uses the caller's session
+    Step('save_user', _save_user, inline=True,
+         requires=['put_user_policy', 'create_access_key',
+                   'put_bucket_policy', 'put_bucket_cors']),
+]
+
+# -----------------------------------------------------------------------------
+
+def _new_context(public_id):
+    collection_name = 'z'+public_id.replace('-','')
+    return { 'public_id': public_id,
+             'collection_name': collection_name,
+             'bucket_name': collection_name.lower() }
+
+# -----------------------------------------------------------------------------
+
+def _run_steps(steps, context, progress=None):
+    flask_app = app._get_current_object()
+    return run_graph(steps,
+                     context,
+                     timer=StepTimer(progress),
+                     max_workers=app.config['PROVISIONING_STEP_WORKERS'],
+                     wrap=flask_app.app_context,
+                     logger=app.logger)
+
+# -----------------------------------------------------------------------------
+
+def create_aws_user(public_id, progress=None):
+
+    app.logger.debug("In create_aws_user function")
+
+    return _run_steps(PROVISIONING_STEPS, _new_context(public_id), progress)
+
+# -----------------------------------------------------------------------------
+
+def provision_aws_user(public_id):
+    # creates everything on aws but leaves saving to the caller so rows can be
+    # written in batches. returns (context, unsaved AwsDetails) or None
+
+    context = _new_context(public_id)
+    if not _run_steps(AWS_STEPS, context):
+        return None
+
+    return context, _build_aws_user(context)
+
+# -----------------------------------------------------------------------------
+
+def rollback_aws_user(context):
+    # undoes a provision_aws_user whose row couldn't be saved
+    rollback(AWS_STEPS, context, app.logger)
 
 # -----------------------------------------------------------------------------
 
-def create_presigned_url(bucket_name, object_name, expiration, public_id):
+def get_presign_credentials(public_id):
+    # returns the cached credentials and s3 client for a user, building them
+    # from the db on a miss. one call per request rather than one per object
 
-    aws_details = AwsDetails.query.filter_by(public_id=public_id).first()
+    credentials = credential_cache.get(public_id)
+    if credentials:
+        return credentials
+
+    # only the key pair, not the whole row
+    aws_details = db.session.query(AwsDetails.aws_AccessKeyId,
+                                   AwsDetails.aws_SecretAccessKey).\
+                      filter(AwsDetails.public_id == public_id).first()
 
     if not aws_details:
         return None
 
     # get access keys
-    cipher_suite = Fernet(app.config['FERNET_KEY'])
+    cipher_suite = fernet_suite(app.config)
     aws_AccessKeyId = cipher_suite.decrypt(aws_details.aws_AccessKeyId.encode('utf-8'))
     aws_SecretAccessKey = cipher_suite.decrypt(aws_details.aws_SecretAccessKey.encode('utf-8'))
-  
+
     aws_AccessKeyId = aws_AccessKeyId.decode('utf-8')
     aws_SecretAccessKey = aws_SecretAccessKey.decode('utf-8')
 
+    import boto3
+    from botocore.client import Config
+
     try:
         s3 = boto3.client('s3',
                           region_name='us-east-1',
                           aws_access_key_id=aws_AccessKeyId,
                           aws_secret_access_key=aws_SecretAccessKey,
                           config=Config(signature_version='s3v4'))
+    except ClientError as e:
+        logging.error(e)
+        return None
+    instrument_client(s3)
+
+    signer = PresignedPostSigner(aws_AccessKeyId, aws_SecretAccessKey, s3,
+                                 region='us-east-1')
+    credentials = PresignCredentials(aws_AccessKeyId, aws_SecretAccessKey, s3, signer)
+    credential_cache.set(public_id, credentials)
 
+    return credentials
+
+# -----------------------------------------------------------------------------
+
+def create_presigned_url(credentials, bucket_name, object_name, expiration):
+
+    try:
         #object_name = object_name + ".jpeg"
 
-        response = s3.generate_presigned_post(bucket_name,
-                                              object_name,
-                                              Fields=None,
-                                              Conditions=None,
-                                              ExpiresIn=expiration)
+        if app.config['PRESIGN_FAST_PATH']:
+            return credentials.signer.generate_presigned_post(bucket_name,
+                                                              object_name,
+                                                              expiration)
+
+        response = credentials.s3.generate_presigned_post(bucket_name,
+                                                          object_name,
+                                                          Fields=None,
+                                                          Conditions=None,
+                                                          ExpiresIn=expiration)
     except ClientError as e:
         logging.error(e)
         return None
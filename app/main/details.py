@@ -0,0 +1,69 @@
+# app/main/details.py
+from app import db
+from app.extensions import details_cache
+from app.models import AwsDetails
+from flask import current_app as app
+
+# fields returned for each view of a user's aws details. the owner also gets
+# their (encrypted) key pair
+VIEWS = {
+    'owner': ('public_id', 'aws_CreateUserRequestId', 'aws_UserId', 'aws_UserName',
+              'aws_AccessKeyId', 'aws_SecretAccessKey', 'aws_PolicyName', 'aws_Arn',
+              'aws_CreateDate'),
+    'admin': ('public_id', 'aws_CreateUserRequestId', 'aws_UserId', 'aws_UserName',
+              'aws_PolicyName', 'aws_Arn', 'aws_CreateDate'),
+}
+
+# -----------------------------------------------------------------------------
+# aws details never change once a user is provisioned so the encoded json for
+# each view is cached on its first lookup. a hit costs no db query and no
+# serialisation. a miss only selects the columns the view returns, so admin
+# lookups never read the key pair. the owner view has every column so the
+# admin view is filled in from it for free. rows are only written by
+# provisioning which invalidates the entry
+# -----------------------------------------------------------------------------
+
+def _encode(data):
+    # built the way jsonify builds its response so a cached body is byte for
+    # byte what an uncached one would be, whatever the json provider settings
+    return app.json.response(data).get_data()
+
+# -----------------------------------------------------------------------------
+
+def get_details_json(public_id, view):
+    # returns encoded json for the view or None if there's no such user.
+    # misses aren't cached so a user shows up as soon as they're saved
+
+    views = details_cache.get(public_id) or {}
+    if view not in views:
+        fields = VIEWS[view]
+        row = db.session.query(*[getattr(AwsDetails, field) for field in fields]).\
+                  filter(AwsDetails.public_id == public_id).first()
+        if row is None:
+            return None
+        app.logger.debug("Loaded [%s] view of aws details for [%s]", view, public_id)
+        data = dict(zip(fields, row))
+        views = dict(views)
+        for name, view_fields in VIEWS.items():
+            if name not in views and set(view_fields) <= set(fields):
+                views[name] = _encode({ field: data[field] for field in view_fields })
+        details_cache.set(public_id, views)
+
+    return views[view]
+
+# -----------------------------------------------------------------------------
+
+def lookup_admin_details(public_ids):
+    # admin view for many users in one IN query that only loads the columns
+    # the view returns. gives a map of public_id to details, None if not found
+
+    fields = VIEWS['admin']
+    columns = [getattr(AwsDetails, field) for field in fields]
+    found = {}
+    for i in range(0, len(public_ids), 1000):
+        chunk = public_ids[i:i+1000]
+        rows = db.session.query(*columns).filter(AwsDetails.public_id.in_(chunk)).all()
+        for row in rows:
+            found[row.public_id] = dict(zip(fields, row))
+
+    return { public_id: found.get(public_id) for public_id in public_ids }
@@ -0,0 +1,58 @@
+# app/main/export.py
+from app import db
+from app.models import AwsDetails
+import datetime
+import json
+
+# encrypted key pair, only exported when asked for
+SECRET_FIELDS = ('aws_AccessKeyId', 'aws_SecretAccessKey')
+
+EXPORT_FIELDS = ('public_id', 'aws_CreateUserRequestId', 'aws_UserId', 'aws_UserName',
+                 'aws_AccessKeyId', 'aws_SecretAccessKey', 'aws_PolicyName', 'aws_Arn',
+                 'aws_CreateDate')
+
+# -----------------------------------------------------------------------------
+# dumps aws_details as newline delimited json, one row per line. rows come off
+# a server side cursor a batch at a time so memory stays flat however big the
+# table is. rows are ordered by create date so the last date seen can be
+# passed back as since for the next incremental pull - since is inclusive so
+# rows on that exact timestamp come again and should be deduped on public_id
+# -----------------------------------------------------------------------------
+
+def parse_since(value):
+    # iso 8601 date or datetime, raises ValueError if it's neither
+    since = datetime.datetime.fromisoformat(value)
+    if since.tzinfo:
+        # aws_CreateDate is stored as naive utc
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return since
+
+# -----------------------------------------------------------------------------
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(repr(value)+' is not json serializable')
+
+# -----------------------------------------------------------------------------
+
+def iter_aws_details(since=None, include_secrets=False, batch_size=1000):
+    # yields a dict per row
+
+    fields = [field for field in EXPORT_FIELDS
+              if include_secrets or field not in SECRET_FIELDS]
+    query = db.session.query(*[getattr(AwsDetails, field) for field in fields])
+    if since:
+        query = query.filter(AwsDetails.aws_CreateDate >= since)
+    query = query.order_by(AwsDetails.aws_CreateDate, AwsDetails.public_id).\
+                  execution_options(yield_per=batch_size)
+
+    for row in query:
+        yield dict(zip(fields, row))
+
+# -----------------------------------------------------------------------------
+
+def iter_ndjson(since=None, include_secrets=False, batch_size=1000):
+    # yields one encoded line per row
+    for row in iter_aws_details(since, include_secrets, batch_size):
+        yield json.dumps(row, default=_default) + "\n"
@@ -0,0 +1,185 @@
+# app/main/jobs.py
+from app import db
+from app.extensions import job_runner
+from app.models import ProvisioningJob
+from app.main.create_user import create_aws_user
+from app.main.bulk import provision_users
+from flask import current_app as app
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+import datetime
+import uuid
+
+# -----------------------------------------------------------------------------
+# async provisioning. the job row lives in postgres so whichever worker gets
+# the status request can answer it, not just the one running the job. bulk
+# jobs have no single public_id and keep their per user report in result
+# -----------------------------------------------------------------------------
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+# -----------------------------------------------------------------------------
+
+def _new_job(public_id=None):
+
+    now = _utcnow()
+    job = ProvisioningJob(job_id = str(uuid.uuid4()),
+                          public_id = public_id,
+                          status = 'queued',
+                          steps = [],
+                          created = now,
+                          updated = now)
+    try:
+        db.session.add(job)
+        db.session.commit()
+    except (SQLAlchemyError, DBAPIError) as e:
+        db.session.rollback()
+        app.logger.error('Database says no!:\n'+str(e))
+        return None
+
+    return job.job_id
+
+# -----------------------------------------------------------------------------
+
+def submit_provisioning_job(public_id):
+
+    job_id = _new_job(public_id)
+    if job_id:
+        job_runner.submit(run_provisioning_job, app._get_current_object(),
+                          job_id, public_id)
+
+    return job_id
+
+# -----------------------------------------------------------------------------
+
+def submit_bulk_provisioning_job(public_ids):
+
+    job_id = _new_job()
+    if job_id:
+        job_runner.submit(run_bulk_provisioning_job, app._get_current_object(),
+                          job_id, list(public_ids))
+
+    return job_id
+
+# -----------------------------------------------------------------------------
+
+def run_provisioning_job(flask_app, job_id, public_id):
+
+    with flask_app.app_context():
+
+        job = db.session.get(ProvisioningJob, job_id)
+        if not job: # pragma: no cover
+            app.logger.error("Provisioning job [%s] not found", job_id)
+            return
+
+        timers = []
+
+        def progress(timer):
+            timers[:] = [timer]
+            _update_job(job, 'running', timer)
+
+        _update_job(job, 'running')
+
+        try:
+            created = create_aws_user(public_id, progress=progress)
+        except Exception as e: # pragma: no cover
+            app.logger.error("Provisioning job [%s] blew up: %s", job_id, str(e))
+            created = False
+
+        timer = timers[0] if timers else None
+        if created:
+            _update_job(job, 'succeeded', timer)
+        else:
+            failed_step = timer.current if timer else None
+            _update_job(job, 'failed', timer,
+                        error='Failed to create user on AWS at step ['+str(failed_step)+']')
+
+        app.logger.info("Provisioning job [%s] for [%s] %s", job_id, public_id, job.status)
+
+# -----------------------------------------------------------------------------
+
+def run_bulk_provisioning_job(flask_app, job_id, public_ids):
+
+    with flask_app.app_context():
+
+        job = db.session.get(ProvisioningJob, job_id)
+        if not job: # pragma: no cover
+            app.logger.error("Bulk provisioning job [%s] not found", job_id)
+            return
+
+        def progress(done, total):
+            job.current_step = 'provisioned %d of %d' % (done, total)
+            _update_job(job, 'running')
+
+        _update_job(job, 'running')
+
+        try:
+            report = provision_users(public_ids, progress=progress)
+        except Exception as e: # pragma: no cover
+            app.logger.error("Bulk provisioning job [%s] blew up: %s", job_id, str(e))
+            job.current_step = None
+            _update_job(job, 'failed', error='Bulk provisioning failed')
+            return
+
+        job.current_step = None
+        job.result = report
+        job.total_seconds = report['summary']['seconds']
+        _update_job(job, 'succeeded')
+
+        app.logger.info("Bulk provisioning job [%s] %s", job_id, report['summary'])
+
+# -----------------------------------------------------------------------------
+
+def _update_job(job, status, timer=None, error=None):
+
+    job.status = status
+    job.updated = _utcnow()
+    if timer:
+        job.current_step = timer.current
+        job.steps = [{ 'step': name, 'seconds': round(seconds, 3), 'offset': round(offset, 3) }
+                     for name, seconds, offset in timer.steps]
+        job.total_seconds = timer.total
+    if error:
+        job.error = error
+
+    try:
+        db.session.add(job)
+        db.session.commit()
+    except (SQLAlchemyError, DBAPIError) as e: # pragma: no cover
+        db.session.rollback()
+        app.logger.error('Could not update provisioning job [%s]: %s', job.job_id, str(e))
+
+# -----------------------------------------------------------------------------
+
+def fail_if_stale(job):
+    # a job whose worker died or was recycled is never finished, so one that
+    # hasn't moved for PROVISIONING_JOB_STALE_SECONDS is marked failed rather
+    # than leaving clients polling forever. running jobs update at every step
+
+    if job.status not in ('queued', 'running'):
+        return job
+
+    stale_after = datetime.timedelta(seconds=app.config['PROVISIONING_JOB_STALE_SECONDS'])
+    if _utcnow() - job.updated < stale_after:
+        return job
+
+    app.logger.warning("Provisioning job [%s] not updated since %s, marking it failed",
+                       job.job_id, job.updated)
+    _update_job(job, 'failed', error='Job stopped without finishing, the worker '
+                                     'running it was probably restarted')
+    return job
+
+# -----------------------------------------------------------------------------
+
+def job_to_dict(job):
+
+    return { 'job_id': job.job_id,
+             'public_id': job.public_id,
+             'status': job.status,
+             'current_step': job.current_step,
+             'steps': job.steps or [],
+             'total_seconds': job.total_seconds,
+             'error': job.error,
+             'result': job.result,
+             'created': job.created,
+             'updated': job.updated }
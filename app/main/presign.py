@@ -0,0 +1,115 @@
+# app/main/presign.py
+import base64
+import datetime
+import hashlib
+import hmac
+import json
+from app.cache import TTLCache
+
+# -----------------------------------------------------------------------------
+# fast path for presigned s3 posts. botocore runs its full request signing
+# machinery (endpoint rules, request dict, event hooks) for every object but a
+# sigv4 presigned post is only a base64 policy and a chain of hmacs. the output
+# of this module must match botocore's byte for byte - see test_presign.py
+# -----------------------------------------------------------------------------
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+ISO8601 = '%Y-%m-%dT%H:%M:%SZ'
+SIGV4_TIMESTAMP = '%Y%m%dT%H%M%SZ'
+
+# same layout json.dumps gives botocore's policy dict. values are json encoded
+# before they go in so escaping matches too
+POLICY_TEMPLATE = ('{"expiration": %s, "conditions": [{"bucket": %s}, {"key": %s}, '
+                   '{"x-amz-algorithm": "' + ALGORITHM + '"}, {"x-amz-credential": %s}, '
+                   '{"x-amz-date": %s}]}')
+
+# derived signing keys only change with the date so keep them for a day,
+# keyed by (access key, date, region, service)
+signing_key_cache = TTLCache(maxsize=4096, ttl=86400)
+
+# -----------------------------------------------------------------------------
+
+def _utcnow():
+    # naive utc datetime, same as botocore.compat.get_current_datetime
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+# -----------------------------------------------------------------------------
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+# -----------------------------------------------------------------------------
+
+def get_signing_key(secret_access_key, access_key_id, datestamp, region, service):
+
+    cache_key = (access_key_id, datestamp, region, service)
+    signing_key = signing_key_cache.get(cache_key)
+    if signing_key:
+        return signing_key
+
+    k_date = _hmac(('AWS4' + secret_access_key).encode('utf-8'), datestamp)
+    k_region = _hmac(k_date, region)
+    k_service = _hmac(k_region, service)
+    signing_key = _hmac(k_service, 'aws4_request')
+    signing_key_cache.set(cache_key, signing_key)
+
+    return signing_key
+
+# -----------------------------------------------------------------------------
+
+class PresignedPostSigner(object):
+
+    def __init__(self, access_key_id, secret_access_key, s3,
+                 region='us-east-1', service='s3'):
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.service = service
+        # botocore client is kept for resolving the post url and for anything
+        # the fast path doesn't handle
+        self.s3 = s3
+        self._urls = {}
+
+    def url_for(self, bucket_name):
+        # endpoint resolution is per bucket so only pay for it once
+        url = self._urls.get(bucket_name)
+        if url is None:
+            url = self.s3.generate_presigned_post(bucket_name, 'key')['url']
+            self._urls[bucket_name] = url
+        return url
+
+    def generate_presigned_post(self, bucket_name, object_name, expiration=3600):
+
+        if object_name.endswith('${filename}'):
+            # starts-with policies are rare enough to leave to botocore
+            return self.s3.generate_presigned_post(bucket_name,
+                                                   object_name,
+                                                   ExpiresIn=expiration)
+
+        now = _utcnow()
+        timestamp = now.strftime(SIGV4_TIMESTAMP)
+        datestamp = timestamp[0:8]
+        credential = '/'.join([self.access_key_id, datestamp, self.region,
+                               self.service, 'aws4_request'])
+        expires = (now + datetime.timedelta(seconds=expiration)).strftime(ISO8601)
+
+        policy_document = POLICY_TEMPLATE % (json.dumps(expires),
+                                             json.dumps(bucket_name),
+                                             json.dumps(object_name),
+                                             json.dumps(credential),
+                                             json.dumps(timestamp))
+        policy = base64.b64encode(policy_document.encode('utf-8')).decode('utf-8')
+
+        signing_key = get_signing_key(self.secret_access_key, self.access_key_id,
+                                      datestamp, self.region, self.service)
+        signature = hmac.new(signing_key, policy.encode('utf-8'), hashlib.sha256).hexdigest()
+
+        fields = {}
+        fields['key'] = object_name
+        fields['x-amz-algorithm'] = ALGORITHM
+        fields['x-amz-credential'] = credential
+        fields['x-amz-date'] = timestamp
+        fields['policy'] = policy
+        fields['x-amz-signature'] = signature
+
+        return { 'url': self.url_for(bucket_name), 'fields': fields }
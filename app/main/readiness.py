@@ -0,0 +1,83 @@
+# app/main/readiness.py
+import time
+from botocore.exceptions import ClientError, WaiterError
+from app.metrics import registry, Histogram
+
+# -----------------------------------------------------------------------------
+# aws is eventually consistent so some provisioning steps can't start until a
+# previous one has propagated. rather than sleeping a fixed time we poll the
+# actual precondition with bounded exponential backoff and carry on as soon as
+# it holds. how long each wait took is kept so we can see what we save
+# -----------------------------------------------------------------------------
+
+propagation_delays = registry.register(Histogram(
+    'aws_propagation_delay_seconds', 'time waited for aws to become consistent, by step',
+    labels=('step',)))
+
+class ReadinessTimeout(Exception):
+    pass
+
+# errors worth asking again about. anything else, e.g. AccessDenied, won't get
+# better by waiting so it's raised straight away
+TRANSIENT_ERRORS = { 'NoSuchBucket', 'OperationAborted', 'SlowDown', 'Throttling',
+                     'ThrottlingException', 'RequestLimitExceeded', 'InternalError',
+                     'ServiceUnavailable' }
+
+# -----------------------------------------------------------------------------
+
+def poll_until(name, check, timeout=30, initial_delay=0.05, max_delay=2.0):
+    # calls check() until it returns True, backing off between calls. returns
+    # the seconds waited or raises ReadinessTimeout
+
+    started = time.monotonic()
+    delay = initial_delay
+
+    while True:
+        if check():
+            waited = time.monotonic() - started
+            propagation_delays.observe(name, waited)
+            return waited
+
+        remaining = timeout - (time.monotonic() - started)
+        if remaining <= 0:
+            raise ReadinessTimeout('['+name+'] not ready after '+str(timeout)+' seconds')
+
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+# -----------------------------------------------------------------------------
+
+def wait_for_bucket(s3, bucket_name, **kwargs):
+    # one attempt per poll with the botocore bucket_exists waiter so it decides
+    # what counts as existing, the backoff here decides the timing
+
+    waiter = s3.get_waiter('bucket_exists')
+
+    def check():
+        try:
+            waiter.wait(Bucket=bucket_name, WaiterConfig={ 'Delay': 0, 'MaxAttempts': 1 })
+        except WaiterError:
+            return False
+        return True
+
+    return poll_until('bucket_exists', check, **kwargs)
+
+# -----------------------------------------------------------------------------
+
+def wait_for_public_access_block_removed(s3, bucket_name, account_id, **kwargs):
+    # a bucket policy allowing public reads is refused until the block is gone
+
+    def check():
+        try:
+            s3.get_public_access_block(Bucket=bucket_name,
+                                       ExpectedBucketOwner=account_id)
+        except ClientError as e:
+            code = e.response['Error']['Code']
+            if code == 'NoSuchPublicAccessBlockConfiguration':
+                return True
+            if code in TRANSIENT_ERRORS:
+                return False
+            raise
+        return False
+
+    return poll_until('public_access_block_removed', check, **kwargs)
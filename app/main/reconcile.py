@@ -0,0 +1,269 @@
+# app/main/reconcile.py
+from app import db
+from app.models import AwsDetails
+from app.extensions import aws_clients
+from app.main.create_user import invalidate_user_caches
+from flask import current_app as app
+from botocore.exceptions import ClientError, BotoCoreError
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import re
+import time
+import uuid
+
+# iam users are called z<uuid without dashes> and buckets are the same in
+# lower case, see _new_context in create_user
+NAME_PATTERN = re.compile(r'^z([0-9a-f]{32})$')
+
+# -----------------------------------------------------------------------------
+# compares what's on aws with what's in aws_details and reports
+#   orphan users    - iam users with no row, e.g. from a failed provisioning
+#   orphan buckets  - buckets with no row
+#   dangling rows   - rows whose iam user has gone
+#   missing buckets - rows whose bucket has gone (reported, never repaired)
+#
+# each run carries on from the checkpoint, doing at most max_pages pages of
+# iam users and buckets and max_pages * page_size rows, so a big account is
+# covered over several runs rather than rescanned each time. a scan that
+# reaches the end starts again from the beginning on the next run.
+#
+# anything created in the last grace_seconds is left alone as it may belong
+# to a provisioning that hasn't saved its row yet. an aws error checking one
+# entity goes in the report's errors and that entity is skipped this run
+# -----------------------------------------------------------------------------
+
+def public_id_from_name(name):
+    match = NAME_PATTERN.match(name.lower())
+    if not match:
+        return None
+    return str(uuid.UUID(match.group(1)))
+
+# -----------------------------------------------------------------------------
+
+def _existing_rows(public_ids):
+    existing = set()
+    ids = list(public_ids)
+    for i in range(0, len(ids), 1000):
+        rows = db.session.query(AwsDetails.public_id).\
+                   filter(AwsDetails.public_id.in_(ids[i:i+1000])).all()
+        existing.update(row[0] for row in rows)
+    return existing
+
+# -----------------------------------------------------------------------------
+
+def _too_new(created, cutoff):
+    return created is not None and created.replace(tzinfo=None) > cutoff
+
+# -----------------------------------------------------------------------------
+
+def _paginate(client, operation, token_key, checkpoint, page_size, max_pages, **kwargs):
+    # yields up to max_pages pages starting from the checkpointed
+    # token and then stores where the next run should start
+    paginator = client.get_paginator(operation)
+    pages = paginator.paginate(PaginationConfig={ 'PageSize': page_size,
+                                                  'MaxItems': page_size * max_pages,
+                                                  'StartingToken': checkpoint.get(token_key) },
+                               **kwargs)
+    for page in pages:
+        yield page
+    checkpoint[token_key] = pages.resume_token
+
+# -----------------------------------------------------------------------------
+
+def _checked(check, what):
+    # wraps a detail call for the pool so one entity failing doesn't end the
+    # run. returns (result, error message)
+    def run(name):
+        try:
+            return check(name), None
+        except (ClientError, BotoCoreError) as e:
+            return None, 'could not check '+what+' ['+name+']: '+str(e)
+    return run
+
+def _user_details(iam, user_name):
+    # access key ids, or None if the user has gone since it was listed
+    try:
+        keys = iam.list_access_keys(UserName=user_name)['AccessKeyMetadata']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchEntity':
+            raise
+        return None
+    return [key['AccessKeyId'] for key in keys]
+
+def _row_status(iam, s3, public_id):
+    # returns (user exists, bucket exists) for a row
+    name = 'z'+public_id.replace('-','')
+    try:
+        iam.get_user(UserName=name)
+        user_exists = True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchEntity':
+            raise
+        user_exists = False
+    try:
+        s3.head_bucket(Bucket=name.lower())
+        bucket_exists = True
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchBucket'):
+            raise
+        bucket_exists = False
+    return user_exists, bucket_exists
+
+# -----------------------------------------------------------------------------
+
+def _scan_users(iam, pool, checkpoint, report, page_size, max_pages, cutoff):
+
+    candidates = {}
+    for page in _paginate(iam, 'list_users', 'iam_token', checkpoint, page_size, max_pages):
+        for user in page['Users']:
+            report['scanned']['iam_users'] += 1
+            public_id = public_id_from_name(user['UserName'])
+            if public_id and not _too_new(user.get('CreateDate'), cutoff):
+                candidates[public_id] = user['UserName']
+
+    orphans = sorted(set(candidates) - _existing_rows(candidates))
+    names = [candidates[public_id] for public_id in orphans]
+    details = pool.map(_checked(lambda name: _user_details(iam, name), 'user'), names)
+    for public_id, name, (keys, error) in zip(orphans, names, details):
+        if error:
+            report['errors'].append(error)
+            continue
+        if keys is None:
+            continue
+        report['orphan_users'].append({ 'public_id': public_id,
+                                        'user_name': name,
+                                        'access_keys': keys })
+
+# -----------------------------------------------------------------------------
+
+def _scan_buckets(s3, checkpoint, report, page_size, max_pages, cutoff):
+
+    candidates = {}
+    for page in _paginate(s3, 'list_buckets', 's3_token', checkpoint, page_size, max_pages,
+                          Prefix='z'):
+        for bucket in page['Buckets']:
+            report['scanned']['buckets'] += 1
+            public_id = public_id_from_name(bucket['Name'])
+            if public_id and not _too_new(bucket.get('CreationDate'), cutoff):
+                candidates[public_id] = bucket['Name']
+
+    orphans = set(candidates) - _existing_rows(candidates)
+    for public_id in sorted(orphans):
+        report['orphan_buckets'].append({ 'public_id': public_id,
+                                          'bucket_name': candidates[public_id] })
+
+# -----------------------------------------------------------------------------
+
+def _scan_rows(iam, s3, pool, checkpoint, report, limit, cutoff):
+
+    query = db.session.query(AwsDetails.public_id).\
+                filter(AwsDetails.aws_CreateDate <= cutoff).\
+                order_by(AwsDetails.public_id)
+    if checkpoint.get('db_marker'):
+        query = query.filter(AwsDetails.public_id > checkpoint['db_marker'])
+    public_ids = [row[0] for row in query.limit(limit).all()]
+
+    statuses = pool.map(_checked(lambda public_id: _row_status(iam, s3, public_id), 'row'),
+                        public_ids)
+    for public_id, (status, error) in zip(public_ids, statuses):
+        report['scanned']['rows'] += 1
+        if error:
+            report['errors'].append(error)
+            continue
+        user_exists, bucket_exists = status
+        if not user_exists:
+            report['dangling_rows'].append(public_id)
+        elif not bucket_exists:
+            report['missing_buckets'].append(public_id)
+
+    # a short batch means we got to the end
+    checkpoint['db_marker'] = public_ids[-1] if len(public_ids) == limit else None
+
+# -----------------------------------------------------------------------------
+
+def _delete_orphan_user(iam, user):
+    name = user['user_name']
+    for policy_name in iam.list_user_policies(UserName=name)['PolicyNames']:
+        iam.delete_user_policy(UserName=name, PolicyName=policy_name)
+    for access_key_id in user['access_keys']:
+        iam.delete_access_key(UserName=name, AccessKeyId=access_key_id)
+    iam.delete_user(UserName=name)
+
+def _repair(iam, s3, report):
+
+    repaired = { 'orphan_users': [], 'orphan_buckets': [], 'dangling_rows': [] }
+
+    for user in report['orphan_users']:
+        try:
+            _delete_orphan_user(iam, user)
+            repaired['orphan_users'].append(user['public_id'])
+        except (ClientError, BotoCoreError) as e:
+            report['errors'].append('could not delete user ['+user['user_name']+']: '+str(e))
+
+    for bucket in report['orphan_buckets']:
+        try:
+            # fails if anything has been uploaded, which we want a human to see
+            s3.delete_bucket(Bucket=bucket['bucket_name'])
+            repaired['orphan_buckets'].append(bucket['public_id'])
+        except (ClientError, BotoCoreError) as e:
+            report['errors'].append('could not delete bucket ['+bucket['bucket_name']+']: '+str(e))
+
+    for public_id in report['dangling_rows']:
+        try:
+            AwsDetails.query.filter_by(public_id=public_id).delete()
+            db.session.commit()
+        except (SQLAlchemyError, DBAPIError) as e:
+            db.session.rollback()
+            report['errors'].append('could not delete row ['+public_id+']: '+str(e))
+            continue
+        invalidate_user_caches(public_id)
+        repaired['dangling_rows'].append(public_id)
+
+    report['repaired'] = repaired
+
+# -----------------------------------------------------------------------------
+
+def reconcile(checkpoint=None, repair=False, page_size=None, max_pages=None,
+              workers=None, grace_seconds=None):
+    # returns a report. checkpoint is updated in place with where the next
+    # run should start
+
+    checkpoint = checkpoint if checkpoint is not None else {}
+    page_size = page_size or app.config['RECONCILE_PAGE_SIZE']
+    max_pages = max_pages or app.config['RECONCILE_MAX_PAGES']
+    workers = workers or app.config['RECONCILE_WORKERS']
+    if grace_seconds is None:
+        grace_seconds = app.config['RECONCILE_GRACE_SECONDS']
+
+    started = time.perf_counter()
+    cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - \
+             datetime.timedelta(seconds=grace_seconds)
+    report = { 'orphan_users': [],
+               'orphan_buckets': [],
+               'dangling_rows': [],
+               'missing_buckets': [],
+               'errors': [],
+               'scanned': { 'iam_users': 0, 'buckets': 0, 'rows': 0 } }
+
+    # detail calls for one entity at a time are what takes the time so they
+    # go on a pool. boto3 clients are thread safe
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as pool:
+        _scan_users(aws_clients.iam, pool, checkpoint, report, page_size, max_pages, cutoff)
+        _scan_buckets(aws_clients.s3, checkpoint, report, page_size, max_pages, cutoff)
+        _scan_rows(aws_clients.iam, aws_clients.s3, pool, checkpoint, report, page_size * max_pages, cutoff)
+
+    if repair:
+        _repair(aws_clients.iam, aws_clients.s3, report)
+
+    report['complete'] = { 'iam_users': checkpoint.get('iam_token') is None,
+                           'buckets': checkpoint.get('s3_token') is None,
+                           'rows': checkpoint.get('db_marker') is None }
+    report['seconds'] = round(time.perf_counter() - started, 3)
+
+    app.logger.info("Reconciliation done in %.1fs: %d orphan users, %d orphan buckets, "
+                    "%d dangling rows, %d missing buckets", report['seconds'],
+                    len(report['orphan_users']), len(report['orphan_buckets']),
+                    len(report['dangling_rows']), len(report['missing_buckets']))
+
+    return report
@@ -0,0 +1,171 @@
+# app/main/rotate.py
+from app import db
+from app.models import AwsDetails
+from app.crypto import fernet_keys, key_id
+from flask import current_app as app
+from sqlalchemy import update
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+import time
+
+# -----------------------------------------------------------------------------
+# re-encrypts the key pair in every aws_details row with the newest key. rows
+# are read a batch at a time in public_id order and each batch's crypto is
+# split across a process pool. the next batch is read while the pool works on
+# the current one. each batch is written with one executemany update in its
+# own short transaction, and then the checkpoint records the last public_id
+# done, so an interrupted run carries on from there. rows already on the
+# newest key are left alone so running it again costs no writes
+# -----------------------------------------------------------------------------
+
+_worker_suite = None
+
+def _init_worker(keys):
+    global _worker_suite
+    _worker_suite = (Fernet(keys[0]), MultiFernet([Fernet(key) for key in keys]))
+
+
+def _rotate_token(newest, suite, token):
+    token = token.encode('utf-8')
+    try:
+        newest.decrypt(token)
+        return None
+    except InvalidToken:
+        pass
+    # raises InvalidToken if no key we have can read it
+    return suite.rotate(token).decode('utf-8')
+
+
+def rotate_rows(rows):
+    # rows are (public_id, access key id, secret) tuples. returns
+    # (updates, failed public_ids) where updates are dicts for the rows that
+    # needed re-encrypting
+    newest, suite = _worker_suite
+    updates = []
+    failed = []
+    for public_id, access_key_id, secret_access_key in rows:
+        try:
+            new_key_id = _rotate_token(newest, suite, access_key_id)
+            new_secret = _rotate_token(newest, suite, secret_access_key)
+        except InvalidToken:
+            failed.append(public_id)
+            continue
+        if new_key_id is None and new_secret is None:
+            continue
+        values = { 'public_id': public_id }
+        if new_key_id is not None:
+            values['aws_AccessKeyId'] = new_key_id
+        if new_secret is not None:
+            values['aws_SecretAccessKey'] = new_secret
+        updates.append(values)
+    return updates, failed
+
+# -----------------------------------------------------------------------------
+
+class _InProcess(object):
+    # stands in for the pool when workers is 0
+
+    def __init__(self, keys):
+        _init_worker(keys)
+
+    def map(self, fn, chunks):
+        return [fn(chunk) for chunk in chunks]
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def _read_batch(after, batch_size):
+    query = db.session.query(AwsDetails.public_id,
+                             AwsDetails.aws_AccessKeyId,
+                             AwsDetails.aws_SecretAccessKey)
+    if after is not None:
+        query = query.filter(AwsDetails.public_id > after)
+    rows = [tuple(row) for row in query.order_by(AwsDetails.public_id).limit(batch_size)]
+    # don't hold a transaction open while the pool works
+    db.session.rollback()
+    return rows
+
+
+def _chunks(rows, count):
+    size = max(-(-len(rows) // count), 1)
+    return [rows[i:i+size] for i in range(0, len(rows), size)]
+
+
+def _write(updates):
+    # only rows with both columns changing go in one executemany, anything
+    # else is rare enough to do on its own
+    if not updates:
+        return
+    full = [values for values in updates if len(values) == 3]
+    if full:
+        db.session.execute(update(AwsDetails), full)
+    for values in updates:
+        if len(values) != 3:
+            db.session.execute(update(AwsDetails), [values])
+    db.session.commit()
+
+# -----------------------------------------------------------------------------
+
+def rotate_keys(checkpoint, batch_size=None, workers=None, progress=None):
+    # checkpoint is a dict loaded with load_checkpoint and updated as batches
+    # are written. returns a report dict
+
+    batch_size = batch_size or app.config['ROTATE_BATCH_SIZE']
+    if workers is None:
+        workers = app.config['ROTATE_WORKERS']
+
+    keys = fernet_keys(app.config)
+    target = key_id(keys[0])
+    if checkpoint.get('key_id') != target or checkpoint.get('complete'):
+        # a checkpoint from rotating to some other key is no use, and after a
+        # finished run there's nothing to carry on from
+        checkpoint.clear()
+        checkpoint.update({ 'key_id': target, 'after': None, 'rotated': 0,
+                            'current': 0, 'failed': [] })
+
+    report = { 'key_id': target, 'scanned': 0, 'rotated': 0, 'current': 0,
+               'failed': [], 'seconds': 0.0, 'rows_per_second': 0.0 }
+
+    if workers:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(keys,))
+    else:
+        pool = _InProcess(keys)
+
+    started = time.perf_counter()
+    try:
+        rows = _read_batch(checkpoint['after'], batch_size)
+        while rows:
+            pending = pool.map(rotate_rows, _chunks(rows, max(workers, 1)))
+            following = _read_batch(rows[-1][0], batch_size)
+
+            updates = []
+            failed = []
+            for chunk_updates, chunk_failed in pending:
+                updates.extend(chunk_updates)
+                failed.extend(chunk_failed)
+            _write(updates)
+
+            report['scanned'] += len(rows)
+            report['rotated'] += len(updates)
+            report['current'] += len(rows) - len(updates) - len(failed)
+            report['failed'].extend(failed)
+
+            checkpoint['after'] = rows[-1][0]
+            checkpoint['rotated'] += len(updates)
+            checkpoint['current'] += len(rows) - len(updates) - len(failed)
+            checkpoint['failed'].extend(failed)
+            if progress:
+                progress(checkpoint, report, time.perf_counter() - started)
+
+            rows = following
+    finally:
+        pool.shutdown(wait=True)
+
+    report['seconds'] = time.perf_counter() - started
+    if report['seconds']:
+        report['rows_per_second'] = report['scanned'] / report['seconds']
+    checkpoint['complete'] = True
+
+    return report
@@ -1,19 +1,36 @@
 # app/main/views.py
 from app import db, limiter, flask_uuid
-from flask import jsonify, request, abort, url_for
+from flask import jsonify, request, abort, url_for, stream_with_context, send_from_directory
 from flask import current_app as app
 from app.main import bp
-from app.main.create_user import create_aws_user, create_presigned_url
-from app.models import AwsDetails 
+from app.main.create_user import create_aws_user, create_presigned_url, get_presign_credentials
+from app.main.jobs import submit_provisioning_job, submit_bulk_provisioning_job, job_to_dict, \
+                          fail_if_stale
+from app.main.details import get_details_json, lookup_admin_details
+from app.main.export import iter_ndjson, parse_since
+from app.extensions import credential_cache, access_cache, details_cache
+from app.metrics import registry
+from app.profiling import list_profiles, profile_text, PROFILE_NAME
+import os
+from app.models import AwsDetails, ProvisioningJob
 from app.decorators import require_access_level
 from app.assertions import assert_valid_schema
 from jsonschema.exceptions import ValidationError as JsonValidationError
+from werkzeug.exceptions import RequestEntityTooLarge
 import uuid
 from urllib.parse import unquote
 
+# each id is 36 chars plus quotes and a separator, leave room for whitespace
+MAX_LOOKUP_BYTES = 64 * 1024
+
+# routes called by things that don't send json, e.g. prometheus
+NOT_JSON = {'main.metrics'}
+
 # reject any non-json requests
 @bp.before_request
 def only_json():
+    if request.endpoint in NOT_JSON:
+        return None
     if not request.is_json:
         return jsonify({ 'message': 'Input must be json'}), 400
 
@@ -43,11 +60,137 @@ def create_user_on_aws():
 
     public_id = data['public_id']
 
+    # provision in the background if configured to or if the client asks
+    if app.config['PROVISIONING_ASYNC'] or \
+       'respond-async' in request.headers.get('Prefer', ''):
+        job_id = submit_provisioning_job(public_id)
+        if not job_id:
+            return jsonify({ 'message': 'Failed to create user on AWS' }), 500
+        status_url = url_for('main.get_provisioning_job', job_id=job_id)
+        return jsonify({ 'message': 'User creation accepted',
+                         'job_id': job_id,
+                         'status_url': status_url }), 202, { 'Location': status_url }
+
     if create_aws_user(public_id):
         return jsonify({ 'message': 'User created on AWS' }), 201
 
     return jsonify({ 'message': 'Failed to create user on AWS' }), 500
 
+# -----------------------------------------------------------------------------
+# create many aws users at once - admin only. always runs in the background as
+# hundreds of users take far longer than a worker is allowed per request
+@bp.route('/aws/users', methods=['POST'])
+@limiter.limit("5/minute")
+@require_access_level(5, request)
+def create_users_on_aws(public_id, request):
+
+    # check input is valid json
+    try:
+        data = request.get_json()
+    except:
+        return jsonify({ 'message': 'Check ya inputs mate. Yer not valid, Jason'}), 400
+
+    # validate input against json schemas
+    try:
+        assert_valid_schema(data, 'bulk_uuids')
+    except JsonValidationError as err:
+        return jsonify({ 'message': 'Check ya inputs mate.', 'error': err.message }), 400
+
+    job_id = submit_bulk_provisioning_job(data['public_ids'])
+    if not job_id:
+        return jsonify({ 'message': 'Failed to create users on AWS' }), 500
+
+    status_url = url_for('main.get_provisioning_job_by_admin', job_id=job_id)
+    return jsonify({ 'message': 'User creation accepted',
+                     'job_id': job_id,
+                     'status_url': status_url }), 202, { 'Location': status_url }
+
+# -----------------------------------------------------------------------------
+# admin view of many aws users at once - one db query however many are asked
+# for, up to the 500 the schema allows
+@bp.route('/aws/users/lookup', methods=['POST'])
+@limiter.limit("30/minute")
+@require_access_level(5, request)
+def lookup_users_on_aws(public_id, request):
+
+    # don't bother reading anything much bigger than 500 ids. werkzeug enforces
+    # this whether or not the request has a content length. with none, e.g.
+    # when chunked, it stops reading at the limit rather than raising so a
+    # body that fills it is taken to be too big
+    request.max_content_length = MAX_LOOKUP_BYTES
+
+    # check input is valid json
+    try:
+        if len(request.get_data()) >= MAX_LOOKUP_BYTES:
+            raise RequestEntityTooLarge()
+        data = request.get_json()
+    except RequestEntityTooLarge:
+        return jsonify({ 'message': 'Too many ids, 500 max per request' }), 413
+    except:
+        return jsonify({ 'message': 'Check ya inputs mate. Yer not valid, Jason'}), 400
+
+    # validate input against json schemas
+    try:
+        assert_valid_schema(data, 'bulk_uuids')
+    except JsonValidationError as err:
+        return jsonify({ 'message': 'Check ya inputs mate.', 'error': err.message }), 400
+
+    users = lookup_admin_details(data['public_ids'])
+    not_found = [user_id for user_id, details in users.items() if details is None]
+
+    return jsonify({ 'users': users,
+                     'found': len(users) - len(not_found),
+                     'not_found': not_found }), 200
+
+# -----------------------------------------------------------------------------
+# stream all aws details as newline delimited json - admin only. ?since= takes
+# an iso date for incremental pulls and ?secrets=true adds the encrypted keys
+@bp.route('/aws/users/export', methods=['GET'])
+@limiter.limit("5/minute")
+@require_access_level(5, request)
+def export_users(public_id, request):
+
+    since = request.args.get('since')
+    if since:
+        try:
+            since = parse_since(since)
+        except ValueError:
+            return jsonify({ 'message': 'since must be an iso 8601 date' }), 400
+
+    include_secrets = request.args.get('secrets', 'false').lower() == 'true'
+
+    return app.response_class(stream_with_context(iter_ndjson(since, include_secrets)),
+                              mimetype='application/x-ndjson')
+
+# -----------------------------------------------------------------------------
+# get progress of an async aws user creation. only the user the job is for
+# gets to see it, anyone else gets the same 404 as for a job that isn't there
+@bp.route('/aws/user/jobs/<uuid:job_id>', methods=['GET'])
+@limiter.limit("100/minute")
+@require_access_level(10, request)
+def get_provisioning_job(public_id, request, job_id):
+
+    job = db.session.get(ProvisioningJob, str(job_id))
+
+    if not job or job.public_id != public_id:
+        return jsonify({ 'message': 'Where dey gone' }), 404
+
+    return jsonify(job_to_dict(fail_if_stale(job))), 200
+
+# -----------------------------------------------------------------------------
+# get progress of any provisioning job, including bulk ones - admin only
+@bp.route('/aws/users/jobs/<uuid:job_id>', methods=['GET'])
+@limiter.limit("100/minute")
+@require_access_level(5, request)
+def get_provisioning_job_by_admin(public_id, request, job_id):
+
+    job = db.session.get(ProvisioningJob, str(job_id))
+
+    if not job:
+        return jsonify({ 'message': 'Where dey gone' }), 404
+
+    return jsonify(job_to_dict(fail_if_stale(job))), 200
+
 # -----------------------------------------------------------------------------
 # get aws user details
 @bp.route('/aws/user', methods=['GET'])
@@ -55,48 +198,26 @@ def create_user_on_aws():
 @require_access_level(10, request)
 def get_user_detail(public_id, request):
 
-    aws_details = AwsDetails.query.filter_by(public_id=public_id).first()
+    body = get_details_json(public_id, 'owner')
 
-    if not aws_details:
+    if not body:
         return jsonify({ 'message': 'Where dey gone' }), 404
 
-    app.logger.debug(aws_details)
-
-    user_data = {}
-    user_data['public_id'] = aws_details.public_id
-    user_data['aws_CreateUserRequestId'] = aws_details.aws_CreateUserRequestId
-    user_data['aws_UserId'] = aws_details.aws_UserId
-    user_data['aws_UserName'] = aws_details.aws_UserName
-    user_data['aws_AccessKeyId'] = aws_details.aws_AccessKeyId
-    user_data['aws_SecretAccessKey'] = aws_details.aws_SecretAccessKey
-    user_data['aws_PolicyName'] = aws_details.aws_PolicyName
-    user_data['aws_Arn'] = aws_details.aws_Arn
-    user_data['aws_CreateDate'] = aws_details.aws_CreateDate
-
-    return jsonify(user_data)
+    return app.response_class(body, mimetype='application/json')
 
 # -----------------------------------------------------------------------------
 # get aws user details for particular user
-@bp.route('/aws/user/<user_id>', methods=['GET'])
+@bp.route('/aws/user/<uuid:user_id>', methods=['GET'])
 @limiter.limit("10/minute")
 @require_access_level(5, request)
 def get_user_details_by_admin(public_id, request, user_id):
 
-    aws_details = AwsDetails.query.filter_by(public_id=user_id).first()
+    body = get_details_json(str(user_id), 'admin')
 
-    if not aws_details:
+    if not body:
         return jsonify({ 'message': 'Where dey gone' }), 404
 
-    user_data = {}
-    user_data['public_id'] = aws_details.public_id
-    user_data['aws_CreateUserRequestId'] = aws_details.aws_CreateUserRequestId
-    user_data['aws_UserId'] = aws_details.aws_UserId
-    user_data['aws_UserName'] = aws_details.aws_UserName
-    user_data['aws_PolicyName'] = aws_details.aws_PolicyName
-    user_data['aws_Arn'] = aws_details.aws_Arn
-    user_data['aws_CreateDate'] = aws_details.aws_CreateDate
-
-    return jsonify(user_data)
+    return app.response_class(body, mimetype='application/json')
 
 # -----------------------------------------------------------------------------
 # generate presigned urls
@@ -123,10 +244,15 @@ def generate_presigned_urls(public_id, request):
     bucket_name = collection_name.lower()
     urls = []
 
+    # one credential lookup per request, not one per object
+    credentials = get_presign_credentials(public_id)
+    if not credentials:
+        return jsonify({ 'message': 'Unable to generate pre-signed URLs' }), 500
+
     for object_id in objects:
         resp = None
         response = {}
-        resp = create_presigned_url(bucket_name, object_id, expiration, public_id)
+        resp = create_presigned_url(credentials, bucket_name, object_id, expiration)
         if resp:
             response['foto_id'] = object_id
             response['fields']  = resp['fields']
@@ -146,6 +272,59 @@ def system_running():
     app.logger.info("Praise the FSM! The sauce is ready")
     return jsonify({ 'message': 'System running...' }), 200
 
+# -----------------------------------------------------------------------------
+# hit rates and sizes of the in-process caches for this worker
+@bp.route('/aws/admin/caches', methods=['GET'])
+@limiter.limit("10/minute")
+@require_access_level(5, request)
+def cache_stats(public_id, request):
+    return jsonify({ 'credentials': credential_cache.stats(),
+                     'access': access_cache.stats(),
+                     'details': details_cache.stats() }), 200
+
+# -----------------------------------------------------------------------------
+# prometheus metrics for every worker on this host
+@bp.route('/aws/metrics', methods=['GET'])
+@limiter.limit("60/minute")
+def metrics():
+    return app.response_class(registry.render(),
+                              mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# -----------------------------------------------------------------------------
+# request profiles written by this host's workers, newest first
+@bp.route('/aws/admin/profiles', methods=['GET'])
+@limiter.limit("30/minute")
+@require_access_level(5, request)
+def get_profiles(public_id, request):
+
+    directory = app.config['PROFILE_DIR']
+    if not directory:
+        return jsonify({ 'enabled': False, 'profiles': [] }), 200
+
+    return jsonify({ 'enabled': True, 'profiles': list_profiles(directory) }), 200
+
+# -----------------------------------------------------------------------------
+# a request profile as a pstats file, or the top functions with ?format=text
+@bp.route('/aws/admin/profiles/<name>', methods=['GET'])
+@limiter.limit("30/minute")
+@require_access_level(5, request)
+def get_profile(public_id, request, name):
+
+    directory = app.config['PROFILE_DIR']
+    if not directory or not PROFILE_NAME.match(name) or \
+       not os.path.isfile(os.path.join(directory, name)):
+        return jsonify({ 'message': 'Where dey gone' }), 404
+
+    if request.args.get('format') == 'text':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'calls'):
+            return jsonify({ 'message': 'sort must be cumulative, tottime or calls' }), 400
+        return app.response_class(profile_text(os.path.join(directory, name), sort=sort),
+                                  mimetype='text/plain')
+
+    return send_from_directory(os.path.abspath(directory), name,
+                               mimetype='application/octet-stream', as_attachment=True)
+
 # -----------------------------------------------------------------------------
 # route for testing rate limit works - generates 429 if more than two calls
 # per minute to this route - restricted to admin users and above
@@ -0,0 +1,313 @@
+# app/metrics.py
+import bisect
+import fcntl
+import json
+import os
+import threading
+import time
+
+# -----------------------------------------------------------------------------
+# simple in-process metrics. histograms use fixed upper bounds (in seconds)
+# and keep a count per bucket plus a running sum, per label. labels are a
+# single value or a tuple of values matching the metric's label names
+# -----------------------------------------------------------------------------
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram(object):
+
+    type = 'histogram'
+
+    def __init__(self, name, description='', buckets=DEFAULT_BUCKETS, labels=('name',)):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = { 'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0 }
+                self._series[label] = series
+            series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def snapshot(self):
+        # cumulative counts per upper bound, the last one being +Inf
+        with self._lock:
+            result = {}
+            for label, series in self._series.items():
+                cumulative = []
+                total = 0
+                for count in series['counts']:
+                    total += count
+                    cumulative.append(total)
+                result[label] = { 'buckets': list(zip(self.buckets + (float('inf'),), cumulative)),
+                                  'sum': series['sum'],
+                                  'count': series['count'] }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def state(self):
+        # json friendly copy of the raw series for combining across workers
+        with self._lock:
+            return [[_label_values(label), series['counts'][:], series['sum'], series['count']]
+                    for label, series in self._series.items()]
+
+    @staticmethod
+    def merge(into, state):
+        for values, counts, total, count in state:
+            key = tuple(values)
+            if key not in into:
+                into[key] = [[0] * len(counts), 0.0, 0]
+            series = into[key]
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+
+    def render(self, merged):
+        lines = []
+        for values, (counts, total, count) in sorted(merged.items()):
+            labels = list(zip(self.labels, values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (self.name,
+                             _format_labels(labels + [('le', _format_bound(bound))]), cumulative))
+            lines.append('%s_sum%s %r' % (self.name, _format_labels(labels), total))
+            lines.append('%s_count%s %d' % (self.name, _format_labels(labels), count))
+        return lines
+
+# -----------------------------------------------------------------------------
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, description='', labels=('name',)):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label, amount=1):
+        with self._lock:
+            self._series[label] = self._series.get(label, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._series)
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def state(self):
+        with self._lock:
+            return [[_label_values(label), value] for label, value in self._series.items()]
+
+    @staticmethod
+    def merge(into, state):
+        for values, value in state:
+            key = tuple(values)
+            into[key] = into.get(key, 0) + value
+
+    def render(self, merged):
+        return ['%s%s %r' % (self.name, _format_labels(list(zip(self.labels, values))), value)
+                for values, value in sorted(merged.items())]
+
+# -----------------------------------------------------------------------------
+
+def _label_values(label):
+    if isinstance(label, tuple):
+        return [str(value) for value in label]
+    return [str(label)]
+
+def _format_bound(bound):
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(float(bound))
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, _escape(value)) for name, value in labels) + '}'
+
+# -----------------------------------------------------------------------------
+# every metric that /aws/metrics exposes is registered here. with more than one
+# worker each one writes its raw series to <METRICS_DIR>/<pid>.json every few
+# seconds and whichever worker is scraped adds them all up. files left by
+# workers that have gone are folded into one archive file so counters never
+# go backwards and the directory doesn't grow with every restart
+# -----------------------------------------------------------------------------
+
+ARCHIVE = 'archive.json'
+LOCK = '.lock'
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._metrics = {}
+        self.directory = None
+        self.interval = 5
+        self._flusher = None
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def init_app(self, app):
+        self.directory = app.config.get('METRICS_DIR') or None
+        self.interval = float(app.config.get('METRICS_FLUSH_INTERVAL', 5))
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            self._start_flusher()
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+    # -------------------------------------------------------------------------
+
+    def _start_flusher(self):
+        if self._flusher and self._flusher.is_alive():
+            return
+
+        def flush_forever():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.flush()
+                except OSError: # pragma: no cover
+                    pass
+
+        self._flusher = threading.Thread(target=flush_forever, name='metrics-flush', daemon=True)
+        self._flusher.start()
+
+    def after_fork(self):
+        # series inherited from the parent were already counted there and the
+        # flusher thread didn't come with us
+        self.reset()
+        self._flusher = None
+        if self.directory:
+            self._start_flusher()
+
+    def collect(self):
+        return { name: metric.state() for name, metric in self._metrics.items() }
+
+    def flush(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, str(os.getpid())+'.json')
+        _write_json(path, self.collect())
+
+    # -------------------------------------------------------------------------
+
+    def _worker_states(self):
+        # own series live, everyone else's from their last flush
+        self.flush()
+        states = []
+        with open(os.path.join(self.directory, LOCK), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                archive_path = os.path.join(self.directory, ARCHIVE)
+                archive = _read_json(archive_path) or {}
+                archived = False
+                for filename in os.listdir(self.directory):
+                    if not filename.endswith('.json') or filename == ARCHIVE:
+                        continue
+                    path = os.path.join(self.directory, filename)
+                    state = _read_json(path)
+                    if state is None:
+                        continue
+                    if _pid_alive(filename[:-5]):
+                        states.append(state)
+                    else:
+                        archive = self._merge_states([archive, state], raw=True)
+                        os.remove(path)
+                        archived = True
+                if archived:
+                    _write_json(archive_path, archive)
+                states.append(archive)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return states
+
+    def _merge_states(self, states, raw=False):
+        merged = {}
+        for state in states:
+            for name, series in state.items():
+                metric = self._metrics.get(name)
+                if metric is None:
+                    continue
+                metric.merge(merged.setdefault(name, {}), series)
+        if not raw:
+            return merged
+        # back to the state format so it can be written out
+        result = {}
+        for name, series in merged.items():
+            if self._metrics[name].type == 'histogram':
+                result[name] = [[list(key), value[0], value[1], value[2]]
+                                for key, value in series.items()]
+            else:
+                result[name] = [[list(key), value] for key, value in series.items()]
+        return result
+
+    def aggregate(self):
+        if self.directory:
+            return self._merge_states(self._worker_states())
+        return self._merge_states([self.collect()])
+
+    def render(self):
+        merged = self.aggregate()
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.description))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            lines.extend(metric.render(merged.get(name, {})))
+        return '\n'.join(lines) + '\n'
+
+# -----------------------------------------------------------------------------
+
+def _read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_path, path)
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return False
+    except ProcessLookupError:
+        return False
+    except PermissionError: # pragma: no cover
+        return True
+    return True
+
+registry = MetricsRegistry()
+os.register_at_fork(after_in_child=registry.after_fork)
@@ -10,12 +10,34 @@ class AwsDetails(db.Model):
 
     __tablename__ = 'aws_details'
 
-    public_id = db.Column(db.String(36), primary_key=True, nullable=False)
-    aws_CreateUserRequestId = db.Column(db.String(300))
-    aws_UserId = db.Column(db.String(300), unique=True)
-    aws_UserName = db.Column(db.String(300), unique=True)
-    aws_AccessKeyId = db.Column(db.String(300), unique=True)
-    aws_SecretAccessKey = db.Column(db.String(300), unique=True)
-    aws_PolicyName = db.Column(db.String(100))
-    aws_Arn = db.Column(db.String(500), unique=True)
+    # public ids are kept as strings in python, a native uuid in postgres.
+    # the key pair is fernet encrypted with a random iv so it is never
+    # unique indexed - see migrations/versions/4cdeb6579e3b
+    public_id = db.Column(db.Uuid(as_uuid=False), primary_key=True, nullable=False)
+    aws_CreateUserRequestId = db.Column(db.String(64))
+    aws_UserId = db.Column(db.String(128), unique=True)
+    aws_UserName = db.Column(db.String(64), unique=True)
+    aws_AccessKeyId = db.Column(db.String(200))
+    aws_SecretAccessKey = db.Column(db.String(200))
+    aws_PolicyName = db.Column(db.String(128))
+    aws_Arn = db.Column(db.String(256), unique=True)
     aws_CreateDate = db.Column(db.TIMESTAMP(), nullable=False)
+
+#-----------------------------------------------------------------------------#
+
+class ProvisioningJob(db.Model):
+
+    __tablename__ = 'provisioning_jobs'
+
+    job_id = db.Column(db.Uuid(as_uuid=False), primary_key=True, nullable=False)
+    # bulk jobs cover many users so have no public_id
+    public_id = db.Column(db.Uuid(as_uuid=False), nullable=True, index=True)
+    status = db.Column(db.String(20), nullable=False)
+    # steps run concurrently so this can be several step names joined up
+    current_step = db.Column(db.Text)
+    steps = db.Column(db.JSON)
+    total_seconds = db.Column(db.Float)
+    error = db.Column(db.String(500))
+    result = db.Column(db.JSON)
+    created = db.Column(db.TIMESTAMP(), nullable=False)
+    updated = db.Column(db.TIMESTAMP(), nullable=False)
@@ -0,0 +1,134 @@
+# app/policies.py
+import json
+import os
+import re
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'main')
+
+# named policy templates. which user and bucket template is used comes from
+# config so we can switch version without a code change
+TEMPLATE_FILES = {
+    'standardpolicy': 'standardpolicy.txt',
+    'bucket_policy': 'bucket_policy.txt',
+    'v2bucket_policy': 'v2bucket_policy.txt',
+}
+
+# placeholders in the template files and the render argument they take
+PLACEHOLDERS = {
+    'XXXXXX': 'resource_name',
+    'AAAAAA': 'principal_arn',
+}
+
+# aws limits, counted without whitespace which compact json doesn't have
+SIZE_LIMITS = {
+    'iam_user': 2048,
+    'bucket': 20480,
+}
+
+EFFECTS = ('Allow', 'Deny')
+
+# -----------------------------------------------------------------------------
+# policy templates are read and parsed once at startup. rendering only ever
+# puts json escaped values inside string literals of an already validated
+# document so the output is always valid json and can be size checked here
+# rather than aws telling us after a round trip
+# -----------------------------------------------------------------------------
+
+class PolicyError(Exception):
+    pass
+
+# -----------------------------------------------------------------------------
+
+def _validate(document):
+    if not isinstance(document, dict):
+        raise PolicyError('policy must be a json object')
+    if 'Version' not in document:
+        raise PolicyError('policy has no Version')
+    statements = document.get('Statement')
+    if isinstance(statements, dict):
+        statements = [statements]
+    if not isinstance(statements, list) or not statements:
+        raise PolicyError('policy has no Statement list')
+    for statement in statements:
+        if not isinstance(statement, dict):
+            raise PolicyError('statement must be a json object')
+        if statement.get('Effect') not in EFFECTS:
+            raise PolicyError('statement has invalid Effect ['+str(statement.get('Effect'))+']')
+        if 'Action' not in statement and 'NotAction' not in statement:
+            raise PolicyError('statement has no Action or NotAction')
+
+# -----------------------------------------------------------------------------
+
+class PolicyTemplate(object):
+
+    def __init__(self, name, text):
+        self.name = name
+        try:
+            self.document = json.loads(text)
+        except ValueError as e:
+            raise PolicyError('['+name+'] is not valid json: '+str(e))
+        _validate(self.document)
+
+        # compact json split on the placeholders, e.g. ['{..."arn:aws:s3:::',
+        # 'resource_name', '/*"...}'] - every other part is an argument name
+        compact = json.dumps(self.document, separators=(',', ':'))
+        pattern = '(' + '|'.join(re.escape(token) for token in PLACEHOLDERS) + ')'
+        self._parts = [PLACEHOLDERS.get(part, part) for part in re.split(pattern, compact)]
+        self.arguments = set(self._parts[1::2])
+
+    def render(self, limit=None, **values):
+        missing = self.arguments - set(values)
+        if missing:
+            raise PolicyError('['+self.name+'] needs '+', '.join(sorted(missing)))
+
+        # escape each value as a json string body so it can't break out
+        escaped = { key: json.dumps(str(value))[1:-1] for key, value in values.items() }
+        parts = self._parts[:]
+        for i in range(1, len(parts), 2):
+            parts[i] = escaped[parts[i]]
+        policy = ''.join(parts)
+
+        if limit and len(policy) > SIZE_LIMITS[limit]:
+            raise PolicyError('['+self.name+'] is '+str(len(policy))+' characters, over the '+
+                              limit+' limit of '+str(SIZE_LIMITS[limit]))
+        return policy
+
+# -----------------------------------------------------------------------------
+
+class PolicyTemplates(object):
+
+    def __init__(self, template_dir=TEMPLATE_DIR, files=TEMPLATE_FILES):
+        self.template_dir = template_dir
+        self.files = files
+        self._templates = {}
+        self._errors = {}
+
+    def init_app(self, app):
+        self.load()
+        for name, error in self._errors.items():
+            app.logger.error("Policy template [%s] not loaded: %s", name, error)
+        for key in ('USER_POLICY_TEMPLATE', 'BUCKET_POLICY_TEMPLATE'):
+            if app.config[key] not in self.files:
+                app.logger.error("%s [%s] is not a known policy template", key, app.config[key])
+
+    def load(self):
+        templates = {}
+        errors = {}
+        for name, filename in self.files.items():
+            try:
+                with open(os.path.join(self.template_dir, filename)) as file:
+                    templates[name] = PolicyTemplate(name, file.read())
+            except OSError as e:
+                errors[name] = 'could not read ['+filename+']: '+str(e)
+            except PolicyError as e:
+                errors[name] = str(e)
+        self._templates = templates
+        self._errors = errors
+
+    def get(self, name):
+        template = self._templates.get(name)
+        if template is None:
+            raise PolicyError(self._errors.get(name, 'no policy template called ['+name+']'))
+        return template
+
+policy_templates = PolicyTemplates()
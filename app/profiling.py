@@ -0,0 +1,127 @@
+# app/profiling.py
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+# profile files are called <epoch ms>-<pid>-<method>-<path>.prof
+PROFILE_NAME = re.compile(r'^[0-9]+-[0-9]+-[A-Z]+-[a-z0-9_.-]*\.prof$')
+
+# -----------------------------------------------------------------------------
+# opt in cprofile of live requests. a request is profiled if it sends the
+# PROFILE_HEADER with the PROFILE_SECRET as its value, or at random at
+# PROFILE_SAMPLE_RATE. the pstats file goes in PROFILE_DIR and the newest
+# PROFILE_KEEP are kept. unless PROFILE_DIR is set the middleware isn't
+# installed at all so there's nothing on the request path.
+#
+# cprofile only sees the thread it was started on and only one request is
+# profiled at a time, others carry on unprofiled
+# -----------------------------------------------------------------------------
+
+class ProfilingMiddleware(object):
+
+    def __init__(self, wsgi_app, directory, sample_rate=0.0, header=None, secret=None,
+                 keep=100, logger=None):
+        self.wsgi_app = wsgi_app
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.environ_key = 'HTTP_' + header.upper().replace('-', '_') if header else None
+        self.secret = secret
+        self.keep = keep
+        self.logger = logger
+        self._busy = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _wanted(self, environ):
+        if self.secret and self.environ_key:
+            value = environ.get(self.environ_key)
+            if value and hmac.compare_digest(value.encode('utf-8'), self.secret.encode('utf-8')):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self._wanted(environ) or not self._busy.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+
+        try:
+            name = _profile_name(environ)
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+
+            def start_response_with_id(status, headers, exc_info=None):
+                headers = list(headers) + [('X-Profile-Id', name)]
+                return start_response(status, headers, exc_info)
+
+            profile.enable()
+            try:
+                response = self.wsgi_app(environ, start_response_with_id)
+            finally:
+                profile.disable()
+
+            profile.dump_stats(os.path.join(self.directory, name))
+            self._prune()
+            if self.logger:
+                self.logger.info("Profiled %s %s in %.3fs to [%s]", environ.get('REQUEST_METHOD'),
+                                 environ.get('PATH_INFO'), time.perf_counter() - started, name)
+            return response
+        finally:
+            self._busy.release()
+
+    def _prune(self):
+        profiles = list_profiles(self.directory)
+        for profile in profiles[self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, profile['name']))
+            except OSError: # pragma: no cover
+                pass
+
+# -----------------------------------------------------------------------------
+
+def _profile_name(environ):
+    path = re.sub(r'[^a-z0-9_.-]+', '_', environ.get('PATH_INFO', '').lower()).strip('_')
+    method = re.sub(r'[^A-Z]', '', environ.get('REQUEST_METHOD', 'GET').upper())
+    return '%d-%d-%s-%s.prof' % (int(time.time() * 1000), os.getpid(), method, path[:80])
+
+# -----------------------------------------------------------------------------
+
+def list_profiles(directory):
+    # newest first
+    profiles = []
+    for name in os.listdir(directory):
+        if PROFILE_NAME.match(name):
+            path = os.path.join(directory, name)
+            try:
+                size = os.path.getsize(path)
+            except OSError: # pragma: no cover
+                continue
+            profiles.append({ 'name': name,
+                              'size': size,
+                              'created': int(name.split('-', 1)[0]) / 1000.0 })
+    profiles.sort(key=lambda profile: profile['name'], reverse=True)
+    return profiles
+
+def profile_text(path, limit=50, sort='cumulative'):
+    # top functions from a pstats file as text
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+# -----------------------------------------------------------------------------
+
+def init_app(app):
+    directory = app.config.get('PROFILE_DIR')
+    if not directory:
+        return
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app, directory,
+                                       sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                                       header=app.config['PROFILE_HEADER'],
+                                       secret=app.config['PROFILE_SECRET'],
+                                       keep=app.config['PROFILE_KEEP'],
+                                       logger=app.logger)
+    app.logger.info("Request profiling on, writing to [%s]", directory)
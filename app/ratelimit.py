@@ -0,0 +1,318 @@
+# app/ratelimit.py
+import errno
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from math import floor
+from urllib.parse import urlparse, parse_qs
+from limits.storage import Storage, SlidingWindowCounterSupport
+from limits.storage.base import TimestampedSlidingWindow
+
+MAGIC = b'PTRL'
+VERSION = 1
+
+# magic, version, slot count, stripe count - padded to HEADER_SIZE
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 64
+
+# key hash (0 means never used), expires at (epoch seconds), count
+SLOT = struct.Struct('<Qdq')
+
+# slots looked at for a key before giving up and reusing one
+PROBES = 16
+
+# struct flock for open file description locks - type, whence, start, length,
+# pid (always 0) padded to the size the kernel expects
+FLOCK = struct.Struct('hhqqi4x')
+
+# -----------------------------------------------------------------------------
+# rate limit counters in a memory mapped file so every worker on a host counts
+# against the same limits, without running redis. use with
+#   RATELIMIT_STORAGE_URI=mmap:///var/tmp/poptape_aws_ratelimit.bin?slots=65536
+#
+# the file is a fixed size hash table of 24 byte slots. keys are stored as a
+# 64 bit hash and are only ever probed for within one stripe of the table so
+# a check locks just that stripe - a threading lock for this process and an
+# fcntl lock on one byte for the others. on linux these are open file
+# description locks; classic posix locks belong to the whole process so the
+# kernel sees two threads holding different stripes as a deadlock.
+#
+# the layout is part of the file name, so a deploy that changes the slot or
+# stripe count gets a new empty file and never resizes one that workers of
+# the old deploy still have mapped.
+#
+# expired slots are reused in place. if every slot a key could go in is live
+# the one expiring soonest is taken, which can only make a limit more
+# lenient, never stricter.
+#
+# the sliding window counter keeps both windows of a limit in the stripe of
+# the limit key so a check is read, compare and write under a single lock.
+# moving window needs a timestamp per hit and isn't supported
+# -----------------------------------------------------------------------------
+
+# every storage still open in this process, reopened in the child after a fork
+_instances = weakref.WeakSet()
+
+def _after_fork_all():
+    for storage in list(_instances):
+        storage._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_all)
+
+# -----------------------------------------------------------------------------
+
+class SharedMemoryStorage(Storage, SlidingWindowCounterSupport, TimestampedSlidingWindow):
+
+    STORAGE_SCHEME = ['mmap']
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+
+        parsed = urlparse(uri)
+        query = { key: values[-1] for key, values in parse_qs(parsed.query).items() }
+        path = parsed.netloc + parsed.path
+        if not path:
+            raise ValueError('mmap storage needs a file, e.g. mmap:///var/tmp/ratelimit.bin')
+
+        self.stripes = int(options.get('stripes', query.get('stripes', 64)))
+        slots = int(options.get('slots', query.get('slots', 65536)))
+        # every stripe is the same size
+        self.per_stripe = max(1, slots // self.stripes)
+        self.slots = self.per_stripe * self.stripes
+        self.size = HEADER_SIZE + self.slots * SLOT.size
+        self.path = '%s.v%d-%dx%d' % (path, VERSION, self.slots, self.stripes)
+
+        self._open()
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+        _instances.add(self)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions)
+
+    def _open(self):
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        header = (MAGIC, VERSION, self.slots, self.stripes)
+        self._lock_byte(0)
+        try:
+            # only ever grown, other processes may have it mapped
+            if os.fstat(self._fd).st_size < self.size:
+                os.ftruncate(self._fd, self.size)
+            existing = os.pread(self._fd, HEADER.size, 0)
+            if existing == bytes(HEADER.size):
+                # new file
+                os.pwrite(self._fd, HEADER.pack(*header), 0)
+                existing = HEADER.pack(*header)
+        finally:
+            self._unlock_byte(0)
+        if HEADER.unpack(existing) != header:
+            os.close(self._fd)
+            raise ValueError('%s is not a rate limit file with this layout' % self.path)
+        self._map = mmap.mmap(self._fd, self.size)
+
+    def _after_fork(self):
+        # the child shares the parent's open file description, and so its
+        # locks, until it opens the file itself. the shared mapping is kept. a
+        # thread lock held by another thread at fork time would never be
+        # released in the child
+        inherited = self._fd
+        self._fd = os.open(self.path, os.O_RDWR)
+        os.close(inherited)
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+
+    def _lock_byte(self, offset):
+        if hasattr(fcntl, 'F_OFD_SETLKW'):
+            fcntl.fcntl(self._fd, fcntl.F_OFD_SETLKW, FLOCK.pack(fcntl.F_WRLCK, 0, offset, 1, 0))
+            return
+        while True:
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+                return
+            except OSError as e:
+                # posix locks can report a deadlock that isn't one when
+                # threads are involved, just try again
+                if e.errno != errno.EDEADLK:
+                    raise
+
+    def _unlock_byte(self, offset):
+        if hasattr(fcntl, 'F_OFD_SETLKW'):
+            fcntl.fcntl(self._fd, fcntl.F_OFD_SETLK, FLOCK.pack(fcntl.F_UNLCK, 0, offset, 1, 0))
+        else:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    @property
+    def base_exceptions(self):
+        return (OSError, ValueError)
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') or 1
+
+    def _stripe(self, key_hash):
+        return key_hash % self.stripes
+
+    @contextmanager
+    def _locked(self, stripe):
+        with self._locks[stripe]:
+            # byte 0 is the header lock, stripes are the bytes after it
+            self._lock_byte(stripe + 1)
+            try:
+                yield
+            finally:
+                self._unlock_byte(stripe + 1)
+
+    def _find(self, stripe, key_hash, now):
+        # returns (offset, count, expires) for the key, or the offset to put it
+        # at with a count of 0 and expires None if it isn't live. caller holds
+        # the stripe lock
+        base = HEADER_SIZE + stripe * self.per_stripe * SLOT.size
+        start = (key_hash >> 32) % self.per_stripe
+        free = None
+        soonest = None
+        for i in range(min(PROBES, self.per_stripe)):
+            offset = base + ((start + i) % self.per_stripe) * SLOT.size
+            slot_hash, expires, count = SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                if expires > now:
+                    return offset, count, expires
+                return offset, 0, None
+            if slot_hash == 0:
+                # slots are never emptied, only expired, so the key can't be
+                # any further along
+                return (free if free is not None else offset), 0, None
+            if expires <= now:
+                if free is None:
+                    free = offset
+            elif soonest is None or expires < soonest[1]:
+                soonest = (offset, expires)
+        if free is not None:
+            return free, 0, None
+        return soonest[0], 0, None
+
+    def _read(self, stripe, key_hash, now):
+        _, count, expires = self._find(stripe, key_hash, now)
+        return count, expires
+
+    def _add(self, stripe, key_hash, expiry, amount, now):
+        offset, count, expires = self._find(stripe, key_hash, now)
+        if expires is None:
+            expires = now + expiry
+        count = max(count + amount, 0)
+        SLOT.pack_into(self._map, offset, key_hash, expires, count)
+        return count
+
+    def _clear(self, stripe, key_hash, now):
+        offset, _, expires = self._find(stripe, key_hash, now)
+        if expires is not None:
+            # leave the hash so probes carry on past this slot
+            SLOT.pack_into(self._map, offset, key_hash, 0.0, 0)
+
+    # -------------------------------------------------------------------------
+    # fixed window
+
+    def incr(self, key, expiry, amount=1):
+        key_hash = self._hash(key)
+        stripe = self._stripe(key_hash)
+        with self._locked(stripe):
+            return self._add(stripe, key_hash, expiry, amount, time.time())
+
+    def decr(self, key, amount=1):
+        key_hash = self._hash(key)
+        stripe = self._stripe(key_hash)
+        with self._locked(stripe):
+            now = time.time()
+            count, expires = self._read(stripe, key_hash, now)
+            if expires is None:
+                return 0
+            return self._add(stripe, key_hash, 0, -amount, now)
+
+    def get(self, key):
+        key_hash = self._hash(key)
+        stripe = self._stripe(key_hash)
+        with self._locked(stripe):
+            return self._read(stripe, key_hash, time.time())[0]
+
+    def get_expiry(self, key):
+        key_hash = self._hash(key)
+        stripe = self._stripe(key_hash)
+        with self._locked(stripe):
+            now = time.time()
+            expires = self._read(stripe, key_hash, now)[1]
+        return expires if expires is not None else now
+
+    def clear(self, key):
+        key_hash = self._hash(key)
+        stripe = self._stripe(key_hash)
+        with self._locked(stripe):
+            self._clear(stripe, key_hash, time.time())
+
+    # -------------------------------------------------------------------------
+    # sliding window counter
+
+    def _window(self, stripe, key, expiry, now):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        previous_count = self._read(stripe, self._hash(previous_key), now)[0]
+        current_count = self._read(stripe, self._hash(current_key), now)[0]
+        if previous_count == 0:
+            previous_ttl = 0.0
+        else:
+            previous_ttl = (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        stripe = self._stripe(self._hash(key))
+        with self._locked(stripe):
+            now = time.time()
+            previous_count, previous_ttl, current_count, _ = self._window(stripe, key, expiry, now)
+            weighted_count = previous_count * previous_ttl / expiry + current_count
+            if floor(weighted_count) + amount > limit:
+                return False
+            # the current window is needed until the end of the next one
+            current_key = self.sliding_window_keys(key, expiry, now)[1]
+            self._add(stripe, self._hash(current_key), 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key, expiry):
+        stripe = self._stripe(self._hash(key))
+        with self._locked(stripe):
+            return self._window(stripe, key, expiry, time.time())
+
+    def clear_sliding_window(self, key, expiry):
+        stripe = self._stripe(self._hash(key))
+        with self._locked(stripe):
+            now = time.time()
+            for window_key in self.sliding_window_keys(key, expiry, now):
+                self._clear(stripe, self._hash(window_key), now)
+
+    # -------------------------------------------------------------------------
+
+    def check(self):
+        return not self._map.closed
+
+    def reset(self):
+        # lock every stripe, always in the same order
+        for stripe in range(self.stripes):
+            self._locks[stripe].acquire()
+            self._lock_byte(stripe + 1)
+        try:
+            now = time.time()
+            live = 0
+            for offset in range(HEADER_SIZE, self.size, SLOT.size):
+                slot_hash, expires, _ = SLOT.unpack_from(self._map, offset)
+                if slot_hash and expires > now:
+                    live += 1
+            self._map[HEADER_SIZE:self.size] = bytes(self.size - HEADER_SIZE)
+            return live
+        finally:
+            for stripe in reversed(range(self.stripes)):
+                self._unlock_byte(stripe + 1)
+                self._locks[stripe].release()
@@ -1,10 +1,206 @@
 # app/services.py
+import asyncio
+import os
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+
+# -----------------------------------------------------------------------------
+# shared http client for calls to other poptape microservices. each worker
+# process gets its own pooled keep-alive session, every call is bounded by a
+# connect and read timeout and a circuit breaker stops us queueing workers up
+# behind a service that is already failing
+# -----------------------------------------------------------------------------
+
+class CircuitOpenError(Exception):
+    pass
+
+# -----------------------------------------------------------------------------
+
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        # when half open one trial call is let through, anything else fails
+        # fast until that call succeeds or fails
+        with self._lock:
+            state = self._state()
+            if state == 'open':
+                return False
+            if state == 'half-open':
+                self.opened_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+# -----------------------------------------------------------------------------
+
+class HttpClient(object):
+
+    def __init__(self, pool_size=10, connect_timeout=2.0, read_timeout=5.0,
+                 failure_threshold=5, reset_timeout=30):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.pool_size = app.config['HTTP_POOL_SIZE']
+        self.timeout = (app.config['HTTP_CONNECT_TIMEOUT'],
+                        app.config['HTTP_READ_TIMEOUT'])
+        self.breaker = CircuitBreaker(app.config['HTTP_BREAKER_FAILURES'],
+                                      app.config['HTTP_BREAKER_RESET'])
+        self.close()
+
+    @property
+    def session(self):
+        # sockets can't be shared across a fork so a worker never uses a
+        # session built in its parent
+        pid = os.getpid()
+        with self._lock:
+            if self._session is None or self._pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                      pool_maxsize=self.pool_size,
+                                      max_retries=0)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                self._pid = pid
+            return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+    def get(self, url, headers=None):
+
+        if not self.breaker.allow():
+            raise CircuitOpenError('circuit open for ['+url+']')
+
+        try:
+            r = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if r.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        return r
+
+http_client = HttpClient()
 
 # -----------------------------------------------------------------------------
 
 def call_requests(url, headers):
-    r = requests.get(url, headers=headers)
+    r = http_client.get(url, headers=headers)
     return r
 
+# -----------------------------------------------------------------------------
+# asyncio version of the above for the asgi server (app/asgi.py) so a worker
+# can wait on the access service for lots of requests at once without a
+# thread each. a thin wrapper round an httpx AsyncClient, imported when first
+# used so the sync workers never load it. it shares the sync client's
+# timeouts and circuit breaker so both count failures against the same
+# service but has its own, bigger, connection limit. an httpx client belongs
+# to the event loop it was first used on so there's one per loop
+# -----------------------------------------------------------------------------
+
+class AsyncHttpClient(object):
+
+    def __init__(self, sync_client, max_connections=100):
+        self.sync_client = sync_client
+        self.max_connections = max_connections
+        self._loop = None
+        self._client = None
+
+    def init_app(self, app):
+        self.max_connections = app.config['ASGI_HTTP_CONNECTIONS']
+        self._loop = None
+        self._client = None
+
+    @property
+    def breaker(self):
+        return self.sync_client.breaker
+
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            import httpx
+            connect_timeout, read_timeout = self.sync_client.timeout
+            # no pool timeout, requests wait their turn for a connection
+            # like they did for a thread
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                follow_redirects=False)
+            self._loop = loop
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and self._loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+    async def get(self, url, headers=None):
+
+        import httpx
+
+        if not self.breaker.allow():
+            raise CircuitOpenError('circuit open for ['+url+']')
+
+        try:
+            r = await self.client().get(url, headers=headers)
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            raise
+
+        if r.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        return r
 
+async_http_client = AsyncHttpClient(http_client)
@@ -0,0 +1,196 @@
+# app/taskgraph.py
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+
+# -----------------------------------------------------------------------------
+# tiny dependency graph executor. each step declares the steps it needs and is
+# started on a thread pool as soon as they have all finished. if any step
+# fails nothing new is started, running steps are let finish and the undo of
+# every step that succeeded is run in reverse order of completion.
+#
+# progress callbacks and inline steps only ever run on the calling thread so
+# they can safely use its db session
+# -----------------------------------------------------------------------------
+
+class StepError(Exception):
+    pass
+
+# -----------------------------------------------------------------------------
+
+class Step(object):
+
+    def __init__(self, name, run, requires=(), undo=None, inline=False):
+        self.name = name
+        self.run = run
+        self.requires = tuple(requires)
+        self.undo = undo
+        self.inline = inline
+
+# -----------------------------------------------------------------------------
+
+class StepTimer(object):
+    # per step and total wall clock timings for one run of a graph. steps are
+    # (name, seconds, offset) where offset is when the step started relative
+    # to the start of the run
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.steps = []
+        self.running = []
+        self.failed = None
+        self.total = None
+        self.began = time.perf_counter()
+
+    @property
+    def current(self):
+        if self.failed:
+            return self.failed
+        if self.running:
+            return ', '.join(self.running)
+        return None
+
+    def started(self, name):
+        self.running.append(name)
+        self._notify()
+
+    def stopped(self, name, started, ended, ok=True):
+        self.running.remove(name)
+        if ok:
+            self.steps.append((name, ended - started, started - self.began))
+            self.steps.sort(key=lambda step: step[2])
+        elif not self.failed:
+            self.failed = name
+        self._notify()
+
+    def finish(self):
+        self.total = time.perf_counter() - self.began
+        self._notify()
+
+    def _notify(self):
+        if self.progress:
+            self.progress(self)
+
+# -----------------------------------------------------------------------------
+
+def _timed(step, context, wrap):
+    started = time.perf_counter()
+    try:
+        with (wrap() if wrap else nullcontext()):
+            context[step.name] = step.run(context)
+    except Exception as e:
+        return started, time.perf_counter(), e
+    return started, time.perf_counter(), None
+
+# -----------------------------------------------------------------------------
+
+def _check_graph(steps):
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError('duplicate step names in graph')
+    done = set()
+    remaining = list(steps)
+    while remaining:
+        ready = [step for step in remaining if set(step.requires) <= done]
+        if not ready:
+            raise ValueError('graph has a cycle or a missing step: '+
+                             ', '.join(step.name for step in remaining))
+        for step in ready:
+            done.add(step.name)
+            remaining.remove(step)
+
+# -----------------------------------------------------------------------------
+
+def critical_path(steps, timer):
+    # walks back from the step that finished last, each time picking the
+    # requirement that finished latest
+    by_name = { step.name: step for step in steps }
+    finished = { name: offset + seconds for name, seconds, offset in timer.steps }
+    if not finished:
+        return []
+    path = [max(finished, key=finished.get)]
+    while True:
+        requires = [name for name in by_name[path[-1]].requires if name in finished]
+        if not requires:
+            break
+        path.append(max(requires, key=finished.get))
+    return list(reversed(path))
+
+# -----------------------------------------------------------------------------
+
+def run_graph(steps, context, timer=None, max_workers=4, wrap=None, logger=None):
+    # returns True if every step succeeded. step results are put in context
+    # under the step name
+
+    _check_graph(steps)
+    timer = timer or StepTimer()
+    pending = list(steps)
+    completed = []
+    running = {}
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='steps') as pool:
+        while running or (pending and not error):
+
+            if not error:
+                done = set(completed)
+                for step in [step for step in pending if set(step.requires) <= done]:
+                    pending.remove(step)
+                    timer.started(step.name)
+                    if step.inline:
+                        future = Future()
+                        future.set_result(_timed(step, context, None))
+                        running[future] = step
+                    else:
+                        running[pool.submit(_timed, step, context, wrap)] = step
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                started, ended, step_error = future.result()
+                timer.stopped(step.name, started, ended, ok=step_error is None)
+                if step_error is None:
+                    completed.append(step.name)
+                    if logger:
+                        logger.debug("step [%s] done in %.3fs", step.name, ended - started)
+                elif not error:
+                    error = (step.name, step_error)
+
+    if error:
+        if logger:
+            logger.error("step [%s] failed: %s", error[0], str(error[1]))
+        _rollback(steps, completed, context, logger)
+        timer.finish()
+        return False
+
+    timer.finish()
+    if logger:
+        path = critical_path(steps, timer)
+        timings = ', '.join('%s=%.3fs' % (name, seconds) for name, seconds, _ in timer.steps)
+        logger.info("graph done in %.3fs, critical path [%s], steps [%s]",
+                    timer.total, ' -> '.join(path), timings)
+    return True
+
+# -----------------------------------------------------------------------------
+
+def rollback(steps, context, logger=None):
+    # undoes every step that has a result in the context, e.g. when something
+    # after a successful run fails. steps must be listed in dependency order
+    completed = [step.name for step in steps if step.name in context]
+    _rollback(steps, completed, context, logger)
+
+# -----------------------------------------------------------------------------
+
+def _rollback(steps, completed, context, logger):
+    by_name = { step.name: step for step in steps }
+    for name in reversed(completed):
+        step = by_name[name]
+        if not step.undo:
+            continue
+        try:
+            step.undo(context)
+            if logger:
+                logger.debug("rolled back step [%s]", name)
+        except Exception as e:
+            if logger:
+                logger.error("could not roll back step [%s]: %s", name, str(e))
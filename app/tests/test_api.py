@@ -3,10 +3,12 @@ import json
 import os
 import uuid
 from mock import patch
+from contextlib import contextmanager
 from functools import wraps
 from .fixtures import getPublicID, getSpecificPublicID
 from flask import jsonify
 from moto import mock_aws
+from sqlalchemy import event
 from pathlib import Path
 
 # have to mock the require_access_level decorator here before it
@@ -25,6 +27,7 @@ def mock_dec(access_level, request):
             pub_id = getSpecificPublicID()
             return f(pub_id, request, *args, **kwargs)
 
+        decorated.access_level = access_level
         return decorated
     return actual_decorator
 
@@ -34,6 +37,7 @@ patch('app.decorators.require_access_level', mock_dec).start()
 # from app import create_app, db
 from app import create_app, db
 from app.config import TestConfig
+from app.extensions import aws_clients
 from flask_testing import TestCase as FlaskTestCase
 
 
@@ -59,11 +63,25 @@ class MyTest(FlaskTestCase):
 
     def setUp(self):
         db.create_all()
+        from app.metrics import registry
+        registry.reset()
 
     def tearDown(self):
         db.session.remove()
         db.drop_all()
 
+    @contextmanager
+    def _count_statements(self):
+        # every sql statement run against the db while in the block
+        statements = []
+        def capture(connection, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
 ###############################################################################
 #                                tests                                        #
 ###############################################################################
@@ -173,7 +191,9 @@ class MyTest(FlaskTestCase):
 
     def test_create_user_fail_missing_standard_policy_file(self):
 
-        # rename the standardpolicy file so the api call fails
+        from app.policies import policy_templates
+
+        # rename the standardpolicy file so loading the templates fails
         mod_path = Path(__file__).parent
         relpath = '../main/standardpolicy.txt'
         renamed = '../main/_standardpolicy.txt'
@@ -182,6 +202,10 @@ class MyTest(FlaskTestCase):
 
         if Path.exists(relative_filepath):
             os.rename(relative_filepath, renamed_filepath)
+        try:
+            policy_templates.load()
+        finally:
+            os.rename(renamed_filepath, relative_filepath)
 
         # valid payload with a random UUID
         payload = {"public_id": str(uuid.uuid4())}
@@ -192,16 +216,21 @@ class MyTest(FlaskTestCase):
             headers=headers,
         )
 
-        self.assertTrue(response.status_code, 500)
+        self.assertEqual(response.status_code, 500)
         self.assertTrue("Failed to create user on AWS" in response.get_data(as_text=True))
 
-        os.rename(renamed_filepath, relative_filepath)
+        # templates are checked before anything is created on aws
+        self.assertEqual(aws_clients.iam.list_users()['Users'], [])
+        self.assertEqual(aws_clients.s3.list_buckets()['Buckets'], [])
+        policy_templates.load()
 
     # -----------------------------------------------------------------------------
 
     def test_create_user_fail_missing_bucket_policy_file(self):
 
-        # rename the bucket_policy file so the api call fails
+        from app.policies import policy_templates
+
+        # rename the bucket_policy file so loading the templates fails
         mod_path = Path(__file__).parent
         relpath = '../main/bucket_policy.txt'
         renamed = '../main/_bucket_policy.txt'
@@ -210,6 +239,10 @@ class MyTest(FlaskTestCase):
 
         if Path.exists(relative_filepath):
             os.rename(relative_filepath, renamed_filepath)
+        try:
+            policy_templates.load()
+        finally:
+            os.rename(renamed_filepath, relative_filepath)
 
         # valid payload with a random UUID
         payload = {"public_id": str(uuid.uuid4())}
@@ -220,47 +253,38 @@ class MyTest(FlaskTestCase):
             headers=headers,
         )
 
-        self.assertTrue(response.status_code, 500)
+        self.assertEqual(response.status_code, 500)
         self.assertTrue("Failed to create user on AWS" in response.get_data(as_text=True))
-
-        os.rename(renamed_filepath, relative_filepath)
+        policy_templates.load()
 
     # -----------------------------------------------------------------------------
 
     def test_create_user_fail_bad_standard_policy_file(self):
 
-        # rename the good standardpolicy file
-        mod_path = Path(__file__).parent
-        relpath = '../main/standardpolicy.txt'
-        renamed = '../main/GDstandardpolicy.txt'
-        relative_filepath = (mod_path / relpath).resolve()
-        renamed_filepath = (mod_path / renamed).resolve()
-
-        if Path.exists(relative_filepath):
-            os.rename(relative_filepath, renamed_filepath)
-
-        badfile = 'bad_aws_policy_files/bad_standardpolicy.txt'
-        badfile_filepath = (mod_path / badfile).resolve()
+        from app.policies import PolicyTemplates, TEMPLATE_FILES
+        from app.policies import policy_templates
 
-        if Path.exists(relative_filepath):
-            os.rename(relative_filepath, renamed_filepath)
-
-        if Path.exists(badfile_filepath):
-            os.rename(badfile_filepath, relative_filepath)
+        # point the standard policy at the bad one in the test files
+        mod_path = Path(__file__).parent
+        files = dict(TEMPLATE_FILES)
+        files['standardpolicy'] = str((mod_path / 'bad_aws_policy_files/bad_standardpolicy.txt').resolve())
+        bad_templates = PolicyTemplates(files=files)
+        bad_templates.load()
 
         # valid payload with a random UUID
         payload = {"public_id": getPublicID()}
         headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
-        response = self.client.post(
-            "/aws/user",
-            data=json.dumps(payload),
-            headers=headers,
-        )
+        with patch.object(policy_templates, '_templates', bad_templates._templates), \
+             patch.object(policy_templates, '_errors', bad_templates._errors):
+            response = self.client.post(
+                "/aws/user",
+                data=json.dumps(payload),
+                headers=headers,
+            )
 
-        self.assertTrue(response.status_code, 500)
+        self.assertEqual(response.status_code, 500)
         self.assertTrue("Failed to create user on AWS" in response.get_data(as_text=True))
-
-        os.rename(renamed_filepath, relative_filepath)
+        self.assertTrue('Effect' in bad_templates._errors['standardpolicy'])
 
     # -----------------------------------------------------------------------------
 
@@ -456,4 +480,533 @@ class MyTest(FlaskTestCase):
         self.assertTrue(response.status_code, 400)
         returned_data = json.loads(response.get_data(as_text=True))
         self.assertEqual(returned_data['message'], "Check ya inputs mate.")
-        self.assertEqual(returned_data['error'], "Additional properties are not allowed ('validjson' was unexpected)")
\ No newline at end of file
+        self.assertEqual(returned_data['error'], "Additional properties are not allowed ('validjson' was unexpected)")
+    # -----------------------------------------------------------------------------
+
+    def test_presigned_urls_reuse_cached_credentials(self):
+
+        from app.extensions import credential_cache
+
+        # create a user first
+        public_id = getSpecificPublicID()
+        payload = {"public_id": public_id}
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post(
+            "/aws/user",
+            data=json.dumps(payload),
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(public_id in credential_cache)
+
+        payload = { 'objects': [str(uuid.uuid4()), str(uuid.uuid4())] }
+        response = self.client.post("/aws/urls", data=json.dumps(payload), headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(public_id in credential_cache)
+        cached = credential_cache.get(public_id)
+
+        with self._count_statements() as statements:
+            response = self.client.post("/aws/urls", data=json.dumps(payload), headers=headers)
+        self.assertEqual(statements, [])
+        self.assertEqual(response.status_code, 201)
+        returned_data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(len(returned_data['aws_urls']), 2)
+        self.assertIs(credential_cache.get(public_id), cached)
+
+    # -----------------------------------------------------------------------------
+
+    def test_credential_cache_invalidated_on_provisioning(self):
+
+        from app.extensions import credential_cache
+        from app.main.create_user import create_aws_user
+
+        public_id = getSpecificPublicID()
+        credential_cache.set(public_id, 'stale')
+        self.assertTrue(create_aws_user(public_id))
+        self.assertFalse(public_id in credential_cache)
+
+    # -----------------------------------------------------------------------------
+
+    def test_get_user_details_served_from_cache(self):
+
+        from app.extensions import details_cache
+
+        public_id = getSpecificPublicID()
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post("/aws/user", data=json.dumps({"public_id": public_id}),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        first = self.client.get("/aws/user", headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.mimetype, 'application/json')
+        self.assertTrue(public_id in details_cache)
+
+        # second lookup must not touch the db
+        with self._count_statements() as statements:
+            second = self.client.get("/aws/user", headers=headers)
+            admin = self.client.get("/aws/user/"+public_id, headers=headers)
+        self.assertEqual(statements, [])
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.get_data(), first.get_data())
+        owner_data = json.loads(second.get_data(as_text=True))
+        admin_data = json.loads(admin.get_data(as_text=True))
+        self.assertTrue('aws_SecretAccessKey' in owner_data)
+        self.assertFalse('aws_SecretAccessKey' in admin_data)
+        self.assertFalse('aws_AccessKeyId' in admin_data)
+        self.assertEqual(admin_data['aws_UserName'], owner_data['aws_UserName'])
+
+        stats = details_cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['size'], 1)
+        self.assertTrue(stats['bytes'] > len(first.get_data()))
+
+    # -----------------------------------------------------------------------------
+
+    def test_cached_details_match_jsonify(self):
+
+        from app.main.details import get_details_json, VIEWS
+        from app.models import AwsDetails
+
+        public_id = getSpecificPublicID()
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post("/aws/user", data=json.dumps({"public_id": public_id}),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        row = db.session.get(AwsDetails, public_id)
+        # pretty printed, as jsonify does in debug mode
+        self.app.json.compact = False
+        try:
+            body = get_details_json(public_id, 'admin')
+            expected = jsonify({ field: getattr(row, field) for field in VIEWS['admin'] })
+        finally:
+            self.app.json.compact = None
+        self.assertEqual(body, expected.get_data())
+        self.assertTrue(b'\n  ' in body)
+
+    # -----------------------------------------------------------------------------
+
+    def test_details_cache_invalidated_on_provisioning(self):
+
+        from app.extensions import details_cache
+        from app.main.create_user import create_aws_user
+
+        public_id = getSpecificPublicID()
+        details_cache.set(public_id, { 'owner': b'stale', 'admin': b'stale' })
+        self.assertTrue(create_aws_user(public_id))
+        self.assertFalse(public_id in details_cache)
+        self.assertEqual(details_cache.stats()['bytes'], 0)
+
+    # -----------------------------------------------------------------------------
+
+    def test_get_cache_stats(self):
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.get('/aws/admin/caches', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        returned_data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(returned_data['details']['bytes'], 0)
+        self.assertTrue('hit_rate' in returned_data['credentials'])
+        self.assertTrue('access' in returned_data)
+    # -----------------------------------------------------------------------------
+
+    def test_create_user_async_job(self):
+
+        public_id = getSpecificPublicID()
+        payload = {"public_id": public_id}
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken',
+                    'Prefer': 'respond-async' }
+        response = self.client.post(
+            "/aws/user",
+            data=json.dumps(payload),
+            headers=headers,
+        )
+
+        self.assertEqual(response.status_code, 202)
+        returned_data = json.loads(response.get_data(as_text=True))
+        self.assertTrue(is_valid_uuid(returned_data['job_id']))
+        self.assertEqual(response.headers['Location'], returned_data['status_url'])
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.get(returned_data['status_url'], headers=headers)
+        self.assertEqual(response.status_code, 200)
+        job = json.loads(response.get_data(as_text=True))
+        self.assertEqual(job['public_id'], public_id)
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertIsNone(job['current_step'])
+        self.assertEqual(len(job['steps']), 12)
+        self.assertTrue('render_user_policy' in [s['step'] for s in job['steps']])
+        self.assertEqual(job['steps'][-1]['step'], 'save_user')
+        self.assertTrue(job['total_seconds'] >= max(s['offset'] + s['seconds'] for s in job['steps']) - 0.01)
+
+    # -----------------------------------------------------------------------------
+
+    def test_create_user_async_job_failure_reports_step(self):
+
+        public_id = getSpecificPublicID()
+        self.app.config['PROVISIONING_ASYNC'] = True
+        payload = {"public_id": public_id}
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post("/aws/user", data=json.dumps(payload), headers=headers)
+        self.assertEqual(response.status_code, 202)
+
+        # same user again fails as the iam user already exists
+        response = self.client.post("/aws/user", data=json.dumps(payload), headers=headers)
+        self.assertEqual(response.status_code, 202)
+        status_url = json.loads(response.get_data(as_text=True))['status_url']
+
+        response = self.client.get(status_url, headers=headers)
+        job = json.loads(response.get_data(as_text=True))
+        self.assertEqual(job['status'], 'failed')
+        self.assertEqual(job['current_step'], 'create_user')
+        self.assertTrue('create_user' in job['error'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_get_unknown_job_404(self):
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.get('/aws/user/jobs/'+getPublicID(), headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+    # -----------------------------------------------------------------------------
+
+    def test_get_job_needs_token(self):
+
+        headers = { 'Content-type': 'application/json' }
+        response = self.client.get('/aws/user/jobs/'+getPublicID(), headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    # -----------------------------------------------------------------------------
+
+    def test_job_only_visible_to_its_user(self):
+
+        import datetime
+        from app.models import ProvisioningJob
+
+        # the mocked access check always says the caller is getSpecificPublicID
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        jobs = { 'mine': getSpecificPublicID(), 'theirs': getPublicID(), 'bulk': None }
+        for name, owner in jobs.items():
+            db.session.add(ProvisioningJob(job_id=str(uuid.uuid5(uuid.NAMESPACE_DNS, name)),
+                                           public_id=owner, status='succeeded',
+                                           steps=[], created=now, updated=now))
+        db.session.commit()
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        codes = {}
+        for name in jobs:
+            job_id = str(uuid.uuid5(uuid.NAMESPACE_DNS, name))
+            codes[name] = (self.client.get('/aws/user/jobs/'+job_id, headers=headers).status_code,
+                           self.client.get('/aws/users/jobs/'+job_id, headers=headers).status_code)
+        self.assertEqual(codes, { 'mine': (200, 200), 'theirs': (404, 200), 'bulk': (404, 200) })
+
+        from app.main.views import get_provisioning_job_by_admin
+        self.assertEqual(get_provisioning_job_by_admin.access_level, 5)
+
+    # -----------------------------------------------------------------------------
+
+    def test_stale_job_reported_failed(self):
+
+        import datetime
+        from app.models import ProvisioningJob
+
+        # left running by a worker that went away
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        stale = datetime.datetime(2024, 1, 1)
+        for job_id, updated in (('stale', stale), ('fresh', now)):
+            db.session.add(ProvisioningJob(job_id=str(uuid.uuid5(uuid.NAMESPACE_DNS, job_id)),
+                                           public_id=getSpecificPublicID(), status='running',
+                                           steps=[], created=stale, updated=updated))
+        db.session.commit()
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.get('/aws/user/jobs/'+str(uuid.uuid5(uuid.NAMESPACE_DNS, 'stale')),
+                                   headers=headers)
+        job = json.loads(response.get_data(as_text=True))
+        self.assertEqual(job['status'], 'failed')
+        self.assertTrue('restarted' in job['error'])
+
+        response = self.client.get('/aws/user/jobs/'+str(uuid.uuid5(uuid.NAMESPACE_DNS, 'fresh')),
+                                   headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['status'], 'running')
+
+    # -----------------------------------------------------------------------------
+
+    def test_create_user_failure_rolls_back_aws_resources(self):
+
+        from botocore.exceptions import ClientError
+
+        public_id = getPublicID()
+        collection_name = 'z'+public_id.replace('-','')
+        error = ClientError({ 'Error': { 'Code': 'MalformedPolicy', 'Message': 'bad' } },
+                            'PutBucketPolicy')
+
+        with patch.object(aws_clients.s3, 'put_bucket_policy', side_effect=error):
+            payload = {"public_id": public_id}
+            headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+            response = self.client.post("/aws/user", data=json.dumps(payload), headers=headers)
+
+        self.assertEqual(response.status_code, 500)
+        users = [u['UserName'] for u in aws_clients.iam.list_users()['Users']]
+        buckets = [b['Name'] for b in aws_clients.s3.list_buckets()['Buckets']]
+        self.assertFalse(collection_name in users)
+        self.assertFalse(collection_name in buckets)
+
+    # -----------------------------------------------------------------------------
+
+    def test_bulk_create_users(self):
+
+        existing = getSpecificPublicID()
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post("/aws/user", data=json.dumps({"public_id": existing}),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        new_ids = [getPublicID() for _ in range(3)]
+        payload = { 'public_ids': new_ids + [existing] }
+        response = self.client.post("/aws/users", data=json.dumps(payload), headers=headers)
+
+        self.assertEqual(response.status_code, 202)
+        returned_data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(response.headers['Location'], returned_data['status_url'])
+
+        response = self.client.get(returned_data['status_url'], headers=headers)
+        self.assertEqual(response.status_code, 200)
+        job = json.loads(response.get_data(as_text=True))
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertIsNone(job['public_id'])
+        self.assertIsNone(job['current_step'])
+        report = job['result']
+        self.assertEqual([r['public_id'] for r in report['results']], payload['public_ids'])
+        self.assertEqual([r['status'] for r in report['results']],
+                         ['created', 'created', 'created', 'exists'])
+        self.assertEqual(report['summary']['created'], 3)
+
+        from app.models import AwsDetails
+        self.assertEqual(AwsDetails.query.count(), 4)
+
+    # -----------------------------------------------------------------------------
+
+    def test_lookup_users(self):
+
+        created = getSpecificPublicID()
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post("/aws/user", data=json.dumps({"public_id": created}),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+
+        missing = getPublicID()
+        payload = { 'public_ids': [created, missing] }
+        response = self.client.post("/aws/users/lookup", data=json.dumps(payload),
+                                    headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        returned_data = json.loads(response.get_data(as_text=True))
+        self.assertEqual(returned_data['found'], 1)
+        self.assertEqual(returned_data['not_found'], [missing])
+        self.assertIsNone(returned_data['users'][missing])
+        user = returned_data['users'][created]
+        self.assertEqual(user['aws_UserName'], "ze3cf14c3df064360af93b445c3d78d9e")
+        self.assertFalse('aws_SecretAccessKey' in user)
+        self.assertFalse('aws_AccessKeyId' in user)
+
+        # same fields as the single user admin route
+        single = self.client.get("/aws/user/"+created, headers=headers)
+        self.assertEqual(set(json.loads(single.get_data(as_text=True))), set(user))
+
+    # -----------------------------------------------------------------------------
+
+    def test_lookup_users_size_limits(self):
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        payload = { 'public_ids': [getPublicID() for _ in range(501)] }
+        response = self.client.post("/aws/users/lookup", data=json.dumps(payload),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        payload = { 'public_ids': [getPublicID()], 'padding': 'x' * 70000 }
+        response = self.client.post("/aws/users/lookup", data=json.dumps(payload),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 413)
+
+        # chunked, so no content length to check up front
+        import io
+        response = self.client.post("/aws/users/lookup",
+                                    input_stream=io.BytesIO(json.dumps(payload).encode('utf-8')),
+                                    headers=dict(headers, **{ 'Transfer-Encoding': 'chunked' }),
+                                    environ_overrides={ 'wsgi.input_terminated': True })
+        self.assertIsNone(response.request.content_length)
+        self.assertEqual(response.status_code, 413)
+
+        small = json.dumps({ 'public_ids': [getPublicID()] }).encode('utf-8')
+        response = self.client.post("/aws/users/lookup", input_stream=io.BytesIO(small),
+                                    headers=dict(headers, **{ 'Transfer-Encoding': 'chunked' }),
+                                    environ_overrides={ 'wsgi.input_terminated': True })
+        self.assertEqual(response.status_code, 200)
+    # -----------------------------------------------------------------------------
+
+    def test_bulk_create_users_fail_json_schema_check(self):
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post("/aws/users", data=json.dumps({ 'public_ids': [] }),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    # -----------------------------------------------------------------------------
+
+    def test_bulk_create_users_batch_failure_saves_good_rows(self):
+
+        from app.models import AwsDetails
+        from app.main.bulk import provision_users
+        from app.main.create_user import _build_aws_user as real_build
+
+        ids = [getPublicID() for _ in range(3)]
+
+        def build_with_clash(ctx):
+            aws_user = real_build(ctx)
+            if ctx['public_id'] == ids[1]:
+                # clashes with the first user's unique user name
+                aws_user.aws_UserName = 'z'+ids[0].replace('-','')
+            return aws_user
+
+        progress = []
+        with patch('app.main.create_user._build_aws_user', side_effect=build_with_clash):
+            report = provision_users(ids, concurrency=1, batch_size=10,
+                                     progress=lambda done, total: progress.append((done, total)))
+
+        statuses = { r['public_id']: r['status'] for r in report['results'] }
+        self.assertEqual(statuses, { ids[0]: 'created', ids[1]: 'failed', ids[2]: 'created' })
+        self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+        self.assertEqual(AwsDetails.query.count(), 2)
+        users = [u['UserName'] for u in aws_clients.iam.list_users()['Users']]
+        self.assertFalse('z'+ids[1].replace('-','') in users)
+
+    # -----------------------------------------------------------------------------
+
+    def test_provision_users_cli(self):
+
+        ids = [getPublicID() for _ in range(2)]
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['provision-users'] + ids)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertTrue('created 2' in result.output)
+
+    # -----------------------------------------------------------------------------
+
+    def _add_aws_details(self, count):
+        import datetime
+        from app.models import AwsDetails
+        ids = []
+        for i in range(count):
+            public_id = getPublicID()
+            db.session.add(AwsDetails(public_id=public_id,
+                                      aws_UserName='z'+public_id.replace('-',''),
+                                      aws_AccessKeyId='key'+str(i),
+                                      aws_SecretAccessKey='secret'+str(i),
+                                      aws_CreateDate=datetime.datetime(2024, 1, i+1, 12)))
+            ids.append(public_id)
+        db.session.commit()
+        return ids
+
+    # -----------------------------------------------------------------------------
+
+    def test_export_users(self):
+
+        ids = self._add_aws_details(3)
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.get('/aws/users/export', headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row['public_id'] for row in rows], ids)
+        self.assertEqual(rows[0]['aws_CreateDate'], '2024-01-01T12:00:00')
+        self.assertFalse('aws_SecretAccessKey' in rows[0])
+        self.assertFalse('aws_AccessKeyId' in rows[0])
+
+        response = self.client.get('/aws/users/export?since=2024-01-02T12:00:00&secrets=true',
+                                   headers=headers)
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([row['public_id'] for row in rows], ids[1:])
+        self.assertEqual(rows[0]['aws_SecretAccessKey'], 'secret1')
+
+    # -----------------------------------------------------------------------------
+
+    def test_export_users_bad_since(self):
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.get('/aws/users/export?since=yesterday', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    # -----------------------------------------------------------------------------
+
+    def test_export_users_cli(self):
+
+        ids = self._add_aws_details(2)
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['export-users', '--since', '2024-01-02', '--batch-size', '1'])
+        self.assertEqual(result.exit_code, 0, result.stderr)
+        rows = [json.loads(line) for line in result.stdout.splitlines()]
+        self.assertEqual([row['public_id'] for row in rows], ids[1:])
+        self.assertTrue('exported 1 rows' in result.stderr)
+
+    # -----------------------------------------------------------------------------
+
+    def test_metrics(self):
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.post("/aws/user", data=json.dumps({"public_id": getPublicID()}),
+                                    headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.client.get('/aws/admin/ratelimited', headers=headers)
+
+        # prometheus doesn't send json
+        response = self.client.get('/aws/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        text = response.get_data(as_text=True)
+
+        self.assertTrue('http_request_duration_seconds_count{route="/aws/user",method="POST"} 1\n' in text)
+        self.assertTrue('http_requests_total{route="/aws/user",method="POST",status="201"} 1\n' in text)
+        self.assertTrue('ratelimit_rejections_total{route="/aws/admin/ratelimited"} 1\n' in text)
+        self.assertTrue('aws_call_duration_seconds_count{service="iam",operation="CreateUser"} 1\n' in text)
+        self.assertTrue('aws_call_duration_seconds_count{service="s3",operation="CreateBucket"} 1\n' in text)
+        self.assertTrue('db_query_duration_seconds_count{statement="INSERT"}' in text)
+        self.assertTrue('aws_propagation_delay_seconds_count{step="bucket_exists"}' in text)
+
+    # -----------------------------------------------------------------------------
+
+    def test_profiles(self):
+
+        import tempfile
+        from app import profiling
+
+        headers = { 'Content-type': 'application/json', 'x-access-token': 'somefaketoken' }
+        response = self.client.get('/aws/admin/profiles', headers=headers)
+        self.assertEqual(json.loads(response.get_data(as_text=True))['enabled'], False)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.app.config.update(PROFILE_DIR=tmp, PROFILE_SECRET='letmein')
+            profiling.init_app(self.app)
+
+            response = self.client.get('/aws/status',
+                                       headers={ 'Content-type': 'application/json',
+                                                 'X-Profile': 'letmein' })
+            name = response.headers['X-Profile-Id']
+
+            response = self.client.get('/aws/admin/profiles', headers=headers)
+            returned_data = json.loads(response.get_data(as_text=True))
+            self.assertEqual([profile['name'] for profile in returned_data['profiles']], [name])
+
+            response = self.client.get('/aws/admin/profiles/'+name+'?format=text', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue('system_running' in response.get_data(as_text=True))
+
+            response = self.client.get('/aws/admin/profiles/'+name, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/octet-stream')
+            response.close()
+
+            response = self.client.get('/aws/admin/profiles/..%2F..%2Fetc%2Fpasswd', headers=headers)
+            self.assertEqual(response.status_code, 404)
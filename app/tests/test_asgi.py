@@ -0,0 +1,246 @@
+# app/tests/test_asgi.py
+import asyncio
+import json
+import os
+import time
+import uuid
+import httpx
+from unittest import TestCase
+from mock import patch
+from app import create_app, db
+from app.asgi import AsgiApp, build_environ
+from app.config import TestConfig
+from app.services import AsyncHttpClient, HttpClient, CircuitOpenError
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class AsgiConfig(TestConfig):
+    ASGI_THREADS = 2
+    AUTH_CACHE_TTL = 0
+
+
+async def _call(asgi_app, method, path, body=b'', headers=None):
+    # runs one request through the asgi app and returns (status, headers, body).
+    # a list body is sent as chunks
+    chunks = body if isinstance(body, list) else [body]
+    messages = [{ 'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1 }
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else { 'type': 'http.disconnect' }
+
+    async def send(message):
+        sent.append(message)
+
+    scope = { 'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+              'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                          for name, value in (headers or {}).items()],
+              'client': ('10.0.0.1', 5000), 'server': ('testserver', 80) }
+    await asgi_app(scope, receive, send)
+    response_headers = dict(sent[0]['headers'])
+    return sent[0]['status'], response_headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+
+class AsgiTest(TestCase):
+
+    def setUp(self):
+        self.env = patch.dict(os.environ, { 'CHECK_ACCESS_URL': 'http://access.local/check/' })
+        self.env.start()
+        self.app = create_app(AsgiConfig)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.create_all()
+        self.asgi = AsgiApp(self.app)
+        self.checks = []
+
+        async def access_check(flask_app, token, level):
+            self.checks.append(level)
+            await asyncio.sleep(0.2)
+            return (True, str(uuid.uuid4()))
+
+        self.access_patch = patch('app.asgi.cached_access_check_async', access_check)
+        self.access_patch.start()
+
+    def tearDown(self):
+        self.access_patch.stop()
+        self.asgi.executor.shutdown(wait=True)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        self.env.stop()
+
+    # -----------------------------------------------------------------------------
+
+    def test_same_responses_as_wsgi(self):
+        json_headers = { 'Content-Type': 'application/json' }
+        client = self.app.test_client()
+
+        status, headers, body = asyncio.run(_call(self.asgi, 'GET', '/aws/status',
+                                                  headers=json_headers))
+        expected = client.get('/aws/status', headers=json_headers)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), expected.get_json())
+        self.assertEqual(headers[b'content-type'], b'application/json')
+
+        status, _, body = asyncio.run(_call(self.asgi, 'GET', '/aws/status',
+                                            headers={ 'Content-Type': 'text/html' }))
+        self.assertEqual(status, 400)
+
+        status, _, _ = asyncio.run(_call(self.asgi, 'GET', '/aws/nothinghere',
+                                         headers=json_headers))
+        self.assertEqual(status, 404)
+        self.assertEqual(self.checks, [])
+
+        auth_headers = dict(json_headers, **{ 'x-access-token': 'sometoken' })
+        status, _, body = asyncio.run(_call(self.asgi, 'POST', '/aws/urls', b'notjson',
+                                            headers=auth_headers))
+        self.assertEqual(status, 400)
+        status, _, body = asyncio.run(_call(self.asgi, 'GET', '/aws/user', headers=auth_headers))
+        self.assertEqual(status, 404)
+        self.assertEqual(json.loads(body), { 'message': 'Where dey gone' })
+        self.assertEqual(self.checks, [10, 10])
+
+    # -----------------------------------------------------------------------------
+
+    def test_access_checks_wait_without_threads(self):
+        # 40 requests each waiting 0.2s on the access service with 2 threads
+        headers = { 'Content-Type': 'application/json', 'x-access-token': 'sometoken' }
+
+        async def many():
+            return await asyncio.gather(*[_call(self.asgi, 'GET', '/aws/user', headers=headers)
+                                          for _ in range(40)])
+
+        started = time.monotonic()
+        responses = asyncio.run(many())
+        self.assertTrue(time.monotonic() - started < 2.0)
+        self.assertEqual([status for status, _, _ in responses], [404] * 40)
+        self.assertEqual(len(self.checks), 40)
+
+    # -----------------------------------------------------------------------------
+
+    def test_body_over_limit_rejected_unread(self):
+        self.asgi.max_body = 1024
+        headers = { 'Content-Type': 'application/json', 'x-access-token': 'sometoken' }
+        received = []
+
+        async def chunked():
+            # a client streaming a body with no content length
+            async def receive():
+                received.append(1)
+                return { 'type': 'http.request', 'body': b'x' * 512, 'more_body': True }
+            sent = []
+            async def send(message):
+                sent.append(message)
+            scope = { 'type': 'http', 'method': 'POST', 'path': '/aws/urls',
+                      'query_string': b'', 'client': ('10.0.0.1', 5000),
+                      'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                  for name, value in headers.items()] }
+            await self.asgi(scope, receive, send)
+            return sent
+
+        sent = asyncio.run(chunked())
+        self.assertEqual(sent[0]['status'], 413)
+        self.assertEqual(json.loads(sent[1]['body']), { 'message': 'Request body too large' })
+        self.assertEqual(len(received), 3)
+        self.assertEqual(self.checks, [])
+
+        # chunks adding up to the limit still get to flask
+        status, _, _ = asyncio.run(_call(self.asgi, 'POST', '/aws/urls',
+                                         [b'x' * 512, b'x' * 512], headers=headers))
+        self.assertEqual(status, 400)
+        self.assertEqual(self.checks, [10])
+
+    # -----------------------------------------------------------------------------
+
+    def test_build_environ(self):
+        scope = { 'type': 'http', 'method': 'POST', 'path': '/aws/urls',
+                  'query_string': b'a=1', 'client': ('10.0.0.1', 5000),
+                  'headers': [(b'content-type', b'application/json'),
+                              (b'x-access-token', b'abc'),
+                              (b'accept', b'a'), (b'accept', b'b')] }
+        environ = build_environ(scope, b'{}')
+        self.assertEqual(environ['CONTENT_TYPE'], 'application/json')
+        self.assertEqual(environ['CONTENT_LENGTH'], '2')
+        self.assertEqual(environ['HTTP_X_ACCESS_TOKEN'], 'abc')
+        self.assertEqual(environ['HTTP_ACCEPT'], 'a,b')
+        self.assertEqual(environ['QUERY_STRING'], 'a=1')
+        self.assertEqual(environ['REMOTE_ADDR'], '10.0.0.1')
+        self.assertEqual(environ['wsgi.input'].read(), b'{}')
+
+###############################################################################
+
+class AsyncHttpClientTest(TestCase):
+
+    def test_get_keep_alive_chunked_and_breaker(self):
+
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                path = request.split(b' ')[1]
+                if path == b'/chunked':
+                    writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                                 b'5\r\n{"pub\r\nf\r\nlic_id": "abc"}\r\n0\r\n\r\n')
+                elif path == b'/broken':
+                    writer.write(b'HTTP/1.1 503 Unavailable\r\nContent-Length: 0\r\n\r\n')
+                else:
+                    body = b'{"public_id": "abc"}'
+                    writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n' % len(body)
+                                 + body)
+                await writer.drain()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            url = 'http://127.0.0.1:%d' % port
+            client = AsyncHttpClient(HttpClient(failure_threshold=2))
+            try:
+                first = await client.get(url+'/check/10', headers={ 'x-access-token': 't' })
+                second = await client.get(url+'/chunked')
+                broken = [await client.get(url+'/broken') for _ in range(2)]
+                try:
+                    await client.get(url+'/check/10')
+                    open_circuit = False
+                except CircuitOpenError:
+                    open_circuit = True
+                return first, second, broken, open_circuit
+            finally:
+                server.close()
+
+        first, second, broken, open_circuit = asyncio.run(run())
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json(), { 'public_id': 'abc' })
+        self.assertEqual(second.json(), { 'public_id': 'abc' })
+        self.assertEqual([r.status_code for r in broken], [503, 503])
+        self.assertTrue(open_circuit)
+        # every call went down the one kept alive connection
+        self.assertEqual(len(connections), 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_bad_response_counts_as_failure(self):
+
+        async def handle(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'not http at all\r\n\r\n')
+            await writer.drain()
+            writer.close()
+
+        async def run():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            client = AsyncHttpClient(HttpClient(failure_threshold=5))
+            try:
+                with self.assertRaises(httpx.HTTPError):
+                    await client.get('http://127.0.0.1:%d/check/10' % port)
+                return client.breaker.failures
+            finally:
+                await client.aclose()
+                server.close()
+
+        self.assertEqual(asyncio.run(run()), 1)
@@ -0,0 +1,75 @@
+# app/tests/test_assertions.py
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from unittest import TestCase
+from jsonschema.exceptions import ValidationError as JsonValidationError
+from app.assertions import SchemaRegistry, SCHEMA_DIR
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class SchemaRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = SchemaRegistry()
+        self.registry.load()
+
+    def test_all_schemas_compiled(self):
+        self.assertEqual(sorted(self.registry._validators), ['bulk_uuids', 'urls', 'uuid'])
+        self.assertEqual(sorted(self.registry._fast_checks), ['bulk_uuids', 'urls'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_fast_path_agrees_with_full_validator(self):
+        fast_check = self.registry._fast_checks['urls']
+        validator = self.registry._validators['urls']
+        an_id = str(uuid.uuid4())
+        payloads = [
+            { 'objects': [] },
+            { 'objects': [str(uuid.uuid4()) for _ in range(100)] },
+            { 'objects': [str(uuid.uuid4()) for _ in range(101)] },
+            { 'objects': [an_id, an_id] },
+            { 'objects': [an_id.upper()] },
+            { 'objects': [an_id + 'x'] },
+            { 'objects': [1] },
+            { 'objects': an_id },
+            { 'objects': [an_id], 'validjson': 'blah' },
+            { 'objects': [str(uuid.uuid1())] },
+            [an_id],
+        ]
+        for payload in payloads:
+            self.assertEqual(fast_check(payload), validator.is_valid(payload), payload)
+
+    # -----------------------------------------------------------------------------
+
+    def test_error_messages_unchanged(self):
+        with self.assertRaises(JsonValidationError) as ctx:
+            self.registry.validate({ 'public_id': 'not a uuid' }, 'uuid')
+        self.assertEqual(ctx.exception.message, "'not a uuid' is too short")
+
+    # -----------------------------------------------------------------------------
+
+    def test_auto_reload_picks_up_changed_schema(self):
+        schema_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, schema_dir)
+        shutil.copy(os.path.join(SCHEMA_DIR, 'uuid.json'), schema_dir)
+
+        registry = SchemaRegistry(schema_dir)
+        registry.auto_reload = True
+        registry.load()
+        self.assertIsNone(registry.validate({ 'public_id': str(uuid.uuid4()) }, 'uuid'))
+
+        filepath = os.path.join(schema_dir, 'uuid.json')
+        with open(filepath) as f:
+            schema = json.load(f)
+        schema['required'].append('name')
+        with open(filepath, 'w') as f:
+            json.dump(schema, f)
+        os.utime(filepath, (0, 0))
+
+        with self.assertRaises(JsonValidationError):
+            registry.validate({ 'public_id': str(uuid.uuid4()) }, 'uuid')
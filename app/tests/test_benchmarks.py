@@ -0,0 +1,57 @@
+# app/tests/test_benchmarks.py
+import os
+import subprocess
+import sys
+from unittest import TestCase
+from benchmarks.bench_suite import percentile, summarise, compare
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class BenchSuiteTest(TestCase):
+
+    def test_percentiles(self):
+        ordered = [i / 1000.0 for i in range(1, 101)]
+        self.assertEqual(percentile(ordered, 50), 0.05)
+        self.assertEqual(percentile(ordered, 95), 0.095)
+        self.assertEqual(percentile(ordered, 99), 0.099)
+        self.assertEqual(percentile([0.5], 99), 0.5)
+        self.assertEqual(percentile([], 50), 0.0)
+
+        result = summarise([0.2, 0.1, 0.3, 0.4], 2.0)
+        self.assertEqual(result['ops'], 4)
+        self.assertEqual(result['ops_per_sec'], 2.0)
+        self.assertEqual(result['p50'], 0.2)
+
+    # -----------------------------------------------------------------------------
+
+    def test_compare_flags_regressions_past_threshold(self):
+        baseline = { 'urls x1': { 'ops_per_sec': 1000.0, 'p95': 0.001 },
+                     'gone': { 'ops_per_sec': 1.0, 'p95': 1.0 } }
+
+        within = { 'urls x1': { 'ops_per_sec': 900.0, 'p95': 0.0011 },
+                   'new case': { 'ops_per_sec': 1.0, 'p95': 1.0 } }
+        self.assertEqual(compare(within, baseline, 0.15), [])
+
+        slower = { 'urls x1': { 'ops_per_sec': 800.0, 'p95': 0.002 } }
+        regressions = compare(slower, baseline, 0.15)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('urls x1: 800 ops/s'))
+        self.assertEqual(compare(slower, baseline, 1.5), [])
+
+    # -----------------------------------------------------------------------------
+
+    def test_runs_in_a_clean_shell(self):
+        # the suite sets its own aws defaults, nothing should need exporting.
+        # a new interpreter as the app reads its config at import
+        env = { name: value for name, value in os.environ.items()
+                if not name.startswith('AWS_') }
+        finished = subprocess.run([sys.executable, '-m', 'benchmarks.bench_suite',
+                                   '-s', '0', '-k', 'create_aws_user'],
+                                  cwd=ROOT, env=env, capture_output=True, text=True,
+                                  timeout=300)
+        self.assertEqual(finished.returncode, 0, finished.stderr)
+        self.assertTrue('create_aws_user' in finished.stdout)
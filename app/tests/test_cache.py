@@ -0,0 +1,69 @@
+# app/tests/test_cache.py
+from unittest import TestCase
+from mock import patch
+from app.cache import TTLCache
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class TTLCacheTest(TestCase):
+
+    def test_get_and_set(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_least_recently_used_evicted_when_full(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertTrue('c' in cache)
+
+    # -----------------------------------------------------------------------------
+
+    def test_expired_entries_not_returned(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        with patch('app.cache.time.monotonic', return_value=100.0):
+            cache.set('a', 1)
+        with patch('app.cache.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    # -----------------------------------------------------------------------------
+
+    def test_invalidate_and_configure(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.invalidate('a')
+        self.assertFalse('a' in cache)
+        cache.set('b', 2)
+        cache.configure(maxsize=5, ttl=30)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.maxsize, 5)
+
+    # -----------------------------------------------------------------------------
+
+    def test_weigher_tracks_bytes_held(self):
+        cache = TTLCache(maxsize=2, ttl=60, weigher=len)
+        cache.set('a', b'xxxx')
+        cache.set('b', b'yy')
+        self.assertEqual(cache.stats()['bytes'], 6)
+        cache.set('a', b'x')
+        self.assertEqual(cache.stats()['bytes'], 3)
+        cache.set('c', b'zzz')
+        self.assertEqual(cache.stats()['bytes'], 4)
+        cache.invalidate('a')
+        self.assertEqual(cache.stats()['bytes'], 3)
+        cache.get('c')
+        cache.get('a')
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
@@ -0,0 +1,94 @@
+# app/tests/test_clients.py
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from mock import patch
+from app.clients import AwsClients, AwsClientError
+from benchmarks.bench_coldstart import measure, over_budget, base_env
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class AwsClientsTest(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def factory(service):
+            self.calls.append(service)
+            time.sleep(0.01)
+            return object(), None
+
+        self.clients = AwsClients(factory)
+
+    def test_built_on_first_use_only(self):
+        self.assertEqual(self.calls, [])
+        s3 = self.clients.s3
+        self.assertTrue(self.clients.s3 is s3)
+        self.assertEqual(self.calls, ['s3'])
+        self.assertEqual(self.clients.built(), ['s3'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_one_client_across_threads(self):
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(self.clients.iam))
+                   for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, ['iam'])
+        self.assertEqual(len(set(id(client) for client in seen)), 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_rebuilt_after_fork_and_reset(self):
+        iam = self.clients.iam
+        with patch('app.clients.os.getpid', return_value=os.getpid() + 1):
+            self.assertFalse(self.clients.iam is iam)
+        self.clients.reset()
+        self.assertEqual(self.clients.built(), [])
+        self.clients.iam
+        self.assertEqual(self.calls, ['iam', 'iam', 'iam'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_failure_raises_and_is_retried(self):
+        results = iter([(None, Exception('no region')), (object(), None)])
+        clients = AwsClients(lambda service: next(results))
+        with self.assertRaises(AwsClientError):
+            clients.get('iam')
+        self.assertEqual(clients.built(), [])
+        self.assertTrue(clients.get('iam') is not None)
+
+    # -----------------------------------------------------------------------------
+
+    def test_warm_up(self):
+        self.clients.warmup = ['iam', 's3']
+        self.clients.warm_up()
+        self.assertEqual(self.clients.built(), ['iam', 's3'])
+
+        failing = AwsClients(lambda service: (None, Exception('nope')))
+        failing.warm_up(['iam'])
+        self.assertEqual(failing.built(), [])
+
+# -----------------------------------------------------------------------------
+
+class ColdStartTest(TestCase):
+
+    def test_status_route_does_not_load_boto3(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            result = measure(dict(base_env(tmp), AWS_CLIENT_WARMUP=''))
+        self.assertEqual(result['status'], 200)
+        self.assertFalse(result['boto3'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_over_budget(self):
+        results = { 'lazy': { 'total_ms': 900.0 }, 'warm': { 'total_ms': 1200.0 } }
+        self.assertEqual(over_budget(results, 1000), ['warm: 1200 ms, budget 1000 ms'])
+        self.assertEqual(over_budget(results, 2000), [])
@@ -0,0 +1,177 @@
+# app/tests/test_db.py
+import datetime
+import os
+import tempfile
+import uuid
+from unittest import TestCase
+from unittest.mock import patch
+from sqlalchemy import event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from .fixtures import getPublicID
+from app import create_app, db
+from app.config import TestConfig, engine_options
+from app.extensions import details_cache
+from app.instrumentation import TimedQueuePool, db_pool_wait, db_pool_timeouts
+from app import instrumentation
+from app.models import AwsDetails
+from app.main.create_user import get_presign_credentials
+from app.main.details import get_details_json
+from app.crypto import cipher_suite
+from flask_testing import TestCase as FlaskTestCase
+
+DB_PATH = os.path.join(tempfile.gettempdir(), 'poptape_aws_pool_%s.db' % uuid.uuid4().hex)
+
+class PoolConfig(TestConfig):
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + DB_PATH
+    SQLALCHEMY_ENGINE_OPTIONS = { 'pool_size': 1, 'max_overflow': 0,
+                                  'pool_timeout': 0.05, 'pool_pre_ping': True }
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class EngineOptionsTest(TestCase):
+
+    def test_sqlite_keeps_defaults(self):
+        self.assertEqual(engine_options('sqlite:///:memory:'), {})
+        self.assertEqual(instrumentation.engine_options({}), {})
+
+    # -----------------------------------------------------------------------------
+
+    def test_postgres_pool_from_env(self):
+        with patch.dict(os.environ, { 'DB_POOL_SIZE': '3', 'DB_MAX_OVERFLOW': '2',
+                                      'DB_POOL_TIMEOUT': '1.5', 'DB_POOL_RECYCLE': '60',
+                                      'DB_POOL_PRE_PING': 'False' }):
+            options = engine_options('postgresql+psycopg2://user:pw@localhost/aws')
+        self.assertEqual(options, { 'pool_size': 3, 'max_overflow': 2, 'pool_timeout': 1.5,
+                                    'pool_recycle': 60, 'pool_pre_ping': False })
+
+        with patch.dict(os.environ, {}):
+            for name in ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT',
+                         'DB_POOL_RECYCLE', 'DB_POOL_PRE_PING'):
+                os.environ.pop(name, None)
+            options = engine_options('postgresql+psycopg2://user:pw@localhost/aws')
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['pool_recycle'], 1800)
+
+        timed = instrumentation.engine_options(options)
+        self.assertTrue(timed['poolclass'] is TimedQueuePool)
+        self.assertFalse('poolclass' in options)
+
+# -----------------------------------------------------------------------------
+
+class PoolTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(PoolConfig)
+
+    def setUp(self):
+        db_pool_wait.reset()
+        db_pool_timeouts.reset()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        if os.path.exists(DB_PATH):
+            os.remove(DB_PATH)
+
+    # -----------------------------------------------------------------------------
+
+    def test_checkout_wait_recorded(self):
+        self.assertTrue(isinstance(db.engine.pool, TimedQueuePool))
+        db.session.execute(text('SELECT 1'))
+        db.session.remove()
+        self.assertEqual(db_pool_wait.snapshot()[()]['count'], 1)
+
+        response = self.client.get('/aws/metrics')
+        self.assertTrue('db_pool_checkout_wait_seconds_count 1' in
+                        response.get_data(as_text=True))
+
+    # -----------------------------------------------------------------------------
+
+    def test_checkout_timeout_counted(self):
+        held = db.engine.connect()
+        try:
+            with self.assertRaises(PoolTimeoutError):
+                db.engine.connect()
+        finally:
+            held.close()
+        self.assertEqual(db_pool_timeouts.snapshot(), { (): 1 })
+        self.assertEqual(db_pool_wait.snapshot()[()]['count'], 2)
+
+    # -----------------------------------------------------------------------------
+
+    def test_stale_connection_replaced(self):
+        db.session.execute(text('SELECT 1'))
+        db.session.remove()
+        stale = db.engine.pool.checkedin()
+        self.assertEqual(stale, 1)
+
+        # as if postgres restarted while the connection sat in the pool
+        with patch.object(db.engine.dialect, 'do_ping', side_effect=[False, True]) as ping:
+            self.assertEqual(db.session.execute(text('SELECT 1')).scalar(), 1)
+        self.assertTrue(ping.called)
+
+# -----------------------------------------------------------------------------
+
+class ProjectionTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+        details_cache.clear()
+        suite = cipher_suite(self.app.config)
+        self.public_id = getPublicID()
+        db.session.add(AwsDetails(
+            public_id=self.public_id, aws_UserName='z'+self.public_id.replace('-', ''),
+            aws_AccessKeyId=suite.encrypt(b'AKIATEST').decode('utf-8'),
+            aws_SecretAccessKey=suite.encrypt(b'secret').decode('utf-8'),
+            aws_CreateDate=datetime.datetime(2024, 1, 1)))
+        db.session.commit()
+        db.session.remove()
+
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self._capture)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self._capture)
+        details_cache.clear()
+        db.session.remove()
+        db.drop_all()
+
+    def _capture(self, connection, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    # -----------------------------------------------------------------------------
+
+    def test_admin_view_never_reads_key_pair(self):
+        self.assertTrue(get_details_json(self.public_id, 'admin'))
+        self.assertEqual(len(self.statements), 1)
+        self.assertFalse('aws_SecretAccessKey' in self.statements[0])
+        self.assertFalse('aws_AccessKeyId' in self.statements[0])
+
+        # the owner view still needs its own read
+        self.assertTrue(b'aws_SecretAccessKey' in get_details_json(self.public_id, 'owner'))
+        self.assertEqual(len(self.statements), 2)
+
+    # -----------------------------------------------------------------------------
+
+    def test_owner_view_fills_admin_view(self):
+        self.assertTrue(get_details_json(self.public_id, 'owner'))
+        admin = get_details_json(self.public_id, 'admin')
+        self.assertEqual(len(self.statements), 1)
+        self.assertFalse(b'aws_SecretAccessKey' in admin)
+        self.assertTrue(get_details_json(getPublicID(), 'admin') is None)
+
+    # -----------------------------------------------------------------------------
+
+    def test_presign_reads_only_key_pair(self):
+        credentials = get_presign_credentials(self.public_id)
+        self.assertEqual(credentials.access_key_id, 'AKIATEST')
+        self.assertEqual(len(self.statements), 1)
+        selected = self.statements[0].split('FROM')[0]
+        self.assertTrue('aws_SecretAccessKey' in selected)
+        self.assertFalse('aws_UserName' in selected)
+        self.assertFalse('aws_Arn' in selected)
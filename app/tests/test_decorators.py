@@ -0,0 +1,88 @@
+# app/tests/test_decorators.py
+import time
+from mock import patch, MagicMock
+from flask_testing import TestCase as FlaskTestCase
+from app import create_app
+from app.config import TestConfig
+from app.extensions import access_cache
+from app.decorators import _cached_access_check
+
+URL = 'http://access/check/10'
+HEADERS = { 'Content-Type': 'application/json', 'x-access-token': 'sometoken' }
+
+def _response(status_code, json_data=None):
+    resp = MagicMock()
+    resp.status_code = status_code
+    resp.json.return_value = json_data or {}
+    return resp
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class AccessCacheTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def test_positive_result_cached(self):
+        with patch('app.decorators.call_requests',
+                   return_value=_response(200, { 'public_id': 'abc' })) as mock_get:
+            self.assertEqual(_cached_access_check('sometoken', 10, URL, HEADERS), (True, 'abc'))
+            self.assertEqual(_cached_access_check('sometoken', 10, URL, HEADERS), (True, 'abc'))
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual(access_cache.stats()['hits'], 1)
+        self.assertEqual(access_cache.stats()['misses'], 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_access_level_part_of_key(self):
+        with patch('app.decorators.call_requests',
+                   return_value=_response(200, { 'public_id': 'abc' })) as mock_get:
+            _cached_access_check('sometoken', 10, URL, HEADERS)
+            _cached_access_check('sometoken', 5, URL, HEADERS)
+        self.assertEqual(mock_get.call_count, 2)
+
+    # -----------------------------------------------------------------------------
+
+    def test_negative_result_cached_briefly(self):
+        with patch('app.decorators.call_requests',
+                   return_value=_response(401)) as mock_get:
+            self.assertEqual(_cached_access_check('badtoken', 10, URL, HEADERS), (False, None))
+            self.assertEqual(_cached_access_check('badtoken', 10, URL, HEADERS), (False, None))
+        self.assertEqual(mock_get.call_count, 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_connection_errors_not_cached(self):
+        with patch('app.decorators.call_requests', side_effect=Exception('boom')) as mock_get:
+            self.assertIsNone(_cached_access_check('sometoken', 10, URL, HEADERS))
+            self.assertIsNone(_cached_access_check('sometoken', 10, URL, HEADERS))
+        self.assertEqual(mock_get.call_count, 2)
+
+    # -----------------------------------------------------------------------------
+
+    def test_stale_entry_served_while_revalidating(self):
+        self.app.config['AUTH_CACHE_TTL'] = 1
+        self.app.config['AUTH_CACHE_STALE_TTL'] = 60
+        with patch('app.decorators.call_requests',
+                   return_value=_response(200, { 'public_id': 'abc' })):
+            _cached_access_check('sometoken', 10, URL, HEADERS)
+
+        with patch('app.decorators.time.monotonic', return_value=time.monotonic() + 5), \
+             patch('app.decorators.call_requests',
+                   return_value=_response(200, { 'public_id': 'xyz' })) as mock_get:
+            self.assertEqual(_cached_access_check('sometoken', 10, URL, HEADERS), (True, 'abc'))
+            for _ in range(50):
+                if mock_get.called:
+                    break
+                time.sleep(0.01) # pragma: no cover
+        self.assertEqual(mock_get.call_count, 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_server_errors_not_cached(self):
+        with patch('app.decorators.call_requests', return_value=_response(502)) as mock_get:
+            self.assertIsNone(_cached_access_check('sometoken', 10, URL, HEADERS))
+            self.assertIsNone(_cached_access_check('sometoken', 10, URL, HEADERS))
+        self.assertEqual(mock_get.call_count, 2)
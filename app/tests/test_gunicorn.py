@@ -0,0 +1,75 @@
+# app/tests/test_gunicorn.py
+import os
+import runpy
+from unittest import TestCase
+from mock import patch, MagicMock
+from moto import mock_aws
+from app import create_app, after_fork
+from app.config import TestConfig
+from app.extensions import credential_cache, aws_clients
+
+CONF_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'gunicorn.conf.py')
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class GunicornConfTest(TestCase):
+
+    def _load(self, **env):
+        names = [name for name in os.environ if name.startswith('GUNICORN_')]
+        with patch.dict(os.environ, env):
+            for name in names:
+                if name not in env:
+                    del os.environ[name]
+            return runpy.run_path(CONF_PATH)
+
+    def test_defaults(self):
+        conf = self._load()
+        self.assertEqual(conf['worker_class'], 'sync')
+        self.assertEqual(conf['wsgi_app'], 'aws:app')
+        self.assertEqual(conf['bind'], '0.0.0.0:8040')
+        self.assertFalse(conf['preload_app'])
+        self.assertTrue(conf['workers'] >= 3)
+
+    # -----------------------------------------------------------------------------
+
+    def test_from_env(self):
+        conf = self._load(GUNICORN_WORKER_CLASS='asgi', GUNICORN_WORKERS='4',
+                          GUNICORN_PRELOAD='True', GUNICORN_MAX_REQUESTS='1000')
+        self.assertEqual(conf['wsgi_app'], 'asgi:app')
+        self.assertEqual(conf['workers'], 4)
+        self.assertEqual(conf['max_requests'], 1000)
+        self.assertTrue(conf['preload_app'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_post_fork_only_with_preload(self):
+        conf = self._load()
+        server = MagicMock()
+        worker = MagicMock()
+        flask_app = object()
+        worker.app.wsgi.return_value = MagicMock(flask_app=flask_app)
+        with patch('app.after_fork') as mock_after_fork:
+            server.cfg.preload_app = False
+            conf['post_fork'](server, worker)
+            mock_after_fork.assert_not_called()
+            server.cfg.preload_app = True
+            conf['post_fork'](server, worker)
+            mock_after_fork.assert_called_once_with(flask_app)
+
+# -----------------------------------------------------------------------------
+
+@mock_aws
+class AfterForkTest(TestCase):
+
+    def test_rebuilds_clients_and_pool(self):
+        app = create_app(TestConfig)
+        iam = aws_clients.iam
+        credential_cache.set('somekey', 'somevalue')
+        with patch('sqlalchemy.engine.Engine.dispose') as mock_dispose:
+            after_fork(app)
+            mock_dispose.assert_called_once_with(close=False)
+        self.assertEqual(aws_clients.built(), [])
+        self.assertFalse(aws_clients.iam is iam)
+        self.assertEqual(credential_cache.get('somekey'), None)
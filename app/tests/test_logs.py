@@ -0,0 +1,132 @@
+# app/tests/test_logs.py
+import glob
+import json
+import logging
+import os
+import sys
+import tempfile
+from unittest import TestCase
+from flask import Flask
+from app.config import TestConfig
+from app.logs import BoundedQueueHandler, ModuleLevelFilter, JsonFormatter, \
+                     SharedRotatingFileHandler, LogPipeline, parse_levels, dropped_records
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+def _record(message, level=logging.INFO, pathname='/srv/app/main/views.py', name='app',
+            exc_info=None):
+    return logging.LogRecord(name, level, pathname, 10, message, None, exc_info)
+
+
+class LogsTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        dropped_records.reset()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # -----------------------------------------------------------------------------
+
+    def test_full_queue_drops_and_counts(self):
+        handler = BoundedQueueHandler(maxsize=2)
+        for i in range(5):
+            handler.handle(_record('message %s', logging.WARNING))
+        self.assertEqual(handler.queue.qsize(), 2)
+        self.assertEqual(dropped_records.snapshot(), { 'WARNING': 3 })
+
+        handler = BoundedQueueHandler(maxsize=1, policy='block', timeout=0.01)
+        handler.handle(_record('first'))
+        handler.handle(_record('second'))
+        self.assertEqual(handler.queue.get_nowait().getMessage(), 'first')
+        self.assertEqual(dropped_records.snapshot(), { 'WARNING': 3, 'INFO': 1 })
+
+    # -----------------------------------------------------------------------------
+
+    def test_records_are_rendered_before_queueing(self):
+        handler = BoundedQueueHandler()
+        values = ['before']
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = logging.LogRecord('app', logging.ERROR, __file__, 1, 'value %s',
+                                       (values,), sys.exc_info())
+        handler.handle(record)
+        values[0] = 'after'
+
+        queued = handler.queue.get_nowait()
+        self.assertEqual(queued.getMessage(), "value ['before']")
+        self.assertIsNone(queued.exc_info)
+        self.assertTrue('ValueError: boom' in queued.exc_text)
+
+        entry = json.loads(JsonFormatter().format(queued))
+        self.assertEqual(entry['message'], "value ['before']")
+        self.assertEqual(entry['level'], 'ERROR')
+        self.assertTrue('ValueError: boom' in entry['exception'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_module_levels(self):
+        levels = parse_levels('app.main=WARNING, app.main.views=DEBUG,botocore=ERROR,bad=NOPE')
+        self.assertEqual(levels['bad'], logging.CRITICAL)
+        level_filter = ModuleLevelFilter(levels, logging.INFO, 'app', '/srv/app')
+
+        self.assertTrue(level_filter.filter(_record('x', logging.DEBUG)))
+        self.assertFalse(level_filter.filter(_record('x', logging.INFO,
+                                                     '/srv/app/main/create_user.py')))
+        self.assertFalse(level_filter.filter(_record('x', logging.DEBUG, '/srv/app/cache.py')))
+        self.assertTrue(level_filter.filter(_record('x', logging.INFO, '/srv/app/cache.py')))
+        self.assertFalse(level_filter.filter(_record('x', logging.WARNING, '/lib/botocore/hooks.py',
+                                                     'botocore.hooks')))
+
+    # -----------------------------------------------------------------------------
+
+    def test_rotation_shared_between_writers(self):
+        filename = os.path.join(self.tmp.name, 'shared.log')
+        # two handlers on one file behave like two workers
+        writers = [SharedRotatingFileHandler(filename, maxBytes=200, backupCount=50)
+                   for _ in range(2)]
+        for i in range(40):
+            writers[i % 2].handle(_record('line %02d' % i))
+        for writer in writers:
+            writer.close()
+
+        lines = []
+        for path in glob.glob(filename + '*'):
+            if not path.endswith('.lock'):
+                with open(path) as log_file:
+                    lines.extend(log_file.read().splitlines())
+                self.assertTrue(os.path.getsize(path) <= 200)
+        self.assertEqual(sorted(lines), ['line %02d' % i for i in range(40)])
+
+    # -----------------------------------------------------------------------------
+
+    def test_pipeline_writes_json_through_listener(self):
+        filename = os.path.join(self.tmp.name, 'app.log')
+
+        class LogConfig(TestConfig):
+            LOG_FILENAME = filename
+            LOG_LEVEL = 'INFO'
+            LOG_LEVELS = 'app.tests=WARNING,poptape.bench=DEBUG'
+            LOG_FORMAT = 'json'
+
+        app = Flask('app', root_path=os.path.dirname(os.path.dirname(__file__)))
+        app.config.from_object(LogConfig)
+        pipeline = LogPipeline()
+        pipeline.init_app(app)
+        try:
+            app.logger.info('kept')
+            app.logger.warning('also kept')
+            app.logger.debug('below LOG_LEVEL')
+            logging.getLogger('poptape.bench').debug('library debug')
+        finally:
+            pipeline.stop()
+
+        with open(filename) as log_file:
+            entries = [json.loads(line) for line in log_file]
+        self.assertEqual([entry['message'] for entry in entries],
+                         ['also kept', 'library debug'])
+        self.assertFalse(pipeline.handler in app.logger.handlers)
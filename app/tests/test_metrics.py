@@ -0,0 +1,70 @@
+# app/tests/test_metrics.py
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+from app.metrics import Histogram, Counter, MetricsRegistry
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class MetricsRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.latency = self.registry.register(Histogram('latency_seconds', 'how long',
+                                                        buckets=(0.1, 1.0),
+                                                        labels=('route', 'method')))
+        self.errors = self.registry.register(Counter('errors_total', 'how many',
+                                                     labels=('code',)))
+
+    # -----------------------------------------------------------------------------
+
+    def test_render_prometheus_text(self):
+        self.latency.observe(('/aws/user', 'GET'), 0.05)
+        self.latency.observe(('/aws/user', 'GET'), 0.5)
+        self.errors.inc('Throttling')
+        self.errors.inc('say "hi"\n', 2)
+
+        text = self.registry.render()
+
+        self.assertTrue('# TYPE latency_seconds histogram\n' in text)
+        self.assertTrue('latency_seconds_bucket{route="/aws/user",method="GET",le="0.1"} 1\n' in text)
+        self.assertTrue('latency_seconds_bucket{route="/aws/user",method="GET",le="1.0"} 2\n' in text)
+        self.assertTrue('latency_seconds_bucket{route="/aws/user",method="GET",le="+Inf"} 2\n' in text)
+        self.assertTrue('latency_seconds_sum{route="/aws/user",method="GET"} 0.55\n' in text)
+        self.assertTrue('latency_seconds_count{route="/aws/user",method="GET"} 2\n' in text)
+        self.assertTrue('# TYPE errors_total counter\n' in text)
+        self.assertTrue('errors_total{code="Throttling"} 1\n' in text)
+        self.assertTrue('errors_total{code="say \\"hi\\"\\n"} 2\n' in text)
+
+    # -----------------------------------------------------------------------------
+
+    def test_combines_workers_and_keeps_dead_ones(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.registry.directory = tmp
+            self.errors.inc('Throttling')
+
+            # another live worker and one that has gone away
+            other = { 'errors_total': [[['Throttling'], 2]],
+                      'latency_seconds': [[['/aws/user', 'GET'], [1, 0, 0], 0.05, 1]] }
+            with open(os.path.join(tmp, str(os.getppid())+'.json'), 'w') as other_file:
+                json.dump(other, other_file)
+            dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+            dead.wait()
+            with open(os.path.join(tmp, str(dead.pid)+'.json'), 'w') as dead_file:
+                json.dump({ 'errors_total': [[['Throttling'], 4]] }, dead_file)
+
+            text = self.registry.render()
+            self.assertTrue('errors_total{code="Throttling"} 7\n' in text)
+            self.assertTrue('latency_seconds_count{route="/aws/user",method="GET"} 1\n' in text)
+            self.assertFalse(os.path.exists(os.path.join(tmp, str(dead.pid)+'.json')))
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'archive.json')))
+
+            # the dead worker's counts stay in the total
+            self.errors.inc('Throttling')
+            self.assertTrue('errors_total{code="Throttling"} 8\n' in self.registry.render())
@@ -0,0 +1,90 @@
+# app/tests/test_migrations.py
+import os
+import tempfile
+import sqlalchemy as sa
+from unittest import TestCase
+from flask_migrate import upgrade, downgrade
+from .fixtures import getPublicID
+from app import create_app, db
+from app.config import TestConfig
+from app.models import AwsDetails
+
+MIGRATIONS = os.path.join(os.path.dirname(__file__), '..', '..', 'migrations')
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class MigrationsTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+        class MigrationConfig(TestConfig):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(self.tmp.name, 'mig.db')
+
+        self.app = create_app(MigrationConfig)
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.context.pop()
+        self.tmp.cleanup()
+
+    def _unique_columns(self):
+        inspector = sa.inspect(db.engine)
+        return sorted(column for constraint in inspector.get_unique_constraints('aws_details')
+                      for column in constraint['column_names'])
+
+    def test_compact_aws_details_up_and_down(self):
+        public_id = getPublicID()
+        upgrade(directory=MIGRATIONS, revision='a5a0558b8ed5')
+        with db.engine.begin() as connection:
+            connection.execute(sa.text(
+                "INSERT INTO aws_details (public_id, \"aws_AccessKeyId\", "
+                "\"aws_SecretAccessKey\", \"aws_CreateDate\") "
+                "VALUES (:public_id, 'a', 'b', '2024-01-01 00:00:00')"),
+                { 'public_id': public_id })
+        self.assertEqual(len(self._unique_columns()), 5)
+
+        upgrade(directory=MIGRATIONS)
+        self.assertEqual(self._unique_columns(), ['aws_Arn', 'aws_UserId', 'aws_UserName'])
+        row = db.session.get(AwsDetails, public_id)
+        self.assertEqual(row.public_id, public_id)
+        db.session.remove()
+
+        downgrade(directory=MIGRATIONS, revision='a5a0558b8ed5')
+        self.assertEqual(len(self._unique_columns()), 5)
+        with db.engine.connect() as connection:
+            self.assertEqual(connection.execute(sa.text(
+                'SELECT public_id FROM aws_details')).scalar(), public_id)
+
+    # -----------------------------------------------------------------------------
+
+    def test_current_step_widened(self):
+        upgrade(directory=MIGRATIONS)
+        columns = { column['name']: column['type']
+                    for column in sa.inspect(db.engine).get_columns('provisioning_jobs') }
+        self.assertTrue(isinstance(columns['current_step'], sa.Text))
+
+        downgrade(directory=MIGRATIONS, revision='4cdeb6579e3b')
+        columns = { column['name']: column['type']
+                    for column in sa.inspect(db.engine).get_columns('provisioning_jobs') }
+        self.assertEqual(columns['current_step'].length, 50)
+
+    # -----------------------------------------------------------------------------
+
+    def test_bulk_jobs_up_and_down(self):
+        upgrade(directory=MIGRATIONS)
+        columns = { column['name']: column
+                    for column in sa.inspect(db.engine).get_columns('provisioning_jobs') }
+        self.assertTrue(columns['public_id']['nullable'])
+        self.assertTrue('result' in columns)
+
+        downgrade(directory=MIGRATIONS, revision='9b2e61f0c4d7')
+        columns = { column['name']: column
+                    for column in sa.inspect(db.engine).get_columns('provisioning_jobs') }
+        self.assertFalse(columns['public_id']['nullable'])
+        self.assertFalse('result' in columns)
@@ -0,0 +1,59 @@
+# app/tests/test_policies.py
+import json
+from unittest import TestCase
+from app.policies import PolicyTemplate, PolicyTemplates, PolicyError
+
+ARN = 'arn:aws:iam::123456789012:user/zabc'
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class PolicyTemplateTest(TestCase):
+
+    def setUp(self):
+        self.templates = PolicyTemplates()
+        self.templates.load()
+
+    def test_all_shipped_templates_load(self):
+        self.assertEqual(self.templates._errors, {})
+        self.assertEqual(self.templates.get('bucket_policy').arguments,
+                         { 'resource_name', 'principal_arn' })
+        self.assertEqual(self.templates.get('v2bucket_policy').arguments, { 'resource_name' })
+
+    # -----------------------------------------------------------------------------
+
+    def test_render_matches_old_string_replace(self):
+        with open(self.templates.template_dir + '/bucket_policy.txt') as f:
+            text = f.read()
+        expected = json.loads(text.replace('XXXXXX', 'zabc').replace('AAAAAA', ARN))
+        rendered = self.templates.get('bucket_policy').render(limit='bucket',
+                                                              resource_name='zabc',
+                                                              principal_arn=ARN)
+        self.assertEqual(json.loads(rendered), expected)
+
+    # -----------------------------------------------------------------------------
+
+    def test_values_cannot_break_out_of_strings(self):
+        rendered = self.templates.get('standardpolicy').render(resource_name='a"}],"x":"y')
+        document = json.loads(rendered)
+        self.assertEqual(document['Statement'][1]['Resource'], ['arn:aws:s3:::a"}],"x":"y'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_missing_argument_and_size_limit(self):
+        template = self.templates.get('bucket_policy')
+        with self.assertRaises(PolicyError):
+            template.render(resource_name='zabc')
+        with self.assertRaises(PolicyError):
+            self.templates.get('standardpolicy').render(limit='iam_user', resource_name='z'*2048)
+
+    # -----------------------------------------------------------------------------
+
+    def test_invalid_templates_rejected(self):
+        with self.assertRaises(PolicyError):
+            PolicyTemplate('bad', '{ Version":"2012-10-17" }')
+        with self.assertRaises(PolicyError):
+            PolicyTemplate('bad', '{"Version":"2012-10-17","Statement":[{"Effect":"Alow","Action":"s3:*"}]}')
+        with self.assertRaises(PolicyError):
+            self.templates.get('nothere')
@@ -0,0 +1,63 @@
+# app/tests/test_profiling.py
+import os
+import tempfile
+from unittest import TestCase
+from mock import patch
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+from app.profiling import ProfilingMiddleware, list_profiles, profile_text
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+def _wsgi_app(environ, start_response):
+    sum(range(1000))
+    return Response('ok')(environ, start_response)
+
+
+class ProfilingMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _client(self, **kwargs):
+        return Client(ProfilingMiddleware(_wsgi_app, self.tmp.name, header='X-Profile',
+                                          secret='letmein', **kwargs))
+
+    # -----------------------------------------------------------------------------
+
+    def test_profiles_only_with_the_secret(self):
+        client = self._client()
+        self.assertFalse('X-Profile-Id' in client.get('/aws/urls').headers)
+        self.assertFalse('X-Profile-Id' in client.get('/aws/urls',
+                                                      headers={ 'X-Profile': 'guess' }).headers)
+        self.assertEqual(list_profiles(self.tmp.name), [])
+
+        response = client.get('/aws/urls', headers={ 'X-Profile': 'letmein' })
+        self.assertEqual(response.get_data(as_text=True), 'ok')
+        name = response.headers['X-Profile-Id']
+        self.assertTrue(name.endswith('-GET-aws_urls.prof'))
+        self.assertEqual([profile['name'] for profile in list_profiles(self.tmp.name)], [name])
+        self.assertTrue('_wsgi_app' in profile_text(os.path.join(self.tmp.name, name)))
+
+    # -----------------------------------------------------------------------------
+
+    def test_sampling_and_pruning(self):
+        client = self._client(sample_rate=0.5, keep=2)
+        with patch('app.profiling.random.random', side_effect=[0.9, 0.1, 0.1, 0.1]):
+            ids = [client.get('/aws/status').headers.get('X-Profile-Id') for _ in range(4)]
+        self.assertIsNone(ids[0])
+        self.assertEqual(len(list_profiles(self.tmp.name)), 2)
+
+    # -----------------------------------------------------------------------------
+
+    def test_one_profile_at_a_time(self):
+        middleware = ProfilingMiddleware(_wsgi_app, self.tmp.name, sample_rate=1.0)
+        middleware._busy.acquire()
+        response = Client(middleware).get('/aws/status')
+        self.assertFalse('X-Profile-Id' in response.headers)
+        self.assertEqual(list_profiles(self.tmp.name), [])
@@ -0,0 +1,148 @@
+# app/tests/test_ratelimit.py
+import gc
+import multiprocessing
+import os
+import tempfile
+import threading
+from unittest import TestCase
+from mock import patch
+from limits import parse, strategies
+from limits.storage import storage_from_string
+from app import ratelimit
+from app.ratelimit import SharedMemoryStorage
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+def _hammer(uri, count):
+    storage = storage_from_string(uri)
+    for _ in range(count):
+        storage.incr('shared', 60)
+
+
+class SharedMemoryStorageTest(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.uri = 'mmap://' + os.path.join(self.tmp.name, 'ratelimit.bin') + '?slots=1024&stripes=8'
+        self.storage = storage_from_string(self.uri)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    # -----------------------------------------------------------------------------
+
+    def test_registered_for_mmap_scheme(self):
+        self.assertIsInstance(self.storage, SharedMemoryStorage)
+        self.assertEqual(self.storage.slots, 1024)
+        self.assertTrue(self.storage.check())
+
+    # -----------------------------------------------------------------------------
+
+    def test_incr_and_expiry(self):
+        with patch('app.ratelimit.time.time', return_value=1000.0):
+            self.assertEqual(self.storage.incr('a', 10), 1)
+            self.assertEqual(self.storage.incr('a', 10, amount=2), 3)
+            self.assertEqual(self.storage.get_expiry('a'), 1010.0)
+            self.assertEqual(self.storage.decr('a'), 2)
+        with patch('app.ratelimit.time.time', return_value=1010.0):
+            self.assertEqual(self.storage.get('a'), 0)
+            self.assertEqual(self.storage.incr('a', 10), 1)
+            self.assertEqual(self.storage.get_expiry('a'), 1020.0)
+            self.storage.clear('a')
+            self.assertEqual(self.storage.get('a'), 0)
+
+    # -----------------------------------------------------------------------------
+
+    def test_counters_shared_between_instances(self):
+        # as they would be between gunicorn workers
+        other = storage_from_string(self.uri)
+        self.storage.incr('a', 60)
+        other.incr('a', 60)
+        self.assertEqual(self.storage.get('a'), 2)
+        self.assertEqual(self.storage.reset(), 1)
+        self.assertEqual(other.get('a'), 0)
+
+    # -----------------------------------------------------------------------------
+
+    def test_no_lost_updates_across_processes_and_threads(self):
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_hammer, args=(self.uri, 200)) for _ in range(4)]
+        threads = [threading.Thread(target=_hammer, args=(self.uri, 200)) for _ in range(2)]
+        for worker in processes + threads:
+            worker.start()
+        for worker in processes + threads:
+            worker.join()
+        self.assertEqual(self.storage.get('shared'), 1200)
+
+    # -----------------------------------------------------------------------------
+
+    def test_full_table_reuses_slots(self):
+        storage = storage_from_string(self.uri.split('?')[0] + '.small?slots=4&stripes=1')
+        with patch('app.ratelimit.time.time', return_value=1000.0):
+            for i in range(10):
+                storage.incr('key'+str(i), 60 + i)
+            # the newest keys are always there, older ones have been pushed out
+            self.assertEqual(storage.get('key9'), 1)
+            self.assertEqual(sum(storage.get('key'+str(i)) for i in range(10)), 4)
+
+    # -----------------------------------------------------------------------------
+
+    def test_layout_change_starts_empty(self):
+        self.storage.incr('a', 60)
+        resized = storage_from_string(self.uri.replace('slots=1024', 'slots=2048'))
+        self.assertEqual(resized.get('a'), 0)
+        self.assertEqual(os.path.getsize(resized.path), resized.size)
+        # workers still on the old layout keep their file and their counts
+        self.assertNotEqual(resized.path, self.storage.path)
+        self.assertEqual(os.path.getsize(self.storage.path), self.storage.size)
+        self.assertEqual(self.storage.get('a'), 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_foreign_file_left_alone(self):
+        with open(self.storage.path, 'r+b') as f:
+            f.write(b'junk')
+        with self.assertRaises(ValueError):
+            storage_from_string(self.uri)
+        with open(self.storage.path, 'rb') as f:
+            self.assertEqual(f.read(4), b'junk')
+
+    # -----------------------------------------------------------------------------
+
+    def test_one_fork_hook_for_live_instances(self):
+        gc.collect()
+        live = len(ratelimit._instances)
+        other = storage_from_string(self.uri)
+        self.assertEqual(len(ratelimit._instances), live + 1)
+        del other
+        gc.collect()
+        self.assertEqual(len(ratelimit._instances), live)
+        with patch.object(SharedMemoryStorage, '_after_fork') as after_fork:
+            ratelimit._after_fork_all()
+        self.assertEqual(after_fork.call_count, live)
+
+    # -----------------------------------------------------------------------------
+
+    def test_sliding_window_counter(self):
+        with patch('app.ratelimit.time.time', return_value=6000.0):
+            self.assertEqual([self.storage.acquire_sliding_window_entry('user', 3, 60)
+                              for _ in range(4)], [True, True, True, False])
+        # half way through the next window half the previous count still counts
+        with patch('app.ratelimit.time.time', return_value=6090.0):
+            self.assertEqual(self.storage.get_sliding_window('user', 60), (3, 30.0, 0, 90.0))
+            self.assertEqual([self.storage.acquire_sliding_window_entry('user', 3, 60)
+                              for _ in range(3)], [True, True, False])
+            self.storage.clear_sliding_window('user', 60)
+            self.assertEqual(self.storage.get_sliding_window('user', 60), (0, 0.0, 0, 90.0))
+
+    # -----------------------------------------------------------------------------
+
+    def test_with_limits_strategies(self):
+        limit = parse('2/minute')
+        for strategy in (strategies.FixedWindowRateLimiter,
+                         strategies.SlidingWindowCounterRateLimiter):
+            limiter = strategy(self.storage)
+            self.assertEqual([limiter.hit(limit, strategy.__name__) for _ in range(3)],
+                             [True, True, False])
@@ -0,0 +1,90 @@
+# app/tests/test_readiness.py
+import boto3
+from botocore.exceptions import ClientError
+from unittest import TestCase
+from mock import patch
+from moto import mock_aws
+from app.main.readiness import poll_until, wait_for_bucket, ReadinessTimeout
+from app.main.readiness import wait_for_public_access_block_removed, propagation_delays
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class PollUntilTest(TestCase):
+
+    def setUp(self):
+        propagation_delays.reset()
+
+    def test_backs_off_until_ready(self):
+        results = iter([False, False, False, True])
+        with patch('app.main.readiness.time.sleep') as mock_sleep:
+            poll_until('thing', lambda: next(results), timeout=10,
+                       initial_delay=0.1, max_delay=0.3)
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list], [0.1, 0.2, 0.3])
+        self.assertEqual(propagation_delays.snapshot()['thing']['count'], 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_no_wait_when_already_ready(self):
+        with patch('app.main.readiness.time.sleep') as mock_sleep:
+            waited = poll_until('thing', lambda: True)
+        mock_sleep.assert_not_called()
+        self.assertTrue(waited < 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_times_out(self):
+        with self.assertRaises(ReadinessTimeout):
+            poll_until('thing', lambda: False, timeout=0.05, initial_delay=0.01)
+        self.assertFalse('thing' in propagation_delays.snapshot())
+
+# -----------------------------------------------------------------------------
+
+@mock_aws
+class AwsReadinessTest(TestCase):
+
+    def setUp(self):
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+
+    def test_wait_for_bucket(self):
+        self.s3.create_bucket(Bucket='zreadiness')
+        self.assertTrue(wait_for_bucket(self.s3, 'zreadiness') < 1)
+        with self.assertRaises(ReadinessTimeout):
+            wait_for_bucket(self.s3, 'znotthere', timeout=0.05, initial_delay=0.01)
+
+    # -----------------------------------------------------------------------------
+
+    def test_wait_for_public_access_block_removed(self):
+        self.s3.create_bucket(Bucket='zreadiness')
+        self.s3.put_public_access_block(Bucket='zreadiness',
+                                        PublicAccessBlockConfiguration={ 'BlockPublicPolicy': True })
+        with self.assertRaises(ReadinessTimeout):
+            wait_for_public_access_block_removed(self.s3, 'zreadiness', '123456789012',
+                                                 timeout=0.05, initial_delay=0.01)
+        self.s3.delete_public_access_block(Bucket='zreadiness')
+        self.assertTrue(wait_for_public_access_block_removed(self.s3, 'zreadiness',
+                                                             '123456789012') < 1)
+
+    # -----------------------------------------------------------------------------
+
+    def test_public_access_block_permanent_errors_raised(self):
+
+        def error(code):
+            return ClientError({ 'Error': { 'Code': code, 'Message': code } },
+                               'GetPublicAccessBlock')
+
+        # a transient error is polled through
+        with patch.object(self.s3, 'get_public_access_block',
+                          side_effect=[error('SlowDown'),
+                                       error('NoSuchPublicAccessBlockConfiguration')]), \
+             patch('app.main.readiness.time.sleep'):
+            wait_for_public_access_block_removed(self.s3, 'zreadiness', '123456789012')
+
+        # access denied fails on the first call rather than at the timeout
+        with patch.object(self.s3, 'get_public_access_block',
+                          side_effect=error('AccessDenied')) as mock_get:
+            with self.assertRaises(ClientError):
+                wait_for_public_access_block_removed(self.s3, 'zreadiness', '123456789012',
+                                                     timeout=10)
+        self.assertEqual(mock_get.call_count, 1)
@@ -0,0 +1,237 @@
+# app/tests/test_reconcile.py
+import datetime
+import json
+import os
+import tempfile
+from botocore.exceptions import ClientError, EndpointConnectionError
+from mock import patch
+from moto import mock_aws
+from .fixtures import getPublicID
+from app import create_app, db
+from app.config import TestConfig
+from app.extensions import aws_clients
+from app.models import AwsDetails
+from app.main.create_user import create_aws_user
+from app.checkpoint import load_checkpoint
+from app.main.reconcile import reconcile, public_id_from_name
+from flask_testing import TestCase as FlaskTestCase
+
+def client_error(code, operation):
+    return ClientError({ 'Error': { 'Code': code, 'Message': code } }, operation)
+
+POLICY = json.dumps({ 'Version': '2012-10-17',
+                      'Statement': [{ 'Effect': 'Allow', 'Action': 's3:GetObject',
+                                      'Resource': '*' }] })
+
+###############################################################################
+#                         flask test case instance                            #
+###############################################################################
+
+@mock_aws
+class ReconcileTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def _orphan_user(self, with_bucket=False):
+        public_id = getPublicID()
+        name = 'z'+public_id.replace('-','')
+        aws_clients.iam.create_user(UserName=name)
+        aws_clients.iam.create_access_key(UserName=name)
+        aws_clients.iam.put_user_policy(UserName=name, PolicyName='policy',
+                                     PolicyDocument=POLICY)
+        if with_bucket:
+            aws_clients.s3.create_bucket(Bucket=name)
+        return public_id
+
+    def _row(self, public_id=None):
+        public_id = public_id or getPublicID()
+        db.session.add(AwsDetails(public_id=public_id,
+                                  aws_UserName='z'+public_id.replace('-',''),
+                                  aws_CreateDate=datetime.datetime(2024, 1, 1)))
+        db.session.commit()
+        return public_id
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+    def test_public_id_from_name(self):
+        public_id = getPublicID()
+        self.assertEqual(public_id_from_name('z'+public_id.replace('-','')), public_id)
+        self.assertIsNone(public_id_from_name('admin'))
+        self.assertIsNone(public_id_from_name('zshort'))
+
+    # -----------------------------------------------------------------------------
+
+    def test_report_and_repair(self):
+
+        good = getPublicID()
+        self.assertTrue(create_aws_user(good))
+        orphan = self._orphan_user(with_bucket=True)
+        dangling = self._row()
+        no_bucket = getPublicID()
+        self.assertTrue(create_aws_user(no_bucket))
+        aws_clients.s3.delete_bucket(Bucket='z'+no_bucket.replace('-',''))
+        aws_clients.iam.create_user(UserName='someone-else')
+
+        report = reconcile(grace_seconds=0)
+
+        self.assertEqual([user['public_id'] for user in report['orphan_users']], [orphan])
+        self.assertEqual(len(report['orphan_users'][0]['access_keys']), 1)
+        self.assertEqual([bucket['public_id'] for bucket in report['orphan_buckets']], [orphan])
+        self.assertEqual(report['dangling_rows'], [dangling])
+        self.assertEqual(report['missing_buckets'], [no_bucket])
+        self.assertEqual(report['scanned']['iam_users'], 4)
+        self.assertTrue(all(report['complete'].values()))
+        self.assertFalse('repaired' in report)
+
+        report = reconcile(repair=True, grace_seconds=0)
+        self.assertEqual(report['repaired'], { 'orphan_users': [orphan],
+                                               'orphan_buckets': [orphan],
+                                               'dangling_rows': [dangling] })
+        self.assertEqual(report['errors'], [])
+        self.assertIsNone(db.session.get(AwsDetails, dangling))
+
+        report = reconcile(grace_seconds=0)
+        self.assertEqual(report['orphan_users'], [])
+        self.assertEqual(report['orphan_buckets'], [])
+        self.assertEqual(report['dangling_rows'], [])
+
+    # -----------------------------------------------------------------------------
+
+    def test_grace_period_skips_new_entities(self):
+        self._orphan_user(with_bucket=True)
+        report = reconcile(grace_seconds=3600)
+        self.assertEqual(report['orphan_users'], [])
+        self.assertEqual(report['orphan_buckets'], [])
+
+    # -----------------------------------------------------------------------------
+
+    def test_checkpoint_makes_runs_incremental(self):
+
+        orphans = set(self._orphan_user() for _ in range(5))
+        dangling = set(self._row() for _ in range(3))
+
+        # each scan carries on from its own marker and starts again once it
+        # gets to the end
+        checkpoint = {}
+        found_users = set()
+        found_rows = set()
+        complete = []
+        for _ in range(3):
+            report = reconcile(checkpoint, page_size=2, max_pages=1, grace_seconds=0)
+            self.assertTrue(report['scanned']['iam_users'] <= 2)
+            self.assertTrue(report['scanned']['rows'] <= 2)
+            found_users.update(user['public_id'] for user in report['orphan_users'])
+            found_rows.update(report['dangling_rows'])
+            complete.append((report['complete']['iam_users'], report['complete']['rows']))
+
+        self.assertEqual(found_users, orphans)
+        self.assertEqual(found_rows, dangling)
+        self.assertEqual(complete, [(False, False), (False, True), (True, False)])
+        self.assertEqual(checkpoint['iam_token'], None)
+        self.assertTrue(checkpoint['db_marker'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_entity_errors_reported_not_raised(self):
+
+        orphan = self._orphan_user()
+        gone = self._orphan_user()
+        forbidden = self._row()
+        dangling = self._row()
+
+        real_list_access_keys = aws_clients.iam.list_access_keys
+        real_head_bucket = aws_clients.s3.head_bucket
+
+        def list_access_keys(UserName):
+            if UserName == 'z'+gone.replace('-',''):
+                # deleted between the list and the detail call
+                raise client_error('NoSuchEntity', 'ListAccessKeys')
+            return real_list_access_keys(UserName=UserName)
+
+        def head_bucket(Bucket):
+            if Bucket == 'z'+forbidden.replace('-',''):
+                raise client_error('403', 'HeadBucket')
+            return real_head_bucket(Bucket=Bucket)
+
+        with patch.object(aws_clients.iam, 'list_access_keys', side_effect=list_access_keys), \
+             patch.object(aws_clients.s3, 'head_bucket', side_effect=head_bucket):
+            report = reconcile(grace_seconds=0)
+
+        self.assertEqual([user['public_id'] for user in report['orphan_users']], [orphan])
+        self.assertEqual(report['dangling_rows'], [dangling])
+        self.assertEqual(report['scanned']['rows'], 2)
+        self.assertEqual(len(report['errors']), 1)
+        self.assertTrue(forbidden in report['errors'][0])
+
+    # -----------------------------------------------------------------------------
+
+    def test_repair_carries_on_after_connection_error(self):
+
+        orphans = sorted(self._orphan_user(with_bucket=True) for _ in range(2))
+        unreachable = 'z'+orphans[0].replace('-','')
+        real_delete_user = aws_clients.iam.delete_user
+        real_delete_bucket = aws_clients.s3.delete_bucket
+
+        def delete_user(UserName):
+            if UserName == unreachable:
+                raise EndpointConnectionError(endpoint_url='https://iam.amazonaws.com')
+            return real_delete_user(UserName=UserName)
+
+        def delete_bucket(Bucket):
+            if Bucket == unreachable:
+                raise EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+            return real_delete_bucket(Bucket=Bucket)
+
+        with patch.object(aws_clients.iam, 'delete_user', side_effect=delete_user), \
+             patch.object(aws_clients.s3, 'delete_bucket', side_effect=delete_bucket):
+            report = reconcile(repair=True, grace_seconds=0)
+
+        self.assertEqual(report['repaired']['orphan_users'], [orphans[1]])
+        self.assertEqual(report['repaired']['orphan_buckets'], [orphans[1]])
+        self.assertEqual(len(report['errors']), 2)
+        self.assertTrue(all(unreachable in error for error in report['errors']))
+
+    # -----------------------------------------------------------------------------
+
+    def test_reconcile_cli_keeps_checkpoint_on_failure(self):
+
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint_path = os.path.join(tmp, 'checkpoint.json')
+            runner = self.app.test_cli_runner()
+            with patch('app.main.reconcile._scan_buckets',
+                       side_effect=client_error('Throttling', 'ListBuckets')):
+                result = runner.invoke(args=['reconcile', '--checkpoint', checkpoint_path])
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertTrue(isinstance(result.exception, ClientError))
+            # the iam users scan finished before the failure
+            self.assertTrue('iam_token' in load_checkpoint(checkpoint_path))
+
+    # -----------------------------------------------------------------------------
+
+    def test_reconcile_cli(self):
+
+        orphan = self._orphan_user()
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint_path = os.path.join(tmp, 'checkpoint.json')
+            report_path = os.path.join(tmp, 'report.json')
+            runner = self.app.test_cli_runner()
+            result = runner.invoke(args=['reconcile', '--grace', '0', '--repair',
+                                         '--checkpoint', checkpoint_path,
+                                         '--report', report_path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertTrue('orphan users 1' in result.output)
+            self.assertTrue('repaired 1 users' in result.output)
+            self.assertEqual(load_checkpoint(checkpoint_path)['iam_token'], None)
+            with open(report_path) as report_file:
+                report = json.load(report_file)
+            self.assertEqual(report['repaired']['orphan_users'], [orphan])
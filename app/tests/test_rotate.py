@@ -0,0 +1,122 @@
+# app/tests/test_rotate.py
+import datetime
+import os
+import tempfile
+from cryptography.fernet import Fernet
+from .fixtures import getPublicID
+from app import create_app, db
+from app.config import TestConfig
+from app.crypto import cipher_suite, key_id
+from app.models import AwsDetails
+from app.main.create_user import get_presign_credentials
+from app.checkpoint import load_checkpoint
+from app.main.rotate import rotate_keys
+from flask_testing import TestCase as FlaskTestCase
+
+OLD_KEY = Fernet.generate_key().decode('utf-8')
+NEW_KEY = Fernet.generate_key().decode('utf-8')
+
+class RotateConfig(TestConfig):
+    FERNET_KEY = NEW_KEY
+    FERNET_OLD_KEYS = OLD_KEY
+
+###############################################################################
+#                         flask test case instance                            #
+###############################################################################
+
+class RotateKeysTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(RotateConfig)
+
+    def setUp(self):
+        db.create_all()
+        old = Fernet(OLD_KEY)
+        self.public_ids = sorted(getPublicID() for _ in range(7))
+        for i, public_id in enumerate(self.public_ids):
+            db.session.add(AwsDetails(
+                public_id=public_id,
+                aws_AccessKeyId=old.encrypt(('AKIA%d' % i).encode('utf-8')).decode('utf-8'),
+                aws_SecretAccessKey=old.encrypt(('secret%d' % i).encode('utf-8')).decode('utf-8'),
+                aws_CreateDate=datetime.datetime(2024, 1, 1)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def _on_new_key(self):
+        new = Fernet(NEW_KEY)
+        rows = AwsDetails.query.order_by(AwsDetails.public_id).all()
+        return [(new.decrypt(row.aws_AccessKeyId.encode('utf-8')).decode('utf-8'),
+                 new.decrypt(row.aws_SecretAccessKey.encode('utf-8')).decode('utf-8'))
+                for row in rows]
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+    def test_old_keys_still_decrypt(self):
+        credentials = get_presign_credentials(self.public_ids[0])
+        self.assertEqual(credentials.access_key_id, 'AKIA0')
+        self.assertEqual(credentials.secret_access_key, 'secret0')
+        # new values go on the newest key
+        token = cipher_suite(self.app.config).encrypt(b'x')
+        self.assertEqual(Fernet(NEW_KEY).decrypt(token), b'x')
+
+    # -----------------------------------------------------------------------------
+
+    def test_rotates_every_row_once(self):
+        checkpoint = {}
+        report = rotate_keys(checkpoint, batch_size=3, workers=0)
+        self.assertEqual((report['scanned'], report['rotated'], report['current']), (7, 7, 0))
+        self.assertEqual(report['key_id'], key_id(NEW_KEY))
+        self.assertEqual(self._on_new_key(),
+                         [('AKIA%d' % i, 'secret%d' % i) for i in range(7)])
+        self.assertTrue(checkpoint['complete'])
+
+        # a finished checkpoint starts again and finds nothing to do
+        report = rotate_keys(checkpoint, batch_size=3, workers=0)
+        self.assertEqual((report['scanned'], report['rotated'], report['current']), (7, 0, 7))
+
+    # -----------------------------------------------------------------------------
+
+    def test_resumes_from_checkpoint(self):
+        checkpoint = {}
+
+        def interrupt(checkpoint, report, seconds):
+            raise KeyboardInterrupt()
+
+        with self.assertRaises(KeyboardInterrupt):
+            rotate_keys(checkpoint, batch_size=3, workers=0, progress=interrupt)
+        self.assertEqual(checkpoint['after'], self.public_ids[2])
+        self.assertEqual(checkpoint['rotated'], 3)
+
+        report = rotate_keys(checkpoint, batch_size=3, workers=0)
+        self.assertEqual(report['scanned'], 4)
+        self.assertEqual(checkpoint['rotated'], 7)
+        self.assertEqual(len(self._on_new_key()), 7)
+
+    # -----------------------------------------------------------------------------
+
+    def test_process_pool_and_unreadable_rows(self):
+        AwsDetails.query.filter_by(public_id=self.public_ids[3]).\
+            update({ 'aws_SecretAccessKey': Fernet(Fernet.generate_key()).encrypt(b'x').decode('utf-8') })
+        db.session.commit()
+
+        report = rotate_keys({}, batch_size=4, workers=2)
+        self.assertEqual(report['rotated'], 6)
+        self.assertEqual(report['failed'], [self.public_ids[3]])
+
+    # -----------------------------------------------------------------------------
+
+    def test_rotate_keys_cli(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint_path = os.path.join(tmp, 'checkpoint.json')
+            runner = self.app.test_cli_runner()
+            result = runner.invoke(args=['rotate-keys', '--workers', '0', '--batch-size', '5',
+                                         '--checkpoint', checkpoint_path])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertTrue('re-encrypted 7' in result.output)
+            self.assertTrue('rows/s' in result.output)
+            self.assertTrue(load_checkpoint(checkpoint_path)['complete'])
@@ -0,0 +1,72 @@
+# app/tests/test_services.py
+import time
+import requests
+from unittest import TestCase
+from mock import patch, MagicMock
+from app.services import HttpClient, CircuitBreaker, CircuitOpenError
+
+def _response(status_code):
+    resp = MagicMock()
+    resp.status_code = status_code
+    return resp
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class HttpClientTest(TestCase):
+
+    def setUp(self):
+        self.client = HttpClient(pool_size=2, connect_timeout=1.5, read_timeout=3,
+                                 failure_threshold=2, reset_timeout=30)
+
+    def test_timeouts_passed_to_session(self):
+        with patch.object(requests.Session, 'get', return_value=_response(200)) as mock_get:
+            self.client.get('http://access/check', headers={ 'a': 'b' })
+        mock_get.assert_called_once_with('http://access/check', headers={ 'a': 'b' },
+                                         timeout=(1.5, 3))
+
+    # -----------------------------------------------------------------------------
+
+    def test_session_reused_within_process_and_rebuilt_after_fork(self):
+        session = self.client.session
+        self.assertIs(self.client.session, session)
+        with patch('app.services.os.getpid', return_value=-1):
+            self.assertIsNot(self.client.session, session)
+
+    # -----------------------------------------------------------------------------
+
+    def test_circuit_opens_and_fails_fast(self):
+        with patch.object(requests.Session, 'get',
+                          side_effect=requests.ConnectionError('down')) as mock_get:
+            for _ in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.client.get('http://access/check')
+            with self.assertRaises(CircuitOpenError):
+                self.client.get('http://access/check')
+        self.assertEqual(mock_get.call_count, 2)
+        self.assertEqual(self.client.breaker.state, 'open')
+
+    # -----------------------------------------------------------------------------
+
+    def test_server_errors_count_as_failures(self):
+        with patch.object(requests.Session, 'get', return_value=_response(503)):
+            self.client.get('http://access/check')
+            self.client.get('http://access/check')
+        self.assertEqual(self.client.breaker.state, 'open')
+
+# -----------------------------------------------------------------------------
+
+class CircuitBreakerTest(TestCase):
+
+    def test_half_open_lets_one_call_through(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        with patch('app.services.time.monotonic', return_value=time.monotonic() + 11):
+            self.assertEqual(breaker.state, 'half-open')
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow())
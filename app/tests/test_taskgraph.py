@@ -0,0 +1,125 @@
+# app/tests/test_taskgraph.py
+import threading
+import datetime
+import time
+import sqlalchemy as sa
+from unittest import TestCase
+from .fixtures import getPublicID
+from app import create_app, db
+from app.config import TestConfig
+from app.models import ProvisioningJob
+from app.main.jobs import _update_job
+from app.taskgraph import Step, StepError, StepTimer, run_graph, critical_path
+from flask_testing import TestCase as FlaskTestCase
+
+###############################################################################
+#                                tests                                        #
+###############################################################################
+
+class RunGraphTest(TestCase):
+
+    def test_independent_steps_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=2)
+
+        def meet(ctx):
+            # only returns if both steps are running at the same time
+            barrier.wait()
+            return True
+
+        steps = [Step('a', meet), Step('b', meet),
+                 Step('c', lambda ctx: ctx['a'] and ctx['b'], requires=['a', 'b'])]
+        context = {}
+        self.assertTrue(run_graph(steps, context))
+        self.assertTrue(context['c'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_step_waits_for_requirements(self):
+        order = []
+
+        def record(name, delay=0):
+            def run(ctx):
+                time.sleep(delay)
+                order.append(name)
+            return run
+
+        steps = [Step('slow', record('slow', 0.05)), Step('fast', record('fast')),
+                 Step('after', record('after'), requires=['slow'])]
+        timer = StepTimer()
+        self.assertTrue(run_graph(steps, {}, timer=timer))
+        self.assertEqual(order, ['fast', 'slow', 'after'])
+        self.assertEqual(critical_path(steps, timer), ['slow', 'after'])
+
+    # -----------------------------------------------------------------------------
+
+    def test_failure_rolls_back_completed_steps(self):
+        undone = []
+
+        def fail(ctx):
+            time.sleep(0.02)
+            raise StepError('nope')
+
+        steps = [Step('a', lambda ctx: 1, undo=lambda ctx: undone.append('a')),
+                 Step('b', lambda ctx: 2, requires=['a'], undo=lambda ctx: undone.append('b')),
+                 Step('bad', fail),
+                 Step('never', lambda ctx: undone.append('never!'), requires=['bad'])]
+        timer = StepTimer()
+        self.assertFalse(run_graph(steps, {}, timer=timer))
+        self.assertEqual(undone, ['b', 'a'])
+        self.assertEqual(timer.current, 'bad')
+
+    # -----------------------------------------------------------------------------
+
+    def test_bad_graphs_rejected(self):
+        with self.assertRaises(ValueError):
+            run_graph([Step('a', lambda ctx: 1, requires=['b'])], {})
+        with self.assertRaises(ValueError):
+            run_graph([Step('a', lambda ctx: 1), Step('a', lambda ctx: 1)], {})
+
+# -----------------------------------------------------------------------------
+
+class JobProgressTest(FlaskTestCase):
+
+    def create_app(self):
+        return create_app(TestConfig)
+
+    def setUp(self):
+        db.create_all()
+        # sqlite ignores varchar lengths, postgres doesn't
+        for column in ProvisioningJob.__table__.columns:
+            if isinstance(column.type, sa.String) and column.type.length:
+                for action in ('INSERT', 'UPDATE'):
+                    db.session.execute(sa.text(
+                        "CREATE TRIGGER %s_%s_length BEFORE %s ON provisioning_jobs "
+                        "WHEN length(NEW.%s) > %d BEGIN "
+                        "SELECT RAISE(ABORT, 'value too long for %s'); END" %
+                        (column.name, action.lower(), action, column.name,
+                         column.type.length, column.name)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_concurrent_steps_stored_as_current_step(self):
+        now = datetime.datetime(2024, 1, 1)
+        job = ProvisioningJob(job_id=getPublicID(), public_id=getPublicID(),
+                              status='queued', steps=[], created=now, updated=now)
+        db.session.add(job)
+        db.session.commit()
+
+        names = ['create_access_key', 'put_bucket_cors', 'delete_public_access_block']
+        barrier = threading.Barrier(len(names), timeout=2)
+        stored = []
+
+        def progress(timer):
+            _update_job(job, 'running', timer)
+            stored.append(db.session.execute(sa.text(
+                'SELECT current_step FROM provisioning_jobs')).scalar())
+
+        steps = [Step(name, lambda ctx: barrier.wait()) for name in names]
+        self.assertTrue(run_graph(steps, {}, timer=StepTimer(progress)))
+
+        everything = ', '.join(names)
+        self.assertTrue(len(everything) > 50)
+        self.assertTrue(everything in stored)
@@ -0,0 +1,7 @@
+# asgi.py
+
+from app import create_app
+from app.asgi import AsgiApp
+
+# for gunicorn -k asgi asgi:app - see app/asgi.py
+app = AsgiApp(create_app())
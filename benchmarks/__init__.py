@@ -0,0 +1,2 @@
+# benchmarks for the service's hot paths. run from the repo root, e.g.
+#   python -m benchmarks.bench_presign
@@ -0,0 +1,117 @@
+# benchmarks/bench_coldstart.py
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from cryptography.fernet import Fernet
+
+# -----------------------------------------------------------------------------
+# cold start check: a fresh interpreter imports aws.py (which runs
+# create_app) and serves its first request, /aws/status. every variant is run
+# --runs times and the medians compared with --budget, in ms of wall clock
+# from starting the process to having the response. exits 1 if any variant
+# is over, so it can sit in ci next to the bench_suite regression check
+#
+#   python -m benchmarks.bench_coldstart --budget 3000
+# -----------------------------------------------------------------------------
+
+DEFAULT_BUDGET = float(os.getenv('COLD_START_BUDGET', 3000))
+
+VARIANTS = [
+    ('lazy clients', { 'AWS_CLIENT_WARMUP': '' }),
+    ('warm-up iam,s3', { 'AWS_CLIENT_WARMUP': 'iam,s3' }),
+]
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from aws import app
+imported = time.perf_counter()
+response = app.test_client().get('/aws/status', headers={ 'Content-Type': 'application/json' })
+served = time.perf_counter()
+print(json.dumps({ 'import_ms': (imported - started) * 1000,
+                   'first_request_ms': (served - imported) * 1000,
+                   'status': response.status_code,
+                   'boto3': 'boto3' in sys.modules }))
+"""
+
+# -----------------------------------------------------------------------------
+
+def measure(env):
+    # one cold start in a new process, timed from before the fork
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result['total_ms'] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def median_of(runs):
+    return { 'import_ms': statistics.median(r['import_ms'] for r in runs),
+             'first_request_ms': statistics.median(r['first_request_ms'] for r in runs),
+             'total_ms': statistics.median(r['total_ms'] for r in runs),
+             'boto3': any(r['boto3'] for r in runs) }
+
+
+def over_budget(results, budget_ms):
+    # a line for every variant whose median cold start is over budget
+    return ['%s: %.0f ms, budget %.0f ms' % (name, result['total_ms'], budget_ms)
+            for name, result in sorted(results.items())
+            if result['total_ms'] > budget_ms]
+
+
+def base_env(tmp):
+    env = dict(os.environ)
+    for name, value in (('SQLALCHEMY_DATABASE_URI', 'sqlite:///'+os.path.join(tmp, 'cold.db')),
+                        ('FERNET_KEY', Fernet.generate_key().decode('utf-8')),
+                        ('CHECK_ACCESS_URL', 'http://authy.local/authy/checkaccess/'),
+                        ('AWS_REGION', 'us-east-1'),
+                        ('AWS_ACCESS_KEY_ID', 'testing'),
+                        ('AWS_SECRET_ACCESS_KEY', 'testing')):
+        env.setdefault(name, value)
+    env['LOG_FILENAME'] = ''
+    env['METRICS_DIR'] = ''
+    env['PROFILE_DIR'] = ''
+    return env
+
+# -----------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description='cold start time against a budget')
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='cold starts per variant, the median is used')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='ms allowed from process start to the first response '
+                             '(default %(default)s, or COLD_START_BUDGET)')
+    args = parser.parse_args()
+
+    print("%-16s %10s %12s %10s %7s" % ('variant', 'import ms', 'first req ms',
+                                        'total ms', 'boto3'))
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = base_env(tmp)
+        for name, settings in VARIANTS:
+            results[name] = median_of([measure(dict(env, **settings))
+                                       for _ in range(args.runs)])
+            print("%-16s %10.0f %12.0f %10.0f %7s" % (
+                name, results[name]['import_ms'], results[name]['first_request_ms'],
+                results[name]['total_ms'], 'yes' if results[name]['boto3'] else 'no'))
+            sys.stdout.flush()
+
+    over = over_budget(results, args.budget)
+    if over:
+        print("over the cold start budget:")
+        for line in over:
+            print("  " + line)
+        sys.exit(1)
+    print("all within %.0f ms" % args.budget)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+# benchmarks/bench_db_layout.py
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import time
+import uuid
+import sqlalchemy as sa
+from cryptography.fernet import Fernet
+
+# -----------------------------------------------------------------------------
+# aws_details as it was (varchar(36) key, unique indexes on both ciphertexts)
+# against the compact schema from migration 4cdeb6579e3b. the same rows are
+# inserted into each in batches, as bulk provisioning writes them, then the
+# table and index sizes are read back. runs against a throwaway sqlite file
+# by default, use --database-uri for postgres where the uuid column makes
+# its difference - sqlite has no uuid type and stores 32 hex chars
+#
+#   python -m benchmarks.bench_db_layout --rows 50000
+#   python -m benchmarks.bench_db_layout --database-uri postgresql+psycopg2://...
+# -----------------------------------------------------------------------------
+
+def _table(metadata, name, compact):
+    key = sa.Uuid(as_uuid=False) if compact else sa.String(36)
+    return sa.Table(name, metadata,
+        sa.Column('public_id', key, primary_key=True),
+        sa.Column('aws_CreateUserRequestId', sa.String(64 if compact else 300)),
+        sa.Column('aws_UserId', sa.String(128 if compact else 300), unique=True),
+        sa.Column('aws_UserName', sa.String(64 if compact else 300), unique=True),
+        sa.Column('aws_AccessKeyId', sa.String(200 if compact else 300), unique=not compact),
+        sa.Column('aws_SecretAccessKey', sa.String(200 if compact else 300),
+                  unique=not compact),
+        sa.Column('aws_PolicyName', sa.String(128 if compact else 100)),
+        sa.Column('aws_Arn', sa.String(256 if compact else 500), unique=True),
+        sa.Column('aws_CreateDate', sa.TIMESTAMP(), nullable=False))
+
+
+def make_rows(count):
+    # what provisioning writes for a user, key pair encrypted as it would be
+    fernet = Fernet(Fernet.generate_key())
+    created = datetime.datetime(2024, 1, 1)
+    rows = []
+    for _ in range(count):
+        public_id = str(uuid.uuid4())
+        name = 'z' + public_id.replace('-', '')
+        rows.append({ 'public_id': public_id,
+                      'aws_CreateUserRequestId': str(uuid.uuid4()),
+                      'aws_UserId': 'AIDA' + uuid.uuid4().hex[:17].upper(),
+                      'aws_UserName': name,
+                      'aws_AccessKeyId': fernet.encrypt(os.urandom(10).hex().upper()
+                                                        .encode('utf-8')).decode('utf-8'),
+                      'aws_SecretAccessKey': fernet.encrypt(os.urandom(20).hex()
+                                                            .encode('utf-8')).decode('utf-8'),
+                      'aws_PolicyName': 'poptape_aws_standard_user_policy',
+                      'aws_Arn': 'arn:aws:iam::123456789012:user/' + name,
+                      'aws_CreateDate': created })
+    return rows
+
+
+def insert_rows(engine, table, rows, batch_size):
+    # one transaction per batch, returns rows/s
+    started = time.perf_counter()
+    for i in range(0, len(rows), batch_size):
+        with engine.begin() as connection:
+            connection.execute(table.insert(), rows[i:i+batch_size])
+    return len(rows) / (time.perf_counter() - started)
+
+
+def sizes(engine, table):
+    # (table bytes, index bytes)
+    with engine.connect() as connection:
+        if engine.dialect.name == 'postgresql':
+            connection.execute(sa.text('ANALYZE ' + table.name))
+            return connection.execute(sa.text(
+                "SELECT pg_table_size(:name), pg_indexes_size(:name)"),
+                { 'name': table.name }).one()
+        pages = dict(connection.execute(sa.text(
+            "SELECT name, sum(pgsize) FROM dbstat GROUP BY name")).all())
+        indexes = [row[0] for row in connection.execute(sa.text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name"),
+            { 'name': table.name }).all()]
+        return pages.get(table.name, 0), sum(pages.get(name, 0) for name in indexes)
+
+# -----------------------------------------------------------------------------
+
+def main():
+
+    parser = argparse.ArgumentParser(description='aws_details schema size and insert rate')
+    parser.add_argument('-n', '--rows', type=int, default=20000,
+                        help='rows inserted into each table')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='rows per insert transaction')
+    parser.add_argument('--database-uri',
+                        help='database to run against, defaults to a temporary sqlite file')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = sa.create_engine(args.database_uri or
+                                  'sqlite:///' + os.path.join(tmp, 'schema.db'))
+        metadata = sa.MetaData()
+        tables = [('before', _table(metadata, 'bench_aws_details_before', False)),
+                  ('after', _table(metadata, 'bench_aws_details_after', True))]
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+        try:
+            print("%-8s %10s %12s %12s %12s" % ('schema', 'rows/s', 'table kB',
+                                                'indexes kB', 'total kB'))
+            for name, table in tables:
+                rate = insert_rows(engine, table, rows, args.batch_size)
+                table_bytes, index_bytes = sizes(engine, table)
+                print("%-8s %10.0f %12.0f %12.0f %12.0f" % (
+                    name, rate, table_bytes / 1024.0, index_bytes / 1024.0,
+                    (table_bytes + index_bytes) / 1024.0))
+                sys.stdout.flush()
+        finally:
+            metadata.drop_all(engine)
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
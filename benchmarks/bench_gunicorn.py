@@ -0,0 +1,122 @@
+# benchmarks/bench_gunicorn.py
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import uuid
+from cryptography.fernet import Fernet
+from benchmarks.bench_asgi import _access_service, _create_db, _load, _free_port, \
+                                  _wait_until_up
+
+# -----------------------------------------------------------------------------
+# memory per worker and throughput for each worker class, with and without
+# preload, all started from gunicorn.conf.py the way the Dockerfile does.
+# GET /aws/user against a stub access service taking --latency ms, sqlite for
+# the db. memory is read from /proc after the load run: pss shares pages
+# between the processes using them so it shows what preload saves
+# -----------------------------------------------------------------------------
+
+PROFILES = [
+    ('sync', { 'GUNICORN_WORKER_CLASS': 'sync' }),
+    ('gthread x8', { 'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_THREADS': '8' }),
+    ('asgi', { 'GUNICORN_WORKER_CLASS': 'asgi' }),
+]
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as stat_file:
+                fields = stat_file.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return children
+
+
+def _memory_kb(pid):
+    # rss, pss and private (unshared) memory in kB
+    values = {}
+    with open('/proc/%d/smaps_rollup' % pid) as smaps:
+        for line in smaps:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                values[parts[0][:-1]] = int(parts[1])
+    return (values['Rss'], values['Pss'],
+            values['Private_Clean'] + values['Private_Dirty'])
+
+
+async def _run(args):
+
+    public_id = str(uuid.uuid4())
+    access = await _access_service(args.latency / 1000.0, public_id)
+    access_port = access.sockets[0].getsockname()[1]
+    loop = asyncio.get_running_loop()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   SQLALCHEMY_DATABASE_URI='sqlite:///'+os.path.join(tmp, 'bench.db'),
+                   CHECK_ACCESS_URL='http://127.0.0.1:%d/check/' % access_port,
+                   FERNET_KEY=os.getenv('FERNET_KEY') or Fernet.generate_key().decode('utf-8'),
+                   AUTH_CACHE_TTL='0',
+                   RATELIMIT_ENABLED='False',
+                   LOG_FILENAME='',
+                   AWS_DEFAULT_REGION='us-east-1',
+                   GUNICORN_WORKERS=str(args.workers))
+        _create_db(env, public_id)
+
+        print("%-11s %-8s %9s %9s %9s %11s %9s %9s" % (
+            'worker', 'preload', 'req/s', 'p99 ms', 'errors', 'rss MB/wkr',
+            'pss MB', 'priv MB'))
+        for name, settings in PROFILES:
+            for preload in ('False', 'True'):
+                port = _free_port()
+                server_env = dict(env, GUNICORN_BIND='127.0.0.1:%d' % port,
+                                  GUNICORN_PRELOAD=preload, **settings)
+                server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c',
+                                           'gunicorn.conf.py', '--log-level', 'warning'],
+                                          env=server_env)
+                try:
+                    await loop.run_in_executor(None, _wait_until_up, port)
+                    result, errors = await _load(port, '/aws/user', args.concurrency,
+                                                 args.seconds)
+                    memory = [_memory_kb(pid) for pid in _children(server.pid)]
+                    workers = len(memory) or 1
+                    print("%-11s %-8s %9.0f %9.1f %9d %11.1f %9.1f %9.1f" % (
+                        name, preload, result['ops_per_sec'], result['p99'] * 1000, errors,
+                        sum(m[0] for m in memory) / workers / 1024.0,
+                        sum(m[1] for m in memory) / workers / 1024.0,
+                        sum(m[2] for m in memory) / workers / 1024.0))
+                    sys.stdout.flush()
+                finally:
+                    # quick shutdown, a graceful one waits on idle keep alive
+                    # connections
+                    server.send_signal(signal.SIGINT)
+                    server.wait()
+
+    access.close()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='gunicorn worker class comparison')
+    parser.add_argument('-s', '--seconds', type=float, default=5.0,
+                        help='seconds to run each case for')
+    parser.add_argument('-c', '--concurrency', type=int, default=100,
+                        help='requests kept in flight')
+    parser.add_argument('-w', '--workers', type=int, default=2,
+                        help='gunicorn workers')
+    parser.add_argument('-l', '--latency', type=float, default=50.0,
+                        help='ms the access service takes to answer')
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
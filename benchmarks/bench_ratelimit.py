@@ -0,0 +1,90 @@
+# benchmarks/bench_ratelimit.py
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from limits.storage import storage_from_string
+import app.ratelimit
+
+# -----------------------------------------------------------------------------
+# sliding window checks per second against the shared mmap storage with
+# several processes (like gunicorn workers) and threads hitting it at once.
+# "hot" is every check on one key so they all fight over one stripe lock,
+# "spread" uses lots of keys like real per ip limits. memory:// is the same
+# check against flask-limiter's default per process storage for reference
+# -----------------------------------------------------------------------------
+
+def _checks(uri, keys, threads, seconds, results):
+
+    storage = storage_from_string(uri)
+    counts = [0] * threads
+    start = time.perf_counter() + 0.2
+    deadline = start + seconds
+
+    def run(index):
+        count = 0
+        i = index
+        while time.perf_counter() < start:
+            pass
+        while time.perf_counter() < deadline:
+            try:
+                storage.acquire_sliding_window_entry(keys[i % len(keys)], 1000000, 60)
+                count += 1
+            except RuntimeError:
+                # MemoryStorage can try to start its expiry timer twice when
+                # threads race, which says more about it than about speed
+                pass
+            i += 1
+        counts[index] = count
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    results.put(sum(counts))
+
+
+def _rate(uri, processes, threads, keys, seconds):
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=_checks, args=(uri, keys, threads, seconds, results))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    total = sum(results.get() for _ in workers)
+    for worker in workers:
+        worker.join()
+    return total / seconds
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='rate limit storage contention benchmark')
+    parser.add_argument('-s', '--seconds', type=float, default=2.0,
+                        help='seconds to run each case for')
+    parser.add_argument('-t', '--threads', type=int, default=4,
+                        help='threads per process')
+    parser.add_argument('-p', '--processes', type=int, nargs='+', default=[1, 2, 4, 8],
+                        help='process counts to try')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        mmap_uri = 'mmap://' + os.path.join(tmp, 'ratelimit.bin')
+        cases = [('hot', ['10.0.0.1']),
+                 ('spread', ['10.0.%d.%d' % (i // 256, i % 256) for i in range(10000)])]
+
+        print("%-8s %-10s %10s %14s" % ('keys', 'storage', 'processes', 'checks/s'))
+        for label, keys in cases:
+            rate = _rate('memory://', 1, args.threads, keys, args.seconds)
+            print("%-8s %-10s %10d %14.0f" % (label, 'memory', 1, rate))
+            for processes in args.processes:
+                storage_from_string(mmap_uri).reset()
+                rate = _rate(mmap_uri, processes, args.threads, keys, args.seconds)
+                print("%-8s %-10s %10d %14.0f" % (label, 'mmap', processes, rate))
+
+
+if __name__ == '__main__':
+    main()
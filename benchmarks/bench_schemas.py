@@ -0,0 +1,60 @@
+# benchmarks/bench_schemas.py
+import argparse
+import json
+import os
+import time
+import uuid
+from jsonschema import validate, Draft7Validator
+from app.assertions import SchemaRegistry, SCHEMA_DIR
+
+# -----------------------------------------------------------------------------
+# validations per second for the /aws/urls and /aws/user payloads. "per call"
+# is the old assert_valid_schema - read the file and jsonschema.validate every
+# time - against the compiled registry with and without the fast path
+# -----------------------------------------------------------------------------
+
+def _per_call(data, schema_type):
+    with open(os.path.join(SCHEMA_DIR, schema_type + '.json')) as schema_file:
+        schema = json.loads(schema_file.read())
+    return validate(data, schema, format_checker=Draft7Validator.FORMAT_CHECKER)
+
+
+def _rate(fn, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        fn()
+        count += 1
+    return count / seconds
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='json schema validation benchmark')
+    parser.add_argument('-s', '--seconds', type=float, default=2.0,
+                        help='seconds to run each case for')
+    args = parser.parse_args()
+
+    registry = SchemaRegistry()
+    registry.load()
+    no_fast_path = SchemaRegistry()
+    no_fast_path.load()
+    no_fast_path._fast_checks = {}
+
+    cases = [
+        ('uuid', { 'public_id': str(uuid.uuid4()) }),
+        ('urls x10', { 'objects': [str(uuid.uuid4()) for _ in range(10)] }),
+        ('urls x100', { 'objects': [str(uuid.uuid4()) for _ in range(100)] }),
+    ]
+
+    print("%-10s %14s %14s %14s" % ('payload', 'per call/s', 'compiled/s', 'fast path/s'))
+    for label, data in cases:
+        schema_type = label.split()[0]
+        old = _rate(lambda: _per_call(data, schema_type), args.seconds)
+        compiled = _rate(lambda: no_fast_path.validate(data, schema_type), args.seconds)
+        fast = _rate(lambda: registry.validate(data, schema_type), args.seconds)
+        print("%-10s %14.0f %14.0f %14.0f" % (label, old, compiled, fast))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+# benchmarks/bench_suite.py
+import argparse
+import datetime
+import fnmatch
+import json
+import math
+import os
+import platform
+import sys
+import time
+import uuid
+from unittest import mock
+from cryptography.fernet import Fernet
+
+# -----------------------------------------------------------------------------
+# repeatable timings for the hot paths, run offline against moto and sqlite
+# (or a local postgres with --database-uri). every case is timed op by op and
+# reported as ops/s and p50/p95/p99 latency.
+#
+#   python -m benchmarks.bench_suite --save benchmarks/baseline.json
+#   python -m benchmarks.bench_suite --compare benchmarks/baseline.json
+#
+# --compare exits 1 if any case has lost more than --threshold (default 15%)
+# of its ops/s or its p95 has grown by more than that. baselines are only
+# comparable on the same machine so they aren't checked in
+# -----------------------------------------------------------------------------
+
+# moto and the app both want these before anything is imported
+for name, value in (('AWS_ACCESS_KEY_ID', 'testing'),
+                    ('AWS_SECRET_ACCESS_KEY', 'testing'),
+                    ('AWS_DEFAULT_REGION', 'us-east-1'),
+                    ('AWS_ACCOUNT_ID', '123456789012'),
+                    ('CHECK_ACCESS_URL', 'http://authy.local/authy/checkaccess/'),
+                    ('FERNET_KEY', Fernet.generate_key().decode('utf-8'))):
+    os.environ.setdefault(name, value)
+
+DEFAULT_THRESHOLD = float(os.getenv('BENCH_THRESHOLD', 0.15))
+
+# -----------------------------------------------------------------------------
+
+def percentile(ordered, pct):
+    # nearest rank on an already sorted list
+    if not ordered:
+        return 0.0
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))), 1)
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarise(latencies, elapsed):
+    ordered = sorted(latencies)
+    return { 'ops': len(ordered),
+             'ops_per_sec': len(ordered) / elapsed if elapsed else 0.0,
+             'p50': percentile(ordered, 50),
+             'p95': percentile(ordered, 95),
+             'p99': percentile(ordered, 99) }
+
+
+def compare(results, baseline, threshold):
+    # returns a line for every case that is worse than its baseline by more
+    # than threshold. cases missing from either side are ignored
+    regressions = []
+    for name, result in sorted(results.items()):
+        before = baseline.get(name)
+        if not before:
+            continue
+        if result['ops_per_sec'] < before['ops_per_sec'] * (1 - threshold):
+            regressions.append('%s: %.0f ops/s, baseline %.0f' % (
+                name, result['ops_per_sec'], before['ops_per_sec']))
+        if result['p95'] > before['p95'] * (1 + threshold):
+            regressions.append('%s: p95 %.3f ms, baseline %.3f ms' % (
+                name, result['p95'] * 1000, before['p95'] * 1000))
+    return regressions
+
+
+def time_case(fn, seconds, min_ops=5, warmup=3):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    started = time.perf_counter()
+    deadline = started + seconds
+    while len(latencies) < min_ops or time.perf_counter() < deadline:
+        op_started = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - op_started)
+    return summarise(latencies, time.perf_counter() - started)
+
+# -----------------------------------------------------------------------------
+
+class FakeAccessResponse(object):
+    # what the access service sends back for a valid token
+
+    status_code = 200
+
+    def __init__(self, public_id):
+        self.public_id = public_id
+
+    def json(self):
+        return { 'public_id': self.public_id }
+
+
+def _cases(app, public_id):
+
+    from flask import request
+    from app.assertions import assert_valid_schema
+    from app.decorators import require_access_level
+    from app.extensions import details_cache
+    from app.main.create_user import create_aws_user
+
+    client = app.test_client()
+    headers = { 'Content-type': 'application/json', 'x-access-token': 'benchtoken' }
+
+    def urls(count):
+        payload = json.dumps({ 'objects': [str(uuid.uuid4()) for _ in range(count)] })
+        def run():
+            response = client.post('/aws/urls', data=payload, headers=headers)
+            assert response.status_code == 201, response.get_data(as_text=True)
+        return run
+
+    schema_payload = { 'objects': [str(uuid.uuid4()) for _ in range(10)] }
+
+    @require_access_level(10, request)
+    def protected(pub_id, request):
+        return pub_id
+
+    def access_check(cache_ttl):
+        def run():
+            app.config['AUTH_CACHE_TTL'] = cache_ttl
+            with app.test_request_context('/aws/user', headers=headers):
+                assert protected() == public_id
+        return run
+
+    def create_user():
+        with app.app_context():
+            assert create_aws_user(str(uuid.uuid4()))
+
+    def user_detail(cached):
+        def run():
+            if not cached:
+                details_cache.clear()
+            response = client.get('/aws/user', headers=headers)
+            assert response.status_code == 200
+        return run
+
+    return [('urls x1', urls(1)),
+            ('urls x10', urls(10)),
+            ('urls x100', urls(100)),
+            ('assert_valid_schema', lambda: assert_valid_schema(schema_payload, 'urls')),
+            ('require_access_level', access_check(0)),
+            ('require_access_level cached', access_check(30)),
+            ('create_aws_user', create_user),
+            ('get_user_detail', user_detail(False)),
+            ('get_user_detail cached', user_detail(True))]
+
+
+def run_suite(seconds, patterns=None, database_uri=None):
+
+    from moto import mock_aws
+    from app import create_app, db
+    from app.config import TestConfig
+    from app.main.create_user import create_aws_user
+
+    class BenchConfig(TestConfig):
+        LOG_LEVEL = 'WARNING'
+        RATELIMIT_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = database_uri or TestConfig.SQLALCHEMY_DATABASE_URI
+
+    public_id = str(uuid.uuid4())
+    results = {}
+
+    with mock_aws(), \
+         mock.patch('app.decorators.call_requests',
+                    lambda url, headers: FakeAccessResponse(public_id)), \
+         mock.patch('app.main.readiness.time.sleep', lambda seconds: None):
+
+        app = create_app(BenchConfig)
+        with app.app_context():
+            db.create_all()
+            try:
+                # the user every authenticated request runs as
+                assert create_aws_user(public_id)
+                for name, fn in _cases(app, public_id):
+                    if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+                        continue
+                    results[name] = time_case(fn, seconds)
+                    _print_result(name, results[name])
+            finally:
+                db.session.remove()
+                db.drop_all()
+
+    return results
+
+# -----------------------------------------------------------------------------
+
+def _print_result(name, result):
+    print("%-28s %7d %12.0f %10.3f %10.3f %10.3f" % (
+        name, result['ops'], result['ops_per_sec'],
+        result['p50'] * 1000, result['p95'] * 1000, result['p99'] * 1000))
+    sys.stdout.flush()
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='hot path benchmark suite')
+    parser.add_argument('-s', '--seconds', type=float, default=2.0,
+                        help='seconds to run each case for')
+    parser.add_argument('-k', '--cases', nargs='+',
+                        help='only run cases matching these patterns, e.g. "urls*"')
+    parser.add_argument('--database-uri',
+                        help='database to run against, defaults to in memory sqlite')
+    parser.add_argument('--save', metavar='PATH',
+                        help='write the results to PATH as a baseline')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare against the baseline at PATH, exit 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fraction worse than the baseline that counts as a '
+                             'regression (default %(default)s, or BENCH_THRESHOLD)')
+    args = parser.parse_args()
+
+    print("%-28s %7s %12s %10s %10s %10s" % ('case', 'ops', 'ops/s',
+                                             'p50 ms', 'p95 ms', 'p99 ms'))
+    results = run_suite(args.seconds, args.cases, args.database_uri)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({ 'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                        'python': platform.python_version(),
+                        'machine': platform.platform(),
+                        'results': results }, baseline_file, indent=2, sort_keys=True)
+        print("saved baseline to [%s]" % args.save)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("regressions past %d%%:" % round(args.threshold * 100))
+            for line in regressions:
+                print("  " + line)
+            sys.exit(1)
+        print("no regressions past %d%% against [%s]" % (round(args.threshold * 100),
+                                                          args.compare))
+
+
+if __name__ == '__main__':
+    main()
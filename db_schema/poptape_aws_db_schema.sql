@@ -37,14 +37,14 @@ ALTER TABLE public.alembic_version OWNER TO poptape_aws;
 --
 
 CREATE TABLE public.aws_details (
-    public_id character varying(36) NOT NULL,
-    "aws_CreateUserRequestId" character varying(300),
-    "aws_UserId" character varying(300),
-    "aws_UserName" character varying(300),
-    "aws_AccessKeyId" character varying(300),
-    "aws_SecretAccessKey" character varying(300),
-    "aws_PolicyName" character varying(100),
-    "aws_Arn" character varying(500),
+    public_id uuid NOT NULL,
+    "aws_CreateUserRequestId" character varying(64),
+    "aws_UserId" character varying(128),
+    "aws_UserName" character varying(64),
+    "aws_AccessKeyId" character varying(200),
+    "aws_SecretAccessKey" character varying(200),
+    "aws_PolicyName" character varying(128),
+    "aws_Arn" character varying(256),
     "aws_CreateDate" timestamp without time zone NOT NULL
 );
 
@@ -52,19 +52,31 @@ CREATE TABLE public.aws_details (
 ALTER TABLE public.aws_details OWNER TO poptape_aws;
 
 --
--- Name: alembic_version alembic_version_pkc; Type: CONSTRAINT; Schema: public; Owner: poptape_aws
+-- Name: provisioning_jobs; Type: TABLE; Schema: public; Owner: poptape_aws
 --
 
-ALTER TABLE ONLY public.alembic_version
-    ADD CONSTRAINT alembic_version_pkc PRIMARY KEY (version_num);
+CREATE TABLE public.provisioning_jobs (
+    job_id uuid NOT NULL,
+    public_id uuid,
+    status character varying(20) NOT NULL,
+    current_step text,
+    steps json,
+    total_seconds double precision,
+    error character varying(500),
+    result json,
+    created timestamp without time zone NOT NULL,
+    updated timestamp without time zone NOT NULL
+);
 
 
+ALTER TABLE public.provisioning_jobs OWNER TO poptape_aws;
+
 --
--- Name: aws_details aws_details_aws_AccessKeyId_key; Type: CONSTRAINT; Schema: public; Owner: poptape_aws
+-- Name: alembic_version alembic_version_pkc; Type: CONSTRAINT; Schema: public; Owner: poptape_aws
 --
 
-ALTER TABLE ONLY public.aws_details
-    ADD CONSTRAINT "aws_details_aws_AccessKeyId_key" UNIQUE ("aws_AccessKeyId");
+ALTER TABLE ONLY public.alembic_version
+    ADD CONSTRAINT alembic_version_pkc PRIMARY KEY (version_num);
 
 
 --
@@ -75,14 +87,6 @@ ALTER TABLE ONLY public.aws_details
     ADD CONSTRAINT "aws_details_aws_Arn_key" UNIQUE ("aws_Arn");
 
 
---
--- Name: aws_details aws_details_aws_SecretAccessKey_key; Type: CONSTRAINT; Schema: public; Owner: poptape_aws
---
-
-ALTER TABLE ONLY public.aws_details
-    ADD CONSTRAINT "aws_details_aws_SecretAccessKey_key" UNIQUE ("aws_SecretAccessKey");
-
-
 --
 -- Name: aws_details aws_details_aws_UserId_key; Type: CONSTRAINT; Schema: public; Owner: poptape_aws
 --
@@ -107,6 +111,21 @@ ALTER TABLE ONLY public.aws_details
     ADD CONSTRAINT aws_details_pkey PRIMARY KEY (public_id);
 
 
+--
+-- Name: provisioning_jobs provisioning_jobs_pkey; Type: CONSTRAINT; Schema: public; Owner: poptape_aws
+--
+
+ALTER TABLE ONLY public.provisioning_jobs
+    ADD CONSTRAINT provisioning_jobs_pkey PRIMARY KEY (job_id);
+
+
+--
+-- Name: ix_provisioning_jobs_public_id; Type: INDEX; Schema: public; Owner: poptape_aws
+--
+
+CREATE INDEX ix_provisioning_jobs_public_id ON public.provisioning_jobs USING btree (public_id);
+
+
 --
 -- PostgreSQL database dump complete
 --
@@ -0,0 +1,41 @@
+# gunicorn.conf.py
+import multiprocessing
+import os
+
+# -----------------------------------------------------------------------------
+# production gunicorn settings, all from the environment. gunicorn picks this
+# file up from the working directory, or use gunicorn -c gunicorn.conf.py
+#
+# GUNICORN_WORKER_CLASS is sync, gthread or asgi (which serves asgi:app, see
+# app/asgi.py). with GUNICORN_PRELOAD=True the app is imported once in the
+# master and workers share its memory. the aws clients and db connection pool
+# can't be shared across a fork so post_fork below rebuilds them in each
+# worker
+# -----------------------------------------------------------------------------
+
+def _flag(name, default):
+    return os.getenv(name, default) == 'True'
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8040')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 1000))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 2))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+preload_app = _flag('GUNICORN_PRELOAD', 'False')
+wsgi_app = os.getenv('GUNICORN_APP', 'asgi:app' if worker_class == 'asgi' else 'aws:app')
+
+# -----------------------------------------------------------------------------
+
+def post_fork(server, worker):
+    # without preload each worker imports the app itself after the fork and
+    # there's nothing to redo
+    if not server.cfg.preload_app:
+        return
+    from app import after_fork
+    application = worker.app.wsgi()
+    after_fork(getattr(application, 'flask_app', application))
@@ -0,0 +1,92 @@
+"""compact aws_details
+
+native uuid keys, no unique indexes on the fernet ciphertexts and columns
+sized to what aws actually returns. the encrypted key pair is never queried
+and every encryption uses a random iv, so the two unique indexes on them
+could never catch a duplicate - they only made inserts and the table bigger.
+aws already guarantees access key ids are unique. on postgres public_id and
+job_id become uuid (16 bytes instead of a 37 byte varchar, in the table and
+in every index on them)
+
+Revision ID: 4cdeb6579e3b
+Revises: a5a0558b8ed5
+Create Date: 2026-10-18 09:35:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4cdeb6579e3b'
+down_revision = 'a5a0558b8ed5'
+branch_labels = None
+depends_on = None
+
+# (column, before, after)
+AWS_DETAILS_SIZES = [
+    ('aws_CreateUserRequestId', sa.String(300), sa.String(64)),
+    ('aws_UserId', sa.String(300), sa.String(128)),
+    ('aws_UserName', sa.String(300), sa.String(64)),
+    ('aws_AccessKeyId', sa.String(300), sa.String(200)),
+    ('aws_SecretAccessKey', sa.String(300), sa.String(200)),
+    ('aws_PolicyName', sa.String(100), sa.String(128)),
+    ('aws_Arn', sa.String(500), sa.String(256)),
+]
+
+UUID_COLUMNS = [('aws_details', 'public_id'),
+                ('provisioning_jobs', 'job_id'),
+                ('provisioning_jobs', 'public_id')]
+
+
+def _sqlite():
+    return op.get_bind().dialect.name == 'sqlite'
+
+
+def upgrade():
+    if _sqlite():
+        # sqlite has no uuid type and sqlalchemy keeps them as 32 hex chars
+        for table, column in UUID_COLUMNS:
+            op.execute('UPDATE %s SET %s = replace(%s, \'-\', \'\')' % (table, column, column))
+
+    with op.batch_alter_table('aws_details') as batch_op:
+        batch_op.drop_constraint('aws_details_aws_AccessKeyId_key', type_='unique')
+        batch_op.drop_constraint('aws_details_aws_SecretAccessKey_key', type_='unique')
+        batch_op.alter_column('public_id', existing_type=sa.String(36),
+                              type_=sa.Uuid(as_uuid=False), existing_nullable=False,
+                              postgresql_using='public_id::uuid')
+        for column, before, after in AWS_DETAILS_SIZES:
+            batch_op.alter_column(column, existing_type=before, type_=after,
+                                  existing_nullable=True)
+
+    with op.batch_alter_table('provisioning_jobs') as batch_op:
+        for column in ('job_id', 'public_id'):
+            batch_op.alter_column(column, existing_type=sa.String(36),
+                                  type_=sa.Uuid(as_uuid=False), existing_nullable=False,
+                                  postgresql_using=column+'::uuid')
+
+
+def downgrade():
+    with op.batch_alter_table('provisioning_jobs') as batch_op:
+        for column in ('job_id', 'public_id'):
+            batch_op.alter_column(column, existing_type=sa.Uuid(as_uuid=False),
+                                  type_=sa.String(36), existing_nullable=False,
+                                  postgresql_using=column+'::text')
+
+    with op.batch_alter_table('aws_details') as batch_op:
+        for column, before, after in AWS_DETAILS_SIZES:
+            batch_op.alter_column(column, existing_type=after, type_=before,
+                                  existing_nullable=True)
+        batch_op.alter_column('public_id', existing_type=sa.Uuid(as_uuid=False),
+                              type_=sa.String(36), existing_nullable=False,
+                              postgresql_using='public_id::text')
+        batch_op.create_unique_constraint('aws_details_aws_SecretAccessKey_key',
+                                          ['aws_SecretAccessKey'])
+        batch_op.create_unique_constraint('aws_details_aws_AccessKeyId_key',
+                                          ['aws_AccessKeyId'])
+
+    if _sqlite():
+        for table, column in UUID_COLUMNS:
+            op.execute('UPDATE %s SET %s = substr(%s, 1, 8) || \'-\' || substr(%s, 9, 4) || '
+                       '\'-\' || substr(%s, 13, 4) || \'-\' || substr(%s, 17, 4) || \'-\' || '
+                       'substr(%s, 21)' % ((table, column) + (column,) * 5))
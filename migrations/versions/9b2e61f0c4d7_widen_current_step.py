@@ -0,0 +1,33 @@
+"""widen provisioning_jobs.current_step
+
+provisioning steps run concurrently and current_step holds every running
+step name joined together, which can be longer than the 50 characters it
+had. postgres rejected those progress updates so job progress stopped
+
+Revision ID: 9b2e61f0c4d7
+Revises: 4cdeb6579e3b
+Create Date: 2026-10-18 14:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2e61f0c4d7'
+down_revision = '4cdeb6579e3b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('provisioning_jobs') as batch_op:
+        batch_op.alter_column('current_step', existing_type=sa.String(50),
+                              type_=sa.Text(), existing_nullable=True)
+
+
+def downgrade():
+    op.execute('UPDATE provisioning_jobs SET current_step = substr(current_step, 1, 50)')
+    with op.batch_alter_table('provisioning_jobs') as batch_op:
+        batch_op.alter_column('current_step', existing_type=sa.Text(),
+                              type_=sa.String(50), existing_nullable=True)
@@ -0,0 +1,60 @@
+"""baseline
+
+aws_details and provisioning_jobs as they were in
+db_schema/poptape_aws_db_schema.sql before the compaction. databases created from that dump should be stamped
+with this revision (flask db stamp a5a0558b8ed5) rather than upgraded to it
+
+Revision ID: a5a0558b8ed5
+Revises: 
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5a0558b8ed5'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('aws_details',
+        sa.Column('public_id', sa.String(length=36), nullable=False),
+        sa.Column('aws_CreateUserRequestId', sa.String(length=300), nullable=True),
+        sa.Column('aws_UserId', sa.String(length=300), nullable=True),
+        sa.Column('aws_UserName', sa.String(length=300), nullable=True),
+        sa.Column('aws_AccessKeyId', sa.String(length=300), nullable=True),
+        sa.Column('aws_SecretAccessKey', sa.String(length=300), nullable=True),
+        sa.Column('aws_PolicyName', sa.String(length=100), nullable=True),
+        sa.Column('aws_Arn', sa.String(length=500), nullable=True),
+        sa.Column('aws_CreateDate', sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint('public_id', name='aws_details_pkey'),
+        sa.UniqueConstraint('aws_AccessKeyId', name='aws_details_aws_AccessKeyId_key'),
+        sa.UniqueConstraint('aws_Arn', name='aws_details_aws_Arn_key'),
+        sa.UniqueConstraint('aws_SecretAccessKey', name='aws_details_aws_SecretAccessKey_key'),
+        sa.UniqueConstraint('aws_UserId', name='aws_details_aws_UserId_key'),
+        sa.UniqueConstraint('aws_UserName', name='aws_details_aws_UserName_key')
+    )
+    op.create_table('provisioning_jobs',
+        sa.Column('job_id', sa.String(length=36), nullable=False),
+        sa.Column('public_id', sa.String(length=36), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('current_step', sa.String(length=50), nullable=True),
+        sa.Column('steps', sa.JSON(), nullable=True),
+        sa.Column('total_seconds', sa.Float(), nullable=True),
+        sa.Column('error', sa.String(length=500), nullable=True),
+        sa.Column('created', sa.TIMESTAMP(), nullable=False),
+        sa.Column('updated', sa.TIMESTAMP(), nullable=False),
+        sa.PrimaryKeyConstraint('job_id', name='provisioning_jobs_pkey')
+    )
+    op.create_index('ix_provisioning_jobs_public_id', 'provisioning_jobs', ['public_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_provisioning_jobs_public_id', table_name='provisioning_jobs')
+    op.drop_table('provisioning_jobs')
+    op.drop_table('aws_details')
@@ -0,0 +1,34 @@
+"""bulk provisioning jobs
+
+bulk provisioning runs as a provisioning job. those cover many users so
+public_id is optional, and the per user report goes in result
+
+Revision ID: d41c7e2a9f05
+Revises: 9b2e61f0c4d7
+Create Date: 2026-10-18 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c7e2a9f05'
+down_revision = '9b2e61f0c4d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('provisioning_jobs') as batch_op:
+        batch_op.add_column(sa.Column('result', sa.JSON(), nullable=True))
+        batch_op.alter_column('public_id', existing_type=sa.Uuid(as_uuid=False),
+                              nullable=True)
+
+
+def downgrade():
+    op.execute('DELETE FROM provisioning_jobs WHERE public_id IS NULL')
+    with op.batch_alter_table('provisioning_jobs') as batch_op:
+        batch_op.alter_column('public_id', existing_type=sa.Uuid(as_uuid=False),
+                              nullable=False)
+        batch_op.drop_column('result')